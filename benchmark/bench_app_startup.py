@@ -0,0 +1,101 @@
+"""Cold start and rerun latency of the Streamlit apps, measured with AppTest in a fresh interpreter.
+
+Each app runs in its own subprocess against a copy of the database, with a local OpenAI stub, and
+reports the first run (imports, Grobid client, reference tables), the median of plain reruns and of
+reruns with a document selected. Before the reruns the child waits --think-time seconds, like a
+user reading the first page, which is when the apps warm up their deferred imports. Pass --root to
+measure another checkout, e.g. the previous commit in a `git worktree`, with the same script.
+
+    python -m benchmark.bench_app_startup [--app streamlit_app_b.py] [--reruns 20] [--think-time 2] [--root .]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APPS = ['streamlit_app_b.py', 'streamlit_app_c.py']
+
+
+def measure(app, reruns, think_time):
+    """Runs in the child, with the checkout to measure as working directory."""
+    sys.path.insert(0, os.getcwd())
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    harness = time.perf_counter() - start
+
+    at = AppTest.from_file(os.path.abspath(app), default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    first_run = time.perf_counter() - start
+    time.sleep(think_time)
+
+    def rerun_times():
+        times = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - start)
+        return times
+
+    result = {'app': app, 'harness_import': harness, 'first_run': first_run, 'rerun': rerun_times(),
+              'exceptions': [e.value for e in at.exception]}
+    selectbox = next((s for s in at.selectbox if s.key == 'doc_id_selection'), None)
+    if selectbox is not None and selectbox.options:
+        start = time.perf_counter()
+        selectbox.select_index(0).run()
+        result['select_document'] = time.perf_counter() - start
+        result['rerun_with_document'] = rerun_times()
+    print(json.dumps(result))
+
+
+def run_child(root, app, reruns, think_time, env):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--app', app,
+                             '--reruns', str(reruns), '--think-time', str(think_time)],
+                            cwd=root, env=env, capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(output.stderr[-2000:])
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def ms(seconds):
+    return f"{seconds * 1000:8.1f} ms"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', action='append', help=f"default: {' and '.join(APPS)}")
+    parser.add_argument('--reruns', type=int, default=20)
+    parser.add_argument('--think-time', type=float, default=2.0, help='seconds between the first run and the reruns')
+    parser.add_argument('--root', default='.', help='checkout to measure')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.app[0], args.reruns, args.think_time)
+        sys.exit()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from benchmark.stub_openai import StubOpenAIServer
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'sqlite.db')
+    shutil.copy(os.path.join(args.root, 'resources/sqlite.db'), db_path)
+    with StubOpenAIServer() as server:
+        env = dict(os.environ, SQLITE_DB_PATH=db_path, OPENAI_API_KEY='bench', OPENAI_BASE_URL=server.base_url)
+        for app in args.app or APPS:
+            result = run_child(args.root, app, args.reruns, args.think_time, env)
+            print(f"{app}")
+            print(f"  import AppTest        {ms(result['harness_import'])}")
+            print(f"  first run             {ms(result['first_run'])}")
+            print(f"  rerun (median)        {ms(statistics.median(result['rerun']))}")
+            if 'select_document' in result:
+                print(f"  select a document     {ms(result['select_document'])}")
+                print(f"  rerun with document   {ms(statistics.median(result['rerun_with_document']))}")
+            for exception in result['exceptions']:
+                print(f"  exception: {exception}")
+    shutil.rmtree(workdir)
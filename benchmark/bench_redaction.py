@@ -0,0 +1,76 @@
+"""Compare title/author redaction by one regex per name with the single-pass Redactor.
+
+Uses the papers with the most person names in their TEI (authors and cited authors, as the export
+collects them), then the same texts with the name list repeated to simulate larger author sets.
+
+    python -m benchmark.bench_redaction [--papers 5] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import time
+
+from lxml import etree
+
+import redaction
+import text_extraction
+import util
+
+TEI = {'tei': 'http://www.tei-c.org/ns/1.0'}
+
+
+def load_paper(xml_path, pdf_dir):
+    root = etree.parse(xml_path).getroot()
+    title = ''.join(root.find('.//tei:titleStmt/tei:title', TEI).itertext())
+    names = [' '.join(''.join(part.itertext()) for part in name) for name in root.iterfind('.//tei:persName', TEI)]
+    pdf_path = os.path.join(pdf_dir, os.path.basename(xml_path).replace('.grobid.tei.xml', '.pdf'))
+    text = ''.join(text_extraction.BACKENDS['pymupdf'].extract_pages(pdf_path)).replace('\n', ' ')
+    return text, title, names
+
+
+def sequential(text, title, names):
+    text = util.replace_ignore_case(text, title, '')
+    for name in names:
+        text = util.replace_ignore_case(text, name, ' ')
+    return text
+
+
+def single_pass(text, title, names):
+    return redaction.Redactor([(title, '')] + [(name, ' ') for name in names]).redact(text)
+
+
+def bench(fn, papers, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for paper in papers:
+            fn(*paper)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--xml-dir', default='resources/xml')
+    parser.add_argument('--pdf-dir', default='resources/pdf')
+    parser.add_argument('--papers', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    papers = []
+    for xml_path in glob.glob(os.path.join(args.xml_dir, '*.grobid.tei.xml')):
+        pdf_path = os.path.join(args.pdf_dir, os.path.basename(xml_path).replace('.grobid.tei.xml', '.pdf'))
+        if os.path.exists(pdf_path):
+            papers.append(load_paper(xml_path, args.pdf_dir))
+    papers = sorted(papers, key=lambda p: -len(p[2]))[:args.papers]
+    characters = sum(len(text) for text, _, _ in papers)
+    print(f"{len(papers)} papers, {characters / 1e6:.2f} M chars")
+    print(f"{'names/paper':>12} {'sequential':>12} {'single pass':>12} {'speedup':>8}")
+    for factor in (1, 4, 16):
+        # suffixes keep the repeated names distinct, as a larger author set would be
+        scaled = [(text, title, [f'{name} {n}' if n else name for n in range(factor) for name in names])
+                  for text, title, names in papers]
+        names_per_paper = sum(len(names) for _, _, names in scaled) / len(scaled)
+        slow = bench(sequential, scaled, args.repeat)
+        fast = bench(single_pass, scaled, args.repeat)
+        print(f"{names_per_paper:12.0f} {slow:11.3f}s {fast:11.3f}s {slow / fast:7.1f}x")
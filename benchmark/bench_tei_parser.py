@@ -0,0 +1,52 @@
+"""Compare the BeautifulSoup coordinate/page extraction with the single-pass iterparse parser.
+
+    python -m benchmark.bench_tei_parser [--repeat 3] [--xml-dir resources/xml]
+"""
+import argparse
+import glob
+import os
+import time
+
+from grobid.grobid_processor import GrobidProcessor
+from grobid.tei_parser import parse_tei
+
+
+def bench(fn, texts, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def soup_structure(text):
+    processor = GrobidProcessor(None)
+    return processor.get_coordinates(text), len(processor.get_pages(text))
+
+
+def iterparse_structure(text):
+    boxes = parse_tei(text)
+    return boxes.to_dicts(), len(boxes.page_sizes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--xml-dir', default='resources/xml')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = []
+    for path in sorted(glob.glob(os.path.join(args.xml_dir, '*.grobid.tei.xml'))):
+        with open(path, encoding='utf-8') as f:
+            texts.append(f.read())
+    boxes = sum(len(parse_tei(text)) for text in texts)
+    print(f"{len(texts)} documents, {sum(map(len, texts)) / 1e6:.1f} MB of TEI, {boxes} boxes")
+
+    results = [('beautifulsoup get_coordinates + get_pages', bench(soup_structure, texts, args.repeat)),
+               ('iterparse columnar', bench(parse_tei, texts, args.repeat)),
+               ('iterparse + dict view', bench(iterparse_structure, texts, args.repeat))]
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f"{name:45s} {seconds * 1000:9.1f} ms  {baseline / seconds:5.1f}x")
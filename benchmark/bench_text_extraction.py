@@ -0,0 +1,40 @@
+"""Compare the PyPDF2 and PyMuPDF extraction backends, serial and page-parallel, on the bundled PDFs.
+
+    python -m benchmark.bench_text_extraction [--pdf-dir resources/pdf] [--limit 20]
+"""
+import argparse
+import glob
+import os
+import time
+
+import text_extraction
+
+
+def bench(label, fn, paths):
+    start = time.perf_counter()
+    pages = characters = 0
+    for path in paths:
+        texts = fn(path)
+        pages += len(texts)
+        characters += sum(map(len, texts))
+    seconds = time.perf_counter() - start
+    print(f"{label:32s} {seconds:8.2f} s  {pages / seconds:8.1f} pages/s  {characters / 1e6:6.2f} M chars")
+    return seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf-dir', default='resources/pdf')
+    parser.add_argument('--limit', type=int, default=0, help='only the first N PDFs')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.pdf_dir, '*.pdf')))
+    if args.limit:
+        paths = paths[:args.limit]
+    print(f"{len(paths)} PDFs, {text_extraction.MAX_WORKERS} worker processes")
+
+    for name in text_extraction.BACKENDS:
+        bench(f"{name} serial", lambda path: text_extraction.BACKENDS[name].extract_pages(path), paths)
+        # every document goes through the process pool, to show the cost and gain of splitting
+        bench(f"{name} page-parallel", lambda path: text_extraction.extract_pages(path, name, parallel_min_pages=1),
+              paths)
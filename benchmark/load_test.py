@@ -0,0 +1,244 @@
+"""Rerun latency, SQLite lock waits and memory of the apps under a growing number of concurrent sessions.
+
+Every session is a separate process driving one app with AppTest (AppTest cannot run scripts from
+several threads of one process) against a shared copy of the database and the local Grobid and
+OpenAI stubs. The sessions start their actions at the same moment and then pick random ones with a
+think time in between:
+
+- streamlit_app_b.py: select a document, toggle a highlight, label a variable and apply the AI label
+  (waiting for its background job), plain rerun
+- streamlit_app_c.py: keyword hits and an AI search for a random query, toggle the prefilter, plain rerun;
+  the search only queues its jobs, later reruns show the answers
+
+For each level of --sessions it reports the p50/p95/p99 latency of the reruns, the time spent in
+`begin immediate` waiting for the SQLite write lock (database.write_transaction) and the peak RSS of
+a session and of all sessions together, and writes everything to benchmark/results/load-<time>.json.
+
+    python -m benchmark.load_test [--app b|c|both] [--sessions 1,2,4,8] [--actions 30] [--think-time 0.2]
+                                  [--openai-latency 0.2] [--grobid-latency 0.5]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULTS_DIR = 'benchmark/results'
+APPS = {'b': 'streamlit_app_b.py', 'c': 'streamlit_app_c.py'}
+HIGHLIGHTS = ['Title', 'Person Names', 'Affiliations', 'Head of sections', 'Sentences', 'Paragraphs', 'Notes',
+              'Formulas', 'Figures and tables', 'References citations in text', 'Citations']
+QUERIES = ['unit of analysis', 'sample size', 'longitudinal survey', 'experiment design', 'time interval',
+           'organizations', 'panel data', 'within-subject']
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q * len(values) + .5) - 1))]
+
+
+def session(app, actions, think_time, start_at, seed):
+    """Runs in the child: one user of the app, printing its measurements as a JSON line."""
+    import resource
+
+    from streamlit.testing.v1 import AppTest
+
+    import bootstrap
+    import metrics
+
+    rng = random.Random(seed)
+    _, pdf_dict = bootstrap.get_reference_data()
+    available = {doc_id for doc_id, filename in pdf_dict.items()
+                 if os.path.exists(os.path.join('resources/pdf', filename))}
+    at = AppTest.from_file(os.path.abspath(app), default_timeout=300)
+    start = time.perf_counter()
+    at.run()
+    first_run = time.perf_counter() - start
+    time.sleep(max(0.0, start_at - time.time()))
+
+    def widget(kind, key=None, label=None):
+        return next((w for w in getattr(at, kind) if (key is None or w.key == key)
+                     and (label is None or w.label == label)), None)
+
+    def select_document():
+        selectbox = widget('selectbox', key='doc_id_selection')
+        # documents of the pdf table that are not in resources/pdf would only measure the error path
+        options = [option for option in selectbox.options if option in available] if selectbox else []
+        if not options:
+            return None
+        return selectbox.select(rng.choice(options))
+
+    def toggle(labels):
+        toggles = [t for t in at.toggle if t.label in labels and not t.disabled]
+        if not toggles:
+            return None
+        choice = rng.choice(toggles)
+        return choice.set_value(not choice.value)
+
+    def label():
+        selectbox = widget('selectbox', key='variable_select_box_key')
+        if selectbox is None or not selectbox.options:
+            return None
+        selectbox.select_index(rng.randrange(len(selectbox.options))).run()
+        # the answer comes from a background job, the page is rerun until it is shown
+        deadline = time.time() + 120
+        while widget('button', label='Apply AI variable') is None and at.info and time.time() < deadline:
+            time.sleep(.1)
+            at.run()
+        button = widget('button', label='Apply AI variable')
+        return button.click() if button is not None else None
+
+    def search(button_label):
+        widget('text_input', key='input_query').input(rng.choice(QUERIES))
+        return widget('button', label=button_label).click()
+
+    if app == APPS['b']:
+        choices = [('select_document', select_document, 2), ('toggle_highlight', lambda: toggle(HIGHLIGHTS), 3),
+                   ('label', label, 2), ('rerun', lambda: at, 3)]
+    else:
+        choices = [('keyword_hits', lambda: search('Keyword hits'), 3), ('ai_search', lambda: search('OK'), 1),
+                   ('toggle_prefilter', lambda: toggle(['Prefilter documents with the full-text index']), 1),
+                   ('rerun', lambda: at, 3)]
+
+    latencies, errors = {}, []
+    for _ in range(actions):
+        time.sleep(rng.uniform(0, 2 * think_time))
+        name, action, _ = rng.choices(choices, weights=[weight for _, _, weight in choices])[0]
+        start = time.perf_counter()
+        try:
+            pending = action()
+            if pending is None and app == APPS['b']:
+                # the highlights and the labeling area need a document first
+                name, pending = 'select_document', select_document()
+            if pending is None:
+                name, pending = 'rerun', at
+            pending.run()
+        except Exception as e:
+            errors.append(f'{name}: {type(e).__name__}: {e}')
+            continue
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+        errors += [f'{name}: {e.value}' for e in at.exception]
+
+    lock_waits = metrics.get_metrics().histograms.get(('db_lock_wait_seconds', ()))
+    print(json.dumps({'app': app, 'first_run': first_run, 'latencies': latencies, 'errors': errors,
+                      'lock_wait': {'counts': lock_waits.counts, 'count': lock_waits.count, 'sum': lock_waits.sum,
+                                    'max': lock_waits.max} if lock_waits else None,
+                      # kilobytes on Linux
+                      'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run_level(apps, sessions, args, env):
+    start_at = time.time() + args.startup_seconds
+    children = []
+    for n in range(sessions):
+        app = apps[n % len(apps)]
+        children.append(subprocess.Popen(
+            [sys.executable, '-m', 'benchmark.load_test', '--child', app, '--actions', str(args.actions),
+             '--think-time', str(args.think_time), '--start-at', str(start_at), '--seed', str(args.seed + n)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True))
+    results = []
+    for child in children:
+        stdout, stderr = child.communicate()
+        if child.returncode:
+            results.append({'errors': [f'session exited with {child.returncode}: {stderr[-1000:]}']})
+        else:
+            results.append(json.loads(stdout.strip().splitlines()[-1]))
+    elapsed = time.time() - start_at
+    return summarize(sessions, results, elapsed)
+
+
+def summarize(sessions, results, elapsed):
+    import metrics
+
+    latencies = [t for r in results for times in r.get('latencies', {}).values() for t in times]
+    per_action = {}
+    for r in results:
+        for name, times in r.get('latencies', {}).items():
+            per_action.setdefault(name, []).extend(times)
+    lock_wait = metrics.Histogram()
+    for r in results:
+        if r.get('lock_wait'):
+            lock_wait.counts = [a + b for a, b in zip(lock_wait.counts, r['lock_wait']['counts'])]
+            lock_wait.count += r['lock_wait']['count']
+            lock_wait.sum += r['lock_wait']['sum']
+            lock_wait.max = max(lock_wait.max, r['lock_wait']['max'])
+    rss = [r['max_rss_mb'] for r in results if 'max_rss_mb' in r]
+    return {'sessions': sessions, 'actions': len(latencies), 'elapsed': elapsed,
+            'throughput': len(latencies) / elapsed if elapsed > 0 else None,
+            'p50': percentile(latencies, .5), 'p95': percentile(latencies, .95), 'p99': percentile(latencies, .99),
+            'per_action': {name: {'count': len(times), 'p50': percentile(times, .5), 'p95': percentile(times, .95)}
+                           for name, times in sorted(per_action.items())},
+            'first_run_p50': percentile([r['first_run'] for r in results if 'first_run' in r], .5),
+            'lock_waits': lock_wait.count, 'lock_wait_seconds': lock_wait.sum,
+            'lock_wait_p95': lock_wait.quantile(.95), 'lock_wait_max': lock_wait.max,
+            'max_rss_mb': max(rss, default=None), 'total_rss_mb': sum(rss),
+            'errors': [e for r in results for e in r.get('errors', [])], 'results': results}
+
+
+def ms(seconds):
+    return '       -' if seconds is None else f'{seconds * 1000:8.1f}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', choices=['b', 'c', 'both'], default='both', help='sessions alternate with both')
+    parser.add_argument('--sessions', default='1,2,4,8', help='concurrency levels')
+    parser.add_argument('--actions', type=int, default=30, help='actions per session')
+    parser.add_argument('--think-time', type=float, default=0.2, help='mean seconds between actions')
+    parser.add_argument('--openai-latency', type=float, default=0.2)
+    parser.add_argument('--grobid-latency', type=float, default=0.5)
+    parser.add_argument('--startup-seconds', type=float, default=20.0,
+                        help='time the sessions get for their first run before the actions start together')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help=f'default: {RESULTS_DIR}/load-<time>.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        session(args.child, args.actions, args.think_time, args.start_at, args.seed)
+        sys.exit()
+
+    from benchmark.stub_grobid import StubGrobidServer
+    from benchmark.stub_openai import StubOpenAIServer
+
+    apps = list(APPS.values()) if args.app == 'both' else [APPS[args.app]]
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    levels = []
+    with StubOpenAIServer(latency=args.openai_latency) as openai_stub, \
+            StubGrobidServer(latency=args.grobid_latency) as grobid_stub:
+        print(f"{'sessions':>8s} {'actions':>8s} {'per s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+              f"{'locks':>6s} {'wait p95':>8s} {'wait max':>8s} {'rss MB':>7s} {'all MB':>7s} {'errors':>6s}")
+        for sessions in [int(n) for n in args.sessions.split(',') if n]:
+            # every level starts from the bundled database and an empty document cache
+            level_dir = os.path.join(workdir, str(sessions))
+            os.makedirs(level_dir)
+            shutil.copy('resources/sqlite.db', os.path.join(level_dir, 'sqlite.db'))
+            env = dict(os.environ, SQLITE_DB_PATH=os.path.join(level_dir, 'sqlite.db'),
+                       DOCUMENT_CACHE_DIR=os.path.join(level_dir, 'documents'), METRICS_FLUSH_SECONDS='0',
+                       OPENAI_API_KEY='load-test', OPENAI_BASE_URL=openai_stub.base_url,
+                       GROBID_SERVER=grobid_stub.base_url)
+            level = run_level(apps, sessions, args, env)
+            levels.append(level)
+            print(f"{sessions:8d} {level['actions']:8d} {level['throughput'] or 0:7.1f} {ms(level['p50'])} "
+                  f"{ms(level['p95'])} {ms(level['p99'])} {level['lock_waits']:6d} {ms(level['lock_wait_p95'])} "
+                  f"{ms(level['lock_wait_max'])} {level['max_rss_mb'] or 0:7.0f} {level['total_rss_mb']:7.0f} "
+                  f"{len(level['errors']):6d}")
+            for error in sorted(set(level['errors']))[:5]:
+                print(f"    {error[:200]}")
+
+    report = {'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': sys.version.split()[0],
+              'platform': platform.platform(), 'cpus': os.cpu_count(), 'args': vars(args), 'levels': levels}
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('load-%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"results written to {output}")
+    shutil.rmtree(workdir)
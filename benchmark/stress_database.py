@@ -0,0 +1,121 @@
+"""Several processes writing labels and cache entries to one database while others read it.
+
+Runs against a copy of the app database (or a fresh file) and checks that no write was lost, no
+statement failed with "database is locked" and the file passes an integrity check; exits with
+status 1 when one of the checks fails.
+
+    python -m benchmark.stress_database [--writers 4] [--readers 2] [--batches 200] [--batch-size 25]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+import database
+from response_cache import ResponseCache
+
+VARIABLES = [f'stress_var_{n}' for n in range(8)]
+
+
+def writer(db_path, worker, batches, batch_size, results):
+    cache = ResponseCache(db_path, max_entries=0)
+    latencies, errors = [], 0
+    conn = database.connect(db_path)
+    for batch in range(batches):
+        rows = [(f'stress_{worker}_{batch}_{n}', VARIABLES[n % len(VARIABLES)], str(n), str(n), '', 'stress')
+                for n in range(batch_size)]
+        start = time.perf_counter()
+        try:
+            database.upsert_labels(conn, rows)
+            cache.put(f'stress_{worker}_{batch}', 'response', 'hash', 'model', 'query')
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    results.put(('writer', worker, latencies, errors))
+
+
+def reader(db_path, worker, stop, results):
+    latencies, errors = [], 0
+    conn = database.connect(db_path)
+    n = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            database.labels_of_variable(conn, VARIABLES[n % len(VARIABLES)])
+            database.labels_of_document(conn, f'stress_0_{n}_0')
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        n += 1
+    conn.close()
+    results.put(('reader', worker, latencies, errors))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=database.DB_PATH, help='copied, never written; missing means a fresh file')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=25)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'stress.db')
+    if os.path.exists(args.db):
+        shutil.copy(args.db, db_path)
+    with closing(database.connect(db_path)) as conn:
+        labels_before = conn.execute('select count(*) from label').fetchone()[0]
+
+    context = multiprocessing.get_context('spawn')
+    results, stop = context.Queue(), context.Event()
+    writers = [context.Process(target=writer, args=(db_path, n, args.batches, args.batch_size, results))
+               for n in range(args.writers)]
+    readers = [context.Process(target=reader, args=(db_path, n, stop, results)) for n in range(args.readers)]
+    start = time.perf_counter()
+    for process in readers + writers:
+        process.start()
+    reports = [results.get() for _ in writers]
+    elapsed = time.perf_counter() - start
+    stop.set()
+    reports += [results.get() for _ in readers]
+    for process in readers + writers:
+        process.join()
+
+    with closing(database.connect(db_path)) as conn:
+        labels = conn.execute('select count(*) from label').fetchone()[0] - labels_before
+        integrity = conn.execute('pragma integrity_check').fetchone()[0]
+        journal_mode = conn.execute('pragma journal_mode').fetchone()[0]
+    expected = args.writers * args.batches * args.batch_size
+    failures = []
+    for role in ('writer', 'reader'):
+        latencies = [latency for r, _, values, _ in reports if r == role for latency in values]
+        errors = sum(e for r, _, _, e in reports if r == role)
+        print(f"{role}s: {len(latencies)} transactions, p50 {percentile(latencies, .5) * 1000:.1f} ms, "
+              f"p99 {percentile(latencies, .99) * 1000:.1f} ms, max {max(latencies, default=0) * 1000:.1f} ms, "
+              f"{errors} errors")
+        if errors:
+            failures.append(f"{errors} {role} transactions failed")
+    print(f"{labels}/{expected} label rows written in {elapsed:.1f}s ({labels / elapsed:.0f} rows/s), "
+          f"journal {journal_mode}, integrity {integrity}")
+    shutil.rmtree(workdir)
+    if labels != expected:
+        failures.append(f"{expected - labels} label rows lost")
+    if integrity != 'ok':
+        failures.append(f"integrity check: {integrity}")
+    if journal_mode != 'wal':
+        failures.append(f"journal mode {journal_mode} instead of wal")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
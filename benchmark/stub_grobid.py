@@ -0,0 +1,145 @@
+"""Local stand-in for the Grobid REST API, replaying the TEI recorded for the bundled PDFs.
+
+A posted PDF is matched by content hash to the TEI that Grobid produced from it before, the
+<name>.grobid.tei.xml in the TEI directory for <name>.pdf in the PDF directory, and sent back after
+a configurable latency. PDFs without a recording get a 500, like a document Grobid fails on, and the
+first requests can be answered 503 to exercise the client's retry on a busy server. Point a client
+at it with GrobidClient(grobid_server=server.base_url) or bootstrap.LazyGrobidClient.
+
+    python -m benchmark.stub_grobid --port 8070 --latency 2
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import util
+
+SERVICES = ('processFulltextDocument', 'processHeaderDocument', 'processReferences')
+
+
+def recorded_tei(pdf_dir='resources/pdf', xml_dir='resources/xml'):
+    """{pdf content hash: TEI path} of the PDFs that have a TEI file."""
+    recordings = {}
+    for pdf_path in glob.glob(os.path.join(pdf_dir, '*.pdf')):
+        xml_path = os.path.join(xml_dir, os.path.basename(pdf_path)[:-4] + '.grobid.tei.xml')
+        if os.path.exists(xml_path):
+            recordings[util.get_file_hash(pdf_path)] = xml_path
+    return recordings
+
+
+def uploaded_pdf(content_type, body):
+    """Bytes of the `input` part of a multipart/form-data body, None when there is none."""
+    message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+    if not message.is_multipart():
+        return None
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'input':
+            return part.get_payload(decode=True)
+    return None
+
+
+class StubGrobidServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, pdf_dir='resources/pdf', xml_dir='resources/xml',
+                 fail_first=0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.recordings = recorded_tei(pdf_dir, xml_dir)
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, text, content_type='text/plain'):
+                data = text.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/api/isalive':
+                    return self._send(200, 'true')
+                if self.path.rstrip('/') == '/api/version':
+                    return self._send(200, 'stub')
+                self._send(404, f'unknown path {self.path}')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                service = self.path.rstrip('/').rsplit('/', 1)[-1]
+                if service not in SERVICES:
+                    return self._send(404, f'unknown service {service}')
+                with stub._lock:
+                    stub.requests += 1
+                    busy = stub.requests <= stub.fail_first
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.latency)
+                    if busy:
+                        return self._send(503, 'stub is busy')
+                    pdf = uploaded_pdf(self.headers.get('Content-Type', ''), body)
+                    if pdf is None:
+                        return self._send(400, 'no input pdf')
+                    xml_path = stub.recordings.get(blake2b(pdf).hexdigest())
+                    if xml_path is None:
+                        return self._send(500, 'no recorded TEI for this pdf')
+                    with open(xml_path, encoding='utf-8') as f:
+                        self._send(200, f.read(), 'application/xml')
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8070)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-first', type=int, default=0)
+    parser.add_argument('--pdf-dir', default='resources/pdf')
+    parser.add_argument('--xml-dir', default='resources/xml')
+    args = parser.parse_args()
+    server = StubGrobidServer(port=args.port, latency=args.latency, pdf_dir=args.pdf_dir, xml_dir=args.xml_dir,
+                              fail_first=args.fail_first)
+    print(f"replaying {len(server.recordings)} TEI files on {server.base_url}")
+    server.httpd.serve_forever()
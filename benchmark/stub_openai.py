@@ -0,0 +1,143 @@
+"""Local stand-in for the OpenAI chat completions endpoint.
+
+Answers every request with a canned completion after a configurable latency, streamed as server-sent
+events when the request asks for it, and can fail the first requests with 429/5xx to exercise
+retries. Point the client at it with OPENAI_BASE_URL or ClientManager(base_url=server.base_url).
+
+    python -m benchmark.stub_openai --port 8071 --latency 0.5
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT = '{"result": "1", "confidence level": "high", "evidence": "stub answer"}'
+
+
+class StubOpenAIServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, content=DEFAULT_CONTENT, fail_first=0,
+                 fail_status=429, retry_after=None, stream_chunk=8, stream_delay=0.0):
+        self.latency = latency
+        self.stream_chunk = stream_chunk
+        self.stream_delay = stream_delay
+        self.content = content
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def completion_content(self, body):
+        return self.content(body) if callable(self.content) else self.content
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, body, content, usage):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                base = {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                        'model': body.get('model', 'stub')}
+                pieces = [content[i:i + stub.stream_chunk] for i in range(0, len(content), stub.stream_chunk)]
+                for n, piece in enumerate(pieces):
+                    delta = {'content': piece, **({'role': 'assistant'} if n == 0 else {})}
+                    event = {**base, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+                    self.wfile.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                    time.sleep(stub.stream_delay)
+                final = {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+                self.wfile.write(f'data: {json.dumps(final)}\n\n'.encode('utf-8'))
+                if (body.get('stream_options') or {}).get('include_usage'):
+                    self.wfile.write(f'data: {json.dumps({**base, "choices": [], "usage": usage})}\n\n'.encode('utf-8'))
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not self.path.endswith('/chat/completions'):
+                    return self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+                with stub._lock:
+                    stub.requests.append(body)
+                    fail = len(stub.requests) <= stub.fail_first
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.latency)
+                    if fail:
+                        headers = {'Retry-After': str(stub.retry_after)} if stub.retry_after is not None else {}
+                        return self._send_json(stub.fail_status, {'error': {'message': 'stub failure',
+                                                                            'type': 'rate_limit'}}, headers)
+                    content = stub.completion_content(body)
+                    prompt_tokens = sum(len(m.get('content') or '') for m in body.get('messages', [])) // 4
+                    completion_tokens = max(1, len(content) // 4)
+                    usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                             'total_tokens': prompt_tokens + completion_tokens}
+                    if body.get('stream'):
+                        return self._send_stream(body, content, usage)
+                    self._send_json(200, {
+                        'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()),
+                        'model': body.get('model', 'stub'),
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': content}}],
+                        'usage': usage})
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8071)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--fail-first', type=int, default=0)
+    args = parser.parse_args()
+    server = StubOpenAIServer(port=args.port, latency=args.latency, fail_first=args.fail_first)
+    print(f"serving chat completions on {server.base_url}")
+    server.httpd.serve_forever()
@@ -0,0 +1,201 @@
+"""Timings of the main code paths over the bundled corpus, written as JSON so runs can be compared.
+
+Runs against a scratch database and document cache, with Grobid and OpenAI replaced by the local
+stubs of this package, so it needs no network and leaves the app's data untouched. Each stage runs
+--repeat times and is reported by its best and median time; stages in front of a cache are run once
+cold and then warm. --compare prints the best times of an earlier result file next to this run's.
+
+    python -m benchmark.suite [--limit 20] [--repeat 3] [--label-rows 1000,10000,100000]
+                              [--grobid-latency 0] [--openai-latency 0] [--output FILE] [--compare FILE]
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# read by the app modules when they are imported, so the scratch locations are set before
+WORKDIR = tempfile.mkdtemp(prefix='benchmark-')
+os.environ['SQLITE_DB_PATH'] = os.path.join(WORKDIR, 'sqlite.db')
+os.environ['DOCUMENT_CACHE_DIR'] = os.path.join(WORKDIR, 'documents')
+os.environ['METRICS_FLUSH_SECONDS'] = '0'
+
+import bootstrap
+import content_export
+import database
+import label_export
+import openai_client
+import openai_service
+import util
+from benchmark.stub_grobid import StubGrobidServer
+from benchmark.stub_openai import StubOpenAIServer
+from grobid.annotation_index import AnnotationIndex
+from grobid.grobid_processor import GrobidProcessor
+
+RESULTS_DIR = 'benchmark/results'
+COORDINATES = ["p", "s", "persName", "biblStruct", "figure", "formula", "head", "note", "title", "ref", "affiliation"]
+# the viewer's default toggles hide these, then a page selection and sentences switched off
+HIDDEN_BY_DEFAULT = ['title', 'head', 'biblStruct', 'note', 'ref', 'formula', 'persName', 'affiliation']
+VARIABLES_PER_DOCUMENT = 25
+
+
+class Suite:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, fn, items, repeat=None, **info):
+        """Time fn(item) for every item, repeat times, and record the stage."""
+        times = []
+        try:
+            for _ in range(repeat or self.repeat):
+                start = time.perf_counter()
+                for item in items:
+                    fn(item)
+                times.append(time.perf_counter() - start)
+        except Exception as e:
+            self.results.append({'name': name, 'items': len(items), 'error': f'{type(e).__name__}: {e}', **info})
+            print(f"{name:44s} failed: {type(e).__name__}: {e}")
+            return
+        best = min(times)
+        self.results.append({'name': name, 'items': len(items), 'seconds': times, 'best': best,
+                             'median': statistics.median(times), **info})
+        print(f"{name:44s} {len(items):6d} {best * 1000:10.1f} ms {best / max(len(items), 1) * 1000:9.2f} ms/item")
+
+
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def select_annotations(annotations):
+    index = AnnotationIndex(annotations)
+    index.select_excluding(HIDDEN_BY_DEFAULT)
+    index.select_excluding(HIDDEN_BY_DEFAULT, [1, 2])
+    index.select_excluding(HIDDEN_BY_DEFAULT + ['s'])
+    index.select_excluding(HIDDEN_BY_DEFAULT)
+
+
+def label_database(rows):
+    """Scratch database with about rows synthetic labels, VARIABLES_PER_DOCUMENT per document."""
+    path = os.path.join(WORKDIR, f'labels-{rows}.db')
+    conn = database.connect(path)
+    labels = [(f'doc{n // VARIABLES_PER_DOCUMENT:07d}', f'variable_{n % VARIABLES_PER_DOCUMENT:02d}',
+               str(n % 7), str(n % 7), '', 'benchmark') for n in range(rows)]
+    database.upsert_labels(conn, labels)
+    conn.close()
+    return path
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(previous_path, results):
+    with open(previous_path) as f:
+        previous = {r['name']: r for r in json.load(f)['results'] if 'best' in r}
+    print(f"\n{'stage':44s} {'before':>10s} {'after':>10s}")
+    for result in results:
+        before = previous.get(result['name'])
+        if before is None or 'best' not in result:
+            continue
+        print(f"{result['name']:44s} {before['best'] * 1000:8.1f}ms {result['best'] * 1000:8.1f}ms "
+              f"{before['best'] / result['best']:6.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdf-dir', default='resources/pdf')
+    parser.add_argument('--xml-dir', default='resources/xml')
+    parser.add_argument('--limit', type=int, default=0, help='only the first N documents')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--label-rows', default='1000,10000,100000', help='sizes of the synthetic label tables')
+    parser.add_argument('--grobid-latency', type=float, default=0.0, help='seconds per stub Grobid request')
+    parser.add_argument('--openai-latency', type=float, default=0.0, help='seconds per stub completion')
+    parser.add_argument('--network-documents', type=int, default=10, help='documents sent to the stubs')
+    parser.add_argument('--output', help=f'default: {RESULTS_DIR}/<time>.json')
+    parser.add_argument('--compare', help='earlier result file')
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.pdf_dir, '*.pdf')))
+    pairs = [(pdf, os.path.join(args.xml_dir, os.path.basename(pdf)[:-4] + '.grobid.tei.xml')) for pdf in pdf_paths]
+    pairs = [(pdf, xml) for pdf, xml in pairs if os.path.exists(xml)]
+    if args.limit:
+        pdf_paths, pairs = pdf_paths[:args.limit], pairs[:args.limit]
+    xml_paths = [xml for _, xml in pairs]
+    texts = [read_text(xml) for xml in xml_paths]
+    print(f"{len(pdf_paths)} PDFs, {len(pairs)} with TEI ({sum(map(len, texts)) / 1e6:.1f} MB), scratch {WORKDIR}")
+    suite = Suite(args.repeat)
+    # the modules imported on first use, so no stage times an import
+    for name in bootstrap.WARM_MODULES + ('bs4', 'pyarrow.parquet'):
+        __import__(name)
+
+    # text extraction, the page cache starts empty
+    suite.run('pdf_to_text/cold', openai_service.pdf_to_text, pdf_paths, repeat=1)
+    suite.run('pdf_to_text/warm', openai_service.pdf_to_text, pdf_paths)
+    suite.run('read_all_pdf_content', util.read_all_pdf_content, pdf_paths)
+
+    # TEI structure, the BeautifulSoup passes and the streaming parser used by load_structure
+    processor = GrobidProcessor(None)
+    suite.run('get_coordinates', processor.get_coordinates, texts)
+    suite.run('get_pages', processor.get_pages, texts)
+    suite.run('parse_structure', GrobidProcessor.parse_structure, texts)
+    annotations = [GrobidProcessor.parse_structure(text)[0] for text in texts]
+    suite.run('annotation filtering', select_annotations, annotations)
+
+    # exporters of the viewer, the document cache starts empty
+    suite.run('export xml', read_bytes, xml_paths)
+    suite.run('export txt/cold', lambda xml: content_export.selected_text(xml, True, True, True), xml_paths, repeat=1)
+    suite.run('export txt/warm', lambda xml: content_export.selected_text(xml, True, True, True), xml_paths)
+    suite.run('export json', lambda pair: content_export.selected_content(pair[1], pair[0], True, True, True, True),
+              pairs)
+
+    # label exports on growing synthetic tables, written once and then served from the export file
+    for rows in [int(n) for n in args.label_rows.split(',') if n]:
+        exporter = label_export.LabelExporter(label_database(rows), os.path.join(WORKDIR, f'exports-{rows}'))
+        for kind, fmt in (('labels', 'tsv'), ('labels', 'parquet'), ('log', 'tsv')):
+            suite.run(f'label export {kind} {fmt} {rows}/cold', lambda _: exporter.export(kind, fmt), [None], repeat=1,
+                      rows=rows)
+            suite.run(f'label export {kind} {fmt} {rows}/cached', lambda _: exporter.export(kind, fmt), [None],
+                      rows=rows)
+
+    # network stages against the stubs
+    network_pdfs = [pdf for pdf, _ in pairs[:args.network_documents]]
+    with StubGrobidServer(latency=args.grobid_latency, pdf_dir=args.pdf_dir, xml_dir=args.xml_dir) as grobid:
+        client = bootstrap.LazyGrobidClient(grobid.base_url, coordinates=COORDINATES, sleep_time=1, timeout=60)
+        suite.run('grobid process_structure', GrobidProcessor(client).process_structure, network_pdfs, repeat=1,
+                  latency=args.grobid_latency)
+    with StubOpenAIServer(latency=args.openai_latency) as stub:
+        os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+        openai_client.configure(base_url=stub.base_url, requests_per_minute=0, tokens_per_minute=0)
+        query = 'What is the unit of analysis of this study?'
+        suite.run('chat_with_pdf/uncached', lambda pdf: openai_service.chat_with_pdf(pdf, query), network_pdfs,
+                  repeat=1, latency=args.openai_latency)
+        suite.run('chat_with_pdf/cached', lambda pdf: openai_service.chat_with_pdf(pdf, query), network_pdfs,
+                  latency=args.openai_latency)
+
+    report = {'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': git_commit(),
+              'python': sys.version.split()[0], 'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'args': vars(args), 'documents': {'pdf': len(pdf_paths), 'tei': len(pairs)}, 'results': suite.results}
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"results written to {output}")
+    if args.compare:
+        compare(args.compare, suite.results)
+    shutil.rmtree(WORKDIR)
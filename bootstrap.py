@@ -0,0 +1,153 @@
+"""Process-wide state the apps need on every rerun: the reference tables and the Grobid client.
+
+Streamlit reruns the whole script on each interaction, so anything read there is read again and
+again. The chain and pdf tables are held in memory and reloaded only when another connection wrote
+to them (PRAGMA data_version, then the table_version counters). The Grobid client is created on
+first use and the server is checked in a background thread instead of blocking the first run.
+The slow imports the modules defer (the OpenAI SDK, the PDF libraries) are warmed up in the
+background too, so the first document opened does not pay for them either.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+
+import database
+import metrics
+
+GROBID_SERVER = os.getenv('GROBID_SERVER', 'http://localhost:8070/')
+WARM_MODULES = ('openai', 'pymupdf', 'PyPDF2')
+
+_warmed_up = threading.Event()
+
+
+def warm_up(modules=WARM_MODULES):
+    """Import modules in a daemon thread, once per process; a rerun needing one meanwhile waits on the import lock.
+
+    Called at the end of a run, so the imports don't compete with rendering the first page.
+    """
+    if _warmed_up.is_set():
+        return
+    _warmed_up.set()
+
+    def run():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logging.warning(f"could not warm up {name}: {e}")
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+
+class ReferenceData:
+    """chain ({variable: prompt}) and pdf ({doc_id: filename}) kept in memory across reruns and sessions.
+
+    The returned dicts are shared, callers must not modify them.
+    """
+    TABLES = ('chain', 'pdf')
+
+    def __init__(self, db_path=database.DB_PATH):
+        self.db_path = db_path
+        self.chain = {}
+        self.pdfs = {}
+        self.loads = 0
+        self._conn = None
+        self._data_version = None
+        self._versions = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = database.connect(self.db_path, check_same_thread=False)
+            # changes whenever another connection committed to the file, a cheap check per rerun
+            data_version = self._conn.execute('pragma data_version').fetchone()[0]
+            result = 'hit'
+            if data_version != self._data_version:
+                self._data_version = data_version
+                versions = database.table_versions(self._conn, self.TABLES)
+                if versions != self._versions:
+                    self.chain = database.get_chain(self._conn)
+                    self.pdfs = database.get_pdfs(self._conn)
+                    self._versions = versions
+                    self.loads += 1
+                    result = 'miss'
+                    logging.info(f"loaded {len(self.chain)} variables and {len(self.pdfs)} pdfs")
+            metrics.cache_lookup('reference_data', result)
+            return self.chain, self.pdfs
+
+
+_reference_data = {}
+_reference_data_lock = threading.Lock()
+
+
+def get_reference_data(db_path=database.DB_PATH):
+    """(chain_dict, pdf_dict) of the database, from memory unless one of the tables changed."""
+    if db_path not in _reference_data:
+        with _reference_data_lock:
+            if db_path not in _reference_data:
+                _reference_data[db_path] = ReferenceData(db_path)
+    return _reference_data[db_path].get()
+
+
+class LazyGrobidClient:
+    """GrobidClient created on first use, with the server checked in the background.
+
+    The client's own check_server ping blocks its constructor and exits the process when the server
+    is down; here available stays None until the check answered and a down server is checked again
+    at most every RECHECK_SECONDS.
+    """
+    RECHECK_SECONDS = 30
+
+    def __init__(self, grobid_server=GROBID_SERVER, **options):
+        self.grobid_server = grobid_server
+        self.options = options
+        self.available = None
+        self._client = None
+        self._checked_at = 0
+        self._check_thread = None
+        self._lock = threading.Lock()
+        self.check_in_background()
+
+    def check_in_background(self):
+        self._checked_at = time.monotonic()
+        self._check_thread = threading.Thread(target=self._check, name='grobid-check', daemon=True)
+        self._check_thread.start()
+
+    def _check(self):
+        import requests
+
+        try:
+            available = requests.get(self.grobid_server.rstrip('/') + '/api/isalive', timeout=5).ok
+        except requests.RequestException:
+            available = False
+        if available != self.available:
+            logging.info(f"grobid server {self.grobid_server} is {'up' if available else 'down'}")
+        self.available = available
+
+    def is_available(self, wait=5):
+        """Whether the server answered the last check, waiting up to wait seconds for the first one."""
+        if self.available is None:
+            self._check_thread.join(wait)
+        elif not self.available and time.monotonic() - self._checked_at > self.RECHECK_SECONDS:
+            self.check_in_background()
+        return bool(self.available)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from grobid_client.grobid_client import GrobidClient
+
+                    self._client = GrobidClient(grobid_server=self.grobid_server, check_server=False,
+                                                **self.options)
+        return self._client
+
+    def process_pdf(self, *args, **kwargs):
+        return self.client.process_pdf(*args, **kwargs)
+
+    def process(self, *args, **kwargs):
+        return self.client.process(*args, **kwargs)
@@ -0,0 +1,155 @@
+"""Headless labeling of every chain variable for every document of the corpus.
+
+Each PDF is extracted once and all its variable prompts run concurrently under a request rate limit.
+Variables with rows in `chain_section` are sent only the sections they need (see section_routing).
+Answers are parsed like the labeling area does and written to the `label` table in batches; pairs
+that already have a label are skipped, so an interrupted run can simply be started again.
+
+    python bulk_label.py --concurrency 8 --rpm 300 --tpm 300000
+"""
+import argparse
+import itertools
+import logging
+import os
+import threading
+import time
+
+import context_builder
+import database
+import openai_client
+import openai_service
+import util
+from fanout import FanOut
+
+DB_PATH = database.DB_PATH
+PDF_DIR = 'resources/pdf'
+
+
+class DocumentTexts:
+    """Prompt context per PDF, built once even when several prompts of a document start together."""
+
+    def __init__(self, model=openai_service.gpt4o_model):
+        self.model = model
+        self._texts = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, pdf_path):
+        with self._lock:
+            lock = self._locks.setdefault(pdf_path, threading.Lock())
+        with lock:
+            if pdf_path not in self._texts:
+                self._texts[pdf_path] = context_builder.build_context(pdf_path, self.model)
+            return self._texts[pdf_path]
+
+    def release(self, pdf_path):
+        with self._lock:
+            self._texts.pop(pdf_path, None)
+
+
+def pending_pairs(conn, variables=None, doc_ids=None, overwrite=False, pdf_dir=PDF_DIR):
+    """[(doc_id, pdf_path, variable, prompt)] in document-major order, skipping labeled pairs unless overwrite."""
+    chain = conn.execute('select variable, prompt from chain order by variable').fetchall()
+    pdfs = conn.execute('select doc_id, filename from pdf order by doc_id').fetchall()
+    labeled = set() if overwrite else set(conn.execute('select doc_id, variable from label'))
+    pairs = []
+    for doc_id, filename in pdfs:
+        pdf_path = os.path.join(pdf_dir, filename)
+        if (doc_ids and doc_id not in doc_ids) or not os.path.exists(pdf_path):
+            continue
+        for variable, prompt in chain:
+            if (variables and variable not in variables) or (doc_id, variable) in labeled:
+                continue
+            pairs.append((doc_id, pdf_path, variable, prompt))
+    return pairs
+
+
+def run(db_path=DB_PATH, concurrency=8, rpm=300, batch_size=50, variables=None, doc_ids=None, overwrite=False,
+        model=openai_service.gpt4o_model, tpm=openai_client.TOKENS_PER_MINUTE):
+    conn = database.connect(db_path)
+    pairs = pending_pairs(conn, variables, doc_ids, overwrite)
+    documents = {pdf_path for _, pdf_path, _, _ in pairs}
+    logging.info(f"{len(pairs)} labels to produce for {len(documents)} documents")
+
+    texts = DocumentTexts(model)
+    remaining = {}
+    for _, pdf_path, _, _ in pairs:
+        remaining[pdf_path] = remaining.get(pdf_path, 0) + 1
+    prompts = {variable: prompt for _, _, variable, prompt in pairs}
+    routed = {variable: database.chain_sections(conn, variable) for variable in prompts}
+    # cached answers are used directly so they don't count against the rate limit
+    cached, calls = [], {}
+    for doc_id, pdf_path, variable, prompt in pairs:
+        query = util.query_add_md(prompt)
+        if routed[variable]:
+            # only the sections the variable needs, the whole paper on low confidence
+            calls[(doc_id, pdf_path, variable, query)] = \
+                lambda timeout, pdf_path=pdf_path, query=query, sections=routed[variable]: \
+                openai_service.chat_with_pdf_sections(pdf_path, query, sections, model=model, timeout=timeout,
+                                                      knowledge_base=lambda: texts.get(pdf_path))[0]
+            continue
+        response = openai_service.response_cache.get(openai_service.get_cache_key(pdf_path, query, model))
+        if response is not None:
+            cached.append(((doc_id, pdf_path, variable, query), response, None))
+            continue
+        calls[(doc_id, pdf_path, variable, query)] = \
+            lambda timeout, pdf_path=pdf_path, query=query: openai_service.chat_with_pdf(
+                pdf_path, query, model=model, timeout=timeout, knowledge_base=lambda: texts.get(pdf_path))
+
+    # the shared client applies retries and the request/token rate limits to every call
+    openai_client.configure(requests_per_minute=rpm, tokens_per_minute=tpm)
+    fanout = FanOut(max_concurrency=concurrency, timeout=openai_client.REQUEST_TIMEOUT, retries=0)
+    start = time.perf_counter()
+    batch, written, failed, finished_documents = [], 0, 0, 0
+    try:
+        for (doc_id, pdf_path, variable, query), response, error in itertools.chain(cached, fanout.imap(calls)):
+            remaining[pdf_path] -= 1
+            if remaining[pdf_path] == 0:
+                texts.release(pdf_path)
+                finished_documents += 1
+            try:
+                if response is None:
+                    raise ValueError(f"no response: {error}")
+                result, _, _ = util.parse_label_response(response)
+            except Exception as e:
+                logging.warning(f"failed to label {doc_id} {variable}: {e}")
+                failed += 1
+                continue
+            batch.append((doc_id, variable, result, result, '', util.prompt_version(prompts[variable])))
+            if len(batch) >= batch_size:
+                database.upsert_labels(conn, batch)
+                written += len(batch)
+                batch = []
+                elapsed = time.perf_counter() - start
+                logging.info(f"{written} labels, {finished_documents}/{len(documents)} documents, "
+                             f"{finished_documents / elapsed * 60:.1f} docs/min")
+    finally:
+        if batch:
+            database.upsert_labels(conn, batch)
+            written += len(batch)
+        conn.close()
+        fanout.executor.shutdown(wait=False, cancel_futures=True)
+    elapsed = time.perf_counter() - start
+    return {'labels': written, 'failed': failed, 'documents': finished_documents, 'seconds': elapsed,
+            'docs_per_minute': finished_documents / elapsed * 60 if elapsed else 0.0}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Label every chain variable for every document.')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent OpenAI requests')
+    parser.add_argument('--rpm', type=int, default=300, help='requests per minute, 0 for no limit')
+    parser.add_argument('--tpm', type=int, default=openai_client.TOKENS_PER_MINUTE,
+                        help='tokens per minute, 0 for no limit')
+    parser.add_argument('--batch-size', type=int, default=50, help='labels written per transaction')
+    parser.add_argument('--variable', action='append', help='only this variable, can be repeated')
+    parser.add_argument('--doc-id', action='append', help='only this document, can be repeated')
+    parser.add_argument('--overwrite', action='store_true', help='relabel pairs that already have a label')
+    parser.add_argument('--model', default=openai_service.gpt4o_model)
+    args = parser.parse_args()
+
+    stats = run(args.db, args.concurrency, args.rpm, args.batch_size, args.variable, args.doc_id, args.overwrite,
+                args.model, args.tpm)
+    print(f"wrote {stats['labels']} labels ({stats['failed']} failed) for {stats['documents']} documents "
+          f"in {stats['seconds']:.0f}s, {stats['docs_per_minute']:.1f} docs/min")
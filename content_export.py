@@ -0,0 +1,40 @@
+"""Selected content of a paper for the JSON and TXT downloads of the viewer.
+
+Both are built from the cached document model of its TEI. The JSON paragraphs are the extracted text
+of the whole PDF with the title and person names redacted, the TXT ones the TEI paragraphs.
+"""
+import metrics
+import redaction
+import util
+from grobid.document import get_document
+
+
+@metrics.timed('export', format='json')
+def selected_content(xml_path, pdf_path, title=False, person_names=False, figures=False, paragraphs=False):
+    document = get_document(xml_path)
+    # ignore role names
+    names = [' '.join(part for part in parts if part.find('Ph.D') < 0) for parts in document.person_names]
+    content = {}
+    if title:
+        content['title'] = document.title
+    if person_names:
+        content['person_names'] = names
+    if figures:
+        content['figures'] = document.figure_heads
+    if paragraphs:
+        all_content = util.read_all_pdf_content(pdf_path).replace('\n', ' ')
+        content['paragraphs'] = redaction.redact_title_and_authors(all_content, document.title, names)
+    return content
+
+
+@metrics.timed('export', format='txt')
+def selected_text(xml_path, person_names=False, figures=False, paragraphs=False):
+    document = get_document(xml_path)
+    lines = [document.title, '']
+    if person_names:
+        lines += [' '.join(parts) + ' ' for parts in document.person_names] + ['']
+    if figures:
+        lines += document.figure_heads + ['']
+    if paragraphs:
+        lines += [paragraph.text for paragraph in document.paragraphs]
+    return '\n'.join(lines) + '\n'
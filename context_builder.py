@@ -0,0 +1,124 @@
+"""Paper text for a prompt, filled by section priority up to the token budget of the target model.
+
+From the TEI the abstract goes in first, then the method and result sections, then everything else,
+and the selected passages are put back in reading order. Papers without a TEI file fall back to
+their extracted pages, in page order.
+"""
+import logging
+import os
+import re
+
+import metrics
+import retrieval
+import section_routing
+import text_extraction
+import token_count
+
+# part of the response cache keys, raised whenever the text sent with a prompt changes so answers given
+# for the old text are not returned: 1 was the whole extracted PDF, 2 the budgeted context built here
+# capped at 24000 tokens, 3 the same within the whole window of the model
+CONTEXT_VERSION = 3
+
+_method_or_result = re.compile(r'method|procedure|participant|sample|measure|design|data|analys|estimat|result|finding')
+
+
+def section_priority(section):
+    """0 for the abstract, 1 for method and result sections, 2 for the rest."""
+    if section == 'abstract':
+        return 0
+    # headings are often letter-spaced in the Grobid output, e.g. 'M E T H O D O L O G Y'
+    if _method_or_result.search(section.replace(' ', '').lower()):
+        return 1
+    return 2
+
+
+def _format_chunks(chunks):
+    blocks, section, paragraph = [], None, None
+    for chunk in chunks:
+        chunk_paragraph = chunk.id.split('.')[0]
+        if chunk.section != section:
+            section = chunk.section
+            blocks.append([section[:1].upper() + section[1:]] if section else [])
+        elif chunk_paragraph == paragraph:
+            # consecutive sentence groups of one paragraph stay one paragraph
+            blocks[-1][-1] += ' ' + chunk.text
+            continue
+        paragraph = chunk_paragraph
+        blocks[-1].append(chunk.text)
+    return '\n\n'.join('\n'.join(block) for block in blocks)
+
+
+def tei_context(xml_path, model, budget, sections=None):
+    """(text, tokens, passages used, passages available) from the TEI passages, of the given section classes only."""
+    chunks = retrieval.get_index(xml_path).chunks
+    if sections:
+        chunks = [c for c, section_class in zip(chunks, section_routing.chunk_classes(chunks))
+                  if section_class in sections]
+    counted = sorted(((section_priority(c.section), c.position, token_count.count_tokens(c.text, model), c)
+                      for c in chunks), key=lambda item: item[:2])
+    selected, used = [], 0
+    for _, _, tokens, chunk in counted:
+        if used + tokens <= budget:
+            selected.append(chunk)
+            used += tokens
+    selected.sort(key=lambda c: c.position)
+    return _format_chunks(selected), used, len(selected), len(chunks)
+
+
+def pdf_context(pdf_file_path, model, budget, backend=text_extraction.DEFAULT_BACKEND):
+    """(text, tokens, pages used, pages in the paper) from the extracted pages, each page once."""
+    pages = text_extraction.get_pages(pdf_file_path, backend)
+    if pages and 'To cite this article' in pages[0]:
+        # publisher cover page
+        pages = pages[1:]
+    selected, used = [], 0
+    for page in pages:
+        tokens = token_count.count_tokens(page, model)
+        if used + tokens > budget:
+            if not selected:
+                selected.append(page[:budget * 4])
+                used = budget
+            break
+        selected.append(page)
+        used += tokens
+    return ''.join(selected), used, len(selected), len(pages)
+
+
+@metrics.timed('build_context')
+def build_context(pdf_file_path, model, token_budget=None, xml_dir=retrieval.XML_DIR,
+                  backend=text_extraction.DEFAULT_BACKEND):
+    """Text of the paper that fits the model's budget, None when the PDF cannot be read."""
+    budget = token_budget or token_count.context_budget(model)
+    xml_path = retrieval.xml_path_for(pdf_file_path, xml_dir)
+    text = None
+    if os.path.exists(xml_path):
+        text, tokens, used, total = tei_context(xml_path, model, budget)
+        unit = 'TEI passages'
+    if not text:
+        try:
+            text, tokens, used, total = pdf_context(pdf_file_path, model, budget, backend)
+        except text_extraction.PdfReadError as e:
+            logging.warning(f"Error reading {pdf_file_path}: {e}")
+            return None
+        unit = 'pages'
+    logging.info(f"context for {pdf_file_path}: {used}/{total} {unit}, {tokens}/{budget} tokens for {model}")
+    return text
+
+
+@metrics.timed('build_context', sections='routed')
+def build_section_context(pdf_file_path, model, sections, token_budget=None, xml_dir=retrieval.XML_DIR):
+    """Text of the sections of the given classes that fits the model's budget.
+
+    None when the paper has no TEI or those sections are too short to answer from, the caller then
+    sends the whole paper.
+    """
+    xml_path = retrieval.xml_path_for(pdf_file_path, xml_dir)
+    if not os.path.exists(xml_path):
+        return None
+    budget = token_budget or token_count.context_budget(model)
+    text, tokens, used, total = tei_context(xml_path, model, budget, sections)
+    if len(text) < section_routing.MIN_ROUTED_CHARACTERS:
+        return None
+    logging.info(f"context for {pdf_file_path} from {', '.join(sections)}: {used}/{total} TEI passages, "
+                 f"{tokens}/{budget} tokens for {model}")
+    return text
@@ -0,0 +1,314 @@
+"""Schema, connections and shared queries of the app database `resources/sqlite.db` (or SQLITE_DB_PATH).
+
+Every module opens its connections through connect(), which brings the file to the latest schema
+version the first time a process touches it. Modules that query now and then use the connection
+their thread keeps open (thread_connection) rather than opening one per call. The database runs in WAL mode so the two apps, the
+ingest and the bulk jobs can read while another one writes. Statements are parameterized and the
+bulk writes go through executemany in one transaction.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.getenv('SQLITE_DB_PATH', 'resources/sqlite.db')
+BUSY_TIMEOUT = 30
+
+
+def _version_triggers(table):
+    """Statements keeping a counter in table_version that every write to the table increments."""
+    return [f"insert or ignore into table_version(name, version) values ('{table}', 0)"] + [
+        f'create trigger if not exists {table}_version_{event} after {event} on {table} begin '
+        f"update table_version set version = version + 1 where name = '{table}'; end"
+        for event in ('insert', 'update', 'delete')]
+
+
+# section classes (see section_routing) sent with the prompts of the variables of the original chain
+DEFAULT_CHAIN_SECTIONS = {
+    'level_entity': ('abstract', 'method', 'results'),
+    'number_entity': ('abstract', 'method', 'results', 'figures'),
+    'number_time': ('abstract', 'method', 'results'),
+    'same_entity': ('abstract', 'method'),
+    'theory': ('abstract', 'introduction', 'discussion'),
+    'DV': ('abstract', 'introduction', 'method', 'results'),
+    'MedMod': ('abstract', 'introduction', 'method', 'results'),
+}
+
+# applied in order, each one once, the file's schema version is kept in PRAGMA user_version;
+# statements use "if not exists" since older code created some of these tables on the fly
+MIGRATIONS = [
+    # 1: the tables the apps started with
+    ['create table if not exists chain ('
+     'variable TEXT not null constraint chain_pk primary key, '
+     'prompt TEXT not null)',
+     'create table if not exists pdf ('
+     'doc_id TEXT not null constraint pdf_pk primary key, '
+     'filename TEXT not null)',
+     'create table if not exists label ('
+     'doc_id TEXT not null, '
+     'variable TEXT not null, '
+     'label TEXT not null, '
+     'ai_label TEXT not null, '
+     'manual_label TEXT not null, '
+     'prompt_version TEXT not null, '
+     'constraint label_pk primary key (doc_id, variable))',
+     'create table if not exists phrase ('
+     'query TEXT not null, '
+     'filename TEXT not null, '
+     'response TEXT not null, '
+     'constraint phrase_pk primary key (query, filename))'],
+    # 2: caches and job state
+    ['create table if not exists response_cache ('
+     'key TEXT not null constraint response_cache_pk primary key, '
+     'doc_hash TEXT not null, '
+     'model TEXT not null, '
+     'query TEXT not null, '
+     'response TEXT not null, '
+     'created_at REAL not null, '
+     'last_access REAL not null)',
+     'create index if not exists response_cache_doc_hash_idx on response_cache (doc_hash)',
+     'create index if not exists response_cache_last_access_idx on response_cache (last_access)',
+     'create table if not exists ingest ('
+     'filename TEXT not null constraint ingest_pk primary key, '
+     'hash TEXT not null, '
+     'status TEXT not null, '
+     'pages INTEGER, '
+     'error TEXT, '
+     'updated_at REAL not null)',
+     'create table if not exists page_text ('
+     'hash TEXT not null, '
+     'backend TEXT not null, '
+     'page INTEGER not null, '
+     'text TEXT not null, '
+     'constraint page_text_pk primary key (hash, backend, page))',
+     'create table if not exists page_text_document ('
+     'hash TEXT not null, '
+     'backend TEXT not null, '
+     'pages INTEGER not null, '
+     'constraint page_text_document_pk primary key (hash, backend))',
+     "create virtual table if not exists tei_fts using fts5("
+     "filename UNINDEXED, chunk_id UNINDEXED, section, text, tokenize = 'porter unicode61')",
+     'create table if not exists tei_fts_source ('
+     'filename TEXT not null constraint tei_fts_source_pk primary key, '
+     'hash TEXT not null)',
+     'create table if not exists table_version ('
+     'name TEXT not null constraint table_version_pk primary key, '
+     'version INTEGER not null)']
+    + _version_triggers('label'),
+    # 3: covering indexes for the labeling UI, existing labels of a variable and the labels of a document
+    ['create index if not exists label_variable_idx on label (variable, label)',
+     'create index if not exists label_doc_id_idx on label (doc_id, variable, label)'],
+    # 4: change tracking of the reference tables the apps keep in memory
+    _version_triggers('chain') + _version_triggers('pdf'),
+    # 5: snapshots of the process metrics, totals since the process started
+    ['create table if not exists metric ('
+     'recorded_at REAL not null, '
+     'pid INTEGER not null, '
+     'name TEXT not null, '
+     'labels TEXT not null, '
+     'count REAL not null, '
+     'sum REAL, '
+     'p50 REAL, '
+     'p95 REAL, '
+     'max REAL)',
+     'create index if not exists metric_name_idx on metric (name, recorded_at)'],
+    # 6: background jobs of the apps, keyed by kind and arguments so equal requests share one job
+    ['create table if not exists job ('
+     'key TEXT not null constraint job_pk primary key, '
+     'kind TEXT not null, '
+     'payload TEXT not null, '
+     'status TEXT not null, '
+     'result TEXT, '
+     'error TEXT, '
+     'attempts INTEGER not null default 0, '
+     'created_at REAL not null, '
+     'started_at REAL, '
+     'finished_at REAL)',
+     'create index if not exists job_status_idx on job (status, created_at)'],
+    # 7: content hash of the registered PDFs, and job priorities so prefetching waits behind the users' jobs
+    ['alter table pdf add column hash TEXT',
+     'create index if not exists pdf_hash_idx on pdf (hash)',
+     'alter table job add column priority INTEGER not null default 0',
+     'drop index if exists job_status_idx',
+     'create index if not exists job_queue_idx on job (status, priority, created_at)'],
+    # 8: paper sections sent with the prompt of a chain variable, a variable without rows gets the whole paper
+    ['create table if not exists chain_section ('
+     'variable TEXT not null, '
+     'section TEXT not null, '
+     'constraint chain_section_pk primary key (variable, section))']
+    + [f"insert or ignore into chain_section(variable, section) select variable, '{section}' from chain "
+       f"where variable = '{variable}'"
+       for variable, sections in DEFAULT_CHAIN_SECTIONS.items() for section in sections],
+    # 9: the answer a streaming job has generated so far
+    ['alter table job add column partial TEXT'],
+    # 10: metric snapshots are deleted by age
+    ['create index if not exists metric_recorded_at_idx on metric (recorded_at)'],
+    # 11: one row per process and series updated in place instead of a snapshot per flush
+    ['drop table if exists metric',
+     'create table if not exists metrics ('
+     'pid INTEGER not null, '
+     'started_at REAL not null, '
+     'name TEXT not null, '
+     'labels TEXT not null, '
+     'recorded_at REAL not null, '
+     'count REAL not null, '
+     'sum REAL, '
+     'p50 REAL, '
+     'p95 REAL, '
+     'max REAL, '
+     'constraint metrics_pk primary key (pid, started_at, name, labels))',
+     'create index if not exists metrics_recorded_at_idx on metrics (recorded_at)'],
+    # 12: the claim a running job belongs to and when its worker last renewed the lease
+    ['alter table job add column run TEXT',
+     'alter table job add column renewed_at REAL',
+     'update job set renewed_at = started_at'],
+]
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def _configure(conn):
+    conn.execute('pragma synchronous = NORMAL')
+    conn.execute('pragma temp_store = MEMORY')
+    conn.execute('pragma cache_size = -16000')
+    conn.execute('pragma mmap_size = 134217728')
+
+
+def migrate(conn):
+    """Bring the database to the last schema version, returns the version it was at."""
+    # journal_mode can't change inside a transaction; it is stored in the file, so set once is enough
+    conn.execute('pragma journal_mode = WAL')
+    conn.execute('begin immediate')
+    try:
+        version = conn.execute('pragma user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'pragma user_version = {number}')
+        conn.execute('commit')
+    except BaseException:
+        conn.execute('rollback')
+        raise
+    return version
+
+
+def connect(db_path=DB_PATH, check_same_thread=True):
+    """Connection with the app pragmas; the first one of a process for a file also migrates it."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread)
+    _configure(conn)
+    key = os.path.abspath(db_path)
+    if key not in _migrated:
+        with _migrate_lock:
+            if key not in _migrated:
+                migrate(conn)
+                _migrated.add(key)
+    return conn
+
+
+_local = threading.local()
+
+
+def thread_connection(db_path=DB_PATH):
+    """Connection of the calling thread to db_path, opened on first use and kept until the thread ends.
+
+    Used as `with database.thread_connection() as conn:`, the block commits its writes (or rolls them
+    back) but leaves the connection, its pragmas and its statement cache to the next call.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = os.path.abspath(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        conn = connections[key] = connect(db_path)
+    return conn
+
+
+@contextmanager
+def write_transaction(conn, observe=True):
+    """begin immediate .. commit, timing the wait for the write lock as db_lock_wait_seconds.
+
+    Taking the lock up front makes a writer queue on the busy timeout instead of failing halfway
+    through when another connection wrote first. observe=False leaves the wait unrecorded, for the
+    metrics flush, which would otherwise always find a change to flush the next time.
+    """
+    start = time.perf_counter()
+    conn.execute('begin immediate')
+    if observe:
+        metrics.get_metrics().observe('db_lock_wait_seconds', time.perf_counter() - start)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def table_versions(conn, tables):
+    """{table: version} of tables tracked in table_version."""
+    placeholders = ', '.join('?' * len(tables))
+    return dict(conn.execute(f'select name, version from table_version where name in ({placeholders})', tables))
+
+
+@metrics.timed('db', query='get_chain')
+def get_chain(conn):
+    """{variable: prompt}"""
+    return dict(conn.execute('select variable, prompt from chain order by rowid'))
+
+
+@metrics.timed('db', query='get_pdfs')
+def get_pdfs(conn):
+    """{doc_id: filename}"""
+    return dict(conn.execute('select doc_id, filename from pdf order by rowid'))
+
+
+@metrics.timed('db', query='chain_sections')
+def chain_sections(conn, variable):
+    """Section classes sent with the prompt of a variable, empty for the whole paper."""
+    return [section for section, in conn.execute('select section from chain_section where variable = ? '
+                                                 'order by section', (variable,))]
+
+
+@metrics.timed('db', query='pdf_rows')
+def pdf_rows(conn):
+    """{filename: (doc_id, hash)} of the registered PDFs, hash is None for rows added by hand."""
+    return {filename: (doc_id, pdf_hash) for doc_id, filename, pdf_hash in
+            conn.execute('select doc_id, filename, hash from pdf')}
+
+
+@metrics.timed('db', query='upsert_pdf')
+def upsert_pdf(conn, doc_id, filename, pdf_hash):
+    with write_transaction(conn):
+        conn.execute('insert into pdf(doc_id, filename, hash) values (?, ?, ?) '
+                     'on conflict(doc_id) do update set filename = excluded.filename, hash = excluded.hash',
+                     (doc_id, filename, pdf_hash))
+
+
+@metrics.timed('db', query='upsert_labels')
+def upsert_labels(conn, rows):
+    """Write (doc_id, variable, label, ai_label, manual_label, prompt_version) rows in one transaction."""
+    with write_transaction(conn):
+        conn.executemany('insert or replace into label(doc_id, variable, label, ai_label, manual_label, '
+                         'prompt_version) values (?, ?, ?, ?, ?, ?)', rows)
+
+
+def upsert_label(conn, doc_id, variable, label, ai_label, manual_label, prompt_version):
+    upsert_labels(conn, [(doc_id, variable, label, ai_label, manual_label, prompt_version)])
+
+
+@metrics.timed('db', query='labels_of_variable')
+def labels_of_variable(conn, variable):
+    """Distinct labels already given to a variable, for picking an existing one."""
+    return [label for label, in conn.execute('select distinct label from label where variable = ? order by label',
+                                             (variable,))]
+
+
+@metrics.timed('db', query='labels_of_document')
+def labels_of_document(conn, doc_id):
+    """[{doc_id, variable, label}] of a document."""
+    rows = conn.execute('select doc_id, variable, label from label where doc_id = ? order by variable', (doc_id,))
+    return [{'doc_id': d, 'variable': v, 'label': label} for d, v, label in rows]
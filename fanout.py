@@ -0,0 +1,139 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class Cancelled(Exception):
+    pass
+
+
+def is_retryable(error):
+    # imported on the first failure, the SDK is slow to import and not needed until then
+    import openai
+
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_after(error):
+    """Seconds the server asked to wait in Retry-After / retry-after-ms, or None."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        # an HTTP date instead of seconds, fall back to the computed backoff
+        return None
+    return None
+
+
+def call_with_retry(fn, retries=3, backoff=1.0, cancel_event=None):
+    """Call fn(), retrying 429/5xx/connection errors with exponential backoff and jitter.
+
+    A Retry-After sent by the server is honored when it is longer than the computed backoff.
+    """
+    attempt = 0
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise Cancelled()
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = max(backoff * (2 ** attempt) * (0.5 + random.random()), retry_after(e) or 0)
+            logging.warning(f"retrying after {type(e).__name__} in {delay:.1f}s ({attempt + 1}/{retries})")
+            # waiting on the event lets a cancellation cut the backoff short
+            if cancel_event is not None and cancel_event.wait(delay):
+                raise Cancelled()
+            if cancel_event is None:
+                time.sleep(delay)
+            attempt += 1
+
+
+class RateLimiter:
+    """Token bucket allowing per_minute acquisitions a minute, with bursts up to burst."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1, cancel_event=None):
+        # a single request larger than the bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            if cancel_event is not None and cancel_event.wait(wait):
+                raise Cancelled()
+            if cancel_event is None:
+                time.sleep(wait)
+
+    def adjust(self, amount):
+        """Take (or give back, when negative) amount once the real cost of an acquisition is known."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class FanOut:
+    """Runs many independent calls on a shared, bounded thread pool.
+
+    The pool size is the concurrency limit for the whole process, so several sessions fanning out at
+    once share it instead of multiplying the number of in-flight requests.
+    """
+
+    def __init__(self, max_concurrency=8, timeout=120, retries=3, backoff=1.0, rate_limiter=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='fanout')
+
+    def _run_one(self, fn, cancel_event):
+        def attempt():
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(cancel_event=cancel_event)
+            return fn(timeout=self.timeout)
+
+        return call_with_retry(attempt, self.retries, self.backoff, cancel_event)
+
+    def imap(self, calls, cancel_event=None):
+        """Yield (key, result, error) in completion order for a dict of key -> fn(timeout=...)."""
+        cancel_event = cancel_event or threading.Event()
+        futures = {self.executor.submit(self._run_one, fn, cancel_event): key for key, fn in calls.items()}
+        try:
+            for future in as_completed(futures):
+                if cancel_event.is_set():
+                    break
+                try:
+                    yield futures[future], future.result(), None
+                except Cancelled:
+                    continue
+                except Exception as e:
+                    logging.warning(f"call {futures[future]} failed: {e}")
+                    yield futures[future], None, e
+        finally:
+            # reached on cancellation, on early exit of the consumer and on normal completion alike
+            for future in futures:
+                future.cancel()
+
+    def run(self, calls, cancel_event=None):
+        return {key: result for key, result, _ in self.imap(calls, cancel_event)}
@@ -0,0 +1,44 @@
+import heapq
+from collections import OrderedDict
+
+
+class AnnotationIndex:
+    """Annotations of one document bucketed by (type, page), built once when the document is opened.
+
+    select() answers "boxes of these types on these pages" by merging the matching buckets back into
+    document order, and keeps the last few answers so toggling back and forth costs a dict lookup.
+    """
+
+    def __init__(self, annotations, memo_size=32):
+        self.annotations = annotations
+        self._buckets = {}
+        for position, annotation in enumerate(annotations):
+            key = (annotation.get('type'), int(annotation['page']))
+            self._buckets.setdefault(key, []).append(position)
+        self.types = frozenset(t for t, _ in self._buckets)
+        self.pages = frozenset(p for _, p in self._buckets)
+        self._memo = OrderedDict()
+        self._memo_size = memo_size
+
+    def __len__(self):
+        return len(self.annotations)
+
+    def select(self, types, pages=None):
+        """Annotations whose type is in types and, when pages is not empty, whose page is in pages."""
+        key = (frozenset(types), frozenset(pages) if pages else None)
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+
+        buckets = [positions for (t, p), positions in self._buckets.items()
+                   if t in key[0] and (key[1] is None or p in key[1])]
+        result = [self.annotations[position] for position in heapq.merge(*buckets)]
+
+        self._memo[key] = result
+        if len(self._memo) > self._memo_size:
+            self._memo.popitem(last=False)
+        return result
+
+    def select_excluding(self, hidden_types, pages=None):
+        """Same as select() for every type present in the document except hidden_types."""
+        return self.select(self.types - set(hidden_types), pages)
@@ -0,0 +1,186 @@
+"""Structured view of a Grobid TEI file, built in one parse and shared by the exporters and the viewer.
+
+Documents are cached per TEI content hash, in memory up to a byte budget (least recently used first
+out) and on disk as pickles, so reopening a document that was seen before parses no XML at all.
+"""
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from lxml import etree
+
+import metrics
+import util
+from grobid.tei_parser import TEI_NS, boxes_from_tree
+
+DOCUMENTS_DIR = os.getenv('DOCUMENT_CACHE_DIR', 'resources/documents')
+# bump when the fields below change, older pickles are then ignored
+FORMAT_VERSION = 1
+MAX_CACHE_BYTES = int(os.getenv('DOCUMENT_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+class Sentence:
+    __slots__ = ('text', 'coords')
+
+    def __init__(self, text, coords):
+        self.text = text
+        # ((page, x, y, width, height), ...)
+        self.coords = coords
+
+
+class Paragraph:
+    __slots__ = ('section', 'text', 'sentences')
+
+    def __init__(self, section, text, sentences):
+        self.section = section
+        self.text = text
+        self.sentences = sentences
+
+
+class Document:
+    """Title, names, figure heads, sections and paragraphs of a TEI file, plus its annotation boxes.
+
+    person_names holds the text parts of every persName (authors and cited authors alike) so each
+    export can join them its own way; boxes is the TeiBoxes of the elements carrying coordinates.
+    """
+    __slots__ = ('title', 'authors', 'person_names', 'figure_heads', 'sections', 'paragraphs', 'boxes')
+
+    def __init__(self, title, authors, person_names, figure_heads, sections, paragraphs, boxes):
+        self.title = title
+        self.authors = authors
+        self.person_names = person_names
+        self.figure_heads = figure_heads
+        self.sections = sections
+        self.paragraphs = paragraphs
+        self.boxes = boxes
+
+    @property
+    def page_count(self):
+        return len(self.boxes.page_sizes)
+
+
+def _text(element):
+    return ''.join(element.itertext())
+
+
+def _parts(element):
+    """Text of the element split like its children: its own text, then each child with its tail."""
+    parts = [element.text] if element.text else []
+    for child in element:
+        parts.append(_text(child))
+        if child.tail:
+            parts.append(child.tail)
+    return tuple(parts)
+
+
+def _coords(element):
+    coords = element.get('coords')
+    if not coords:
+        return ()
+    return tuple((int(float(v[0])), float(v[1]), float(v[2]), float(v[3]), float(v[4]))
+                 for v in (box.split(',') for box in coords.split(';') if box))
+
+
+def _section(paragraph):
+    div = None
+    for ancestor in paragraph.iterancestors():
+        if ancestor.tag == TEI_NS + 'abstract':
+            return 'abstract'
+        if div is None and ancestor.tag == TEI_NS + 'div':
+            div = ancestor
+    head = div.find(TEI_NS + 'head') if div is not None else None
+    return _text(head) if head is not None else ''
+
+
+def parse_document(source):
+    """Document from TEI given as bytes or a path."""
+    root = etree.fromstring(source, etree.XMLParser(huge_tree=True)) if isinstance(source, bytes) \
+        else etree.parse(source, etree.XMLParser(huge_tree=True)).getroot()
+    title = next(root.iter(TEI_NS + 'title'), None)
+    source_desc = root.find(f'.//{TEI_NS}sourceDesc')
+    authors = [' '.join(_parts(name)) for name in source_desc.iter(TEI_NS + 'persName')] \
+        if source_desc is not None else []
+    figure_heads = []
+    for figure in root.iter(TEI_NS + 'figure'):
+        head = figure.find(f'.//{TEI_NS}head')
+        if head is not None:
+            figure_heads.append(_text(head))
+    sections = [_text(head) for head in root.iterfind(f'.//{TEI_NS}body/{TEI_NS}div/{TEI_NS}head')]
+    paragraphs = [Paragraph(_section(p), _text(p),
+                            tuple(Sentence(_text(s), _coords(s)) for s in p.iter(TEI_NS + 's')))
+                  for p in root.iter(TEI_NS + 'p')]
+    return Document(_text(title) if title is not None else '', authors,
+                    [_parts(name) for name in root.iter(TEI_NS + 'persName')], figure_heads, sections,
+                    paragraphs, boxes_from_tree(root))
+
+
+class DocumentCache:
+    """LRU of Documents by TEI content hash, evicting once the pickled sizes exceed max_bytes."""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, documents_dir=DOCUMENTS_DIR):
+        self.max_bytes = max_bytes
+        self.documents_dir = documents_dir
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, tei_hash):
+        return os.path.join(self.documents_dir, f'{tei_hash}.v{FORMAT_VERSION}.pickle')
+
+    def _remember(self, tei_hash, document, size):
+        with self._lock:
+            if tei_hash in self._entries:
+                self.size -= self._entries.pop(tei_hash)[1]
+            self._entries[tei_hash] = (document, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def get(self, xml_path):
+        tei_hash = util.get_file_hash(xml_path)
+        with self._lock:
+            entry = self._entries.get(tei_hash)
+            if entry is not None:
+                self._entries.move_to_end(tei_hash)
+                metrics.cache_lookup('document', 'memory')
+                return entry[0]
+
+        path = self.path(tei_hash)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            document = pickle.loads(data)
+            metrics.cache_lookup('document', 'disk')
+        else:
+            metrics.cache_lookup('document', 'miss')
+            with metrics.timer('parse_document'):
+                document = parse_document(xml_path)
+            data = pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL)
+            os.makedirs(self.documents_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            logging.info(f"parsed {xml_path} into {path}")
+        self._remember(tei_hash, document, len(data))
+        return document
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_document_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DocumentCache()
+    return _cache
+
+
+def get_document(xml_path):
+    return get_document_cache().get(xml_path)
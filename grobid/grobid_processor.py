@@ -1,4 +1,10 @@
-from bs4 import BeautifulSoup
+import json
+import os
+
+import metrics
+import util
+from grobid.document import get_document
+from grobid.tei_parser import parse_tei
 
 COLORS = {
     "persName": "rgba(0, 0, 255, 1)",  # Blue
@@ -14,6 +20,9 @@ COLORS = {
 }
 
 
+ANNOTATIONS_DIR = 'resources/annotations'
+
+
 def get_color(name, param):
     color = COLORS[name] if name in COLORS else "rgba(128, 128, 128, 1.0)"
     if param:
@@ -26,7 +35,7 @@ class GrobidProcessor:
     def __init__(self, grobid_client):
         self.grobid_client = grobid_client
 
-    def process_structure(self, input_path) -> (dict, int):
+    def process_tei(self, input_path):
         pdf_file, status, text = self.grobid_client.process_pdf("processFulltextDocument",
                                                                 input_path,
                                                                 consolidate_header=True,
@@ -40,10 +49,87 @@ class GrobidProcessor:
         if status != 200:
             return
 
-        coordinates = self.get_coordinates(text)
-        pages = self.get_pages(text)
+        return text
+
+    @metrics.timed('grobid_process_structure')
+    def process_structure(self, input_path) -> (dict, int):
+        text = self.process_tei(input_path)
+        if text is None:
+            return
+
+        return self.parse_structure(text)
+
+    @staticmethod
+    def parse_structure(text) -> (dict, int):
+        """Coordinates and page count from one streaming pass over the TEI."""
+        boxes = parse_tei(text)
+        return boxes.to_dicts(), len(boxes.page_sizes)
 
-        return coordinates, len(pages)
+    @staticmethod
+    def annotations_path(pdf_hash, annotations_dir=ANNOTATIONS_DIR):
+        return os.path.join(annotations_dir, f"{pdf_hash}.json")
+
+    @staticmethod
+    def write_annotations(pdf_hash, coordinates, pages, annotations_dir=ANNOTATIONS_DIR):
+        """Store coordinates and page count under the PDF content hash.
+
+        Boxes are written as [page, x, y, width, height, type, color] rows with the type and color
+        strings pooled in side tables, which keeps the file a fraction of the size of the dict list.
+        """
+        os.makedirs(annotations_dir, exist_ok=True)
+        types, colors = {}, {}
+        boxes = [[c['page'], c['x'], c['y'], c['width'], c['height'],
+                  types.setdefault(c.get('type'), len(types)), colors.setdefault(c.get('color'), len(colors))]
+                 for c in coordinates]
+        path = GrobidProcessor.annotations_path(pdf_hash, annotations_dir)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'pages': pages, 'types': list(types), 'colors': list(colors), 'boxes': boxes}, f,
+                      separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    @metrics.timed('load_structure')
+    def load_structure(self, pdf_path, xml_path=None, remote=True) -> (dict, int):
+        """Coordinates and page count for a PDF, read locally whenever possible.
+
+        Looks for the annotation file of the PDF content hash first, then for a stored TEI that was
+        produced with coordinates, read through the shared document cache, and only then sends the PDF
+        to Grobid, unless the client knows the server is down or remote is False. Whatever had to be
+        computed is written back to the annotation file so the next load is a single file read.
+        """
+        pdf_hash = util.get_file_hash(pdf_path)
+        structure = self.read_annotations(pdf_hash)
+        if structure is not None:
+            metrics.cache_lookup('annotations', 'hit')
+            return structure
+
+        document = get_document(xml_path) if xml_path and os.path.exists(xml_path) else None
+        # files written without tei_coordinates carry no <surface> and no box coords
+        if document is not None and document.page_count:
+            metrics.cache_lookup('annotations', 'tei')
+            structure = document.boxes.to_dicts(), document.page_count
+        else:
+            metrics.cache_lookup('annotations', 'miss')
+            if not remote:
+                return
+            is_available = getattr(self.grobid_client, 'is_available', None)
+            if is_available is not None and not is_available():
+                return
+            structure = self.process_structure(pdf_path)
+            if structure is None:
+                return
+        self.write_annotations(pdf_hash, *structure)
+        return structure
+
+    @staticmethod
+    def read_annotations(pdf_hash, annotations_dir=ANNOTATIONS_DIR):
+        path = GrobidProcessor.annotations_path(pdf_hash, annotations_dir)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            data = json.load(f)
+        types, colors = data['types'], data['colors']
+        coordinates = [GrobidProcessor.box_to_dict(box, colors[box[6]], type=types[box[5]]) for box in data['boxes']]
+        return coordinates, data['pages']
 
     @staticmethod
     def box_to_dict(box, color=None, type=None):
@@ -57,7 +143,10 @@ class GrobidProcessor:
 
         return item
 
+    @metrics.timed('get_coordinates')
     def get_coordinates(self, text):
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(text, 'xml')
         all_blocks_with_coordinates = soup.find_all(coords=True)
 
@@ -78,7 +167,10 @@ class GrobidProcessor:
             count += 1
         return coordinates
 
+    @metrics.timed('get_pages')
     def get_pages(self, text):
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(text, 'xml')
         pages_infos = soup.find_all("surface")
 
@@ -0,0 +1,103 @@
+import io
+from array import array
+
+from lxml import etree
+
+TEI_NS = '{http://www.tei-c.org/ns/1.0}'
+
+
+class TeiBoxes:
+    """Page sizes and annotation boxes of a TEI document in columnar form.
+
+    Box i lives on page[i] at (x[i], y[i], width[i], height[i]) and belongs to an element whose tag
+    is types[type_code[i]]. block[i] is the index of that element among the elements carrying coords,
+    which is what the alternating highlight colors are based on.
+    """
+    __slots__ = ('page_sizes', 'page', 'x', 'y', 'width', 'height', 'type_code', 'block', 'types')
+
+    def __init__(self):
+        self.page_sizes = []
+        self.page = array('i')
+        self.x = array('d')
+        self.y = array('d')
+        self.width = array('d')
+        self.height = array('d')
+        self.type_code = array('i')
+        self.block = array('i')
+        self.types = []
+
+    def __len__(self):
+        return len(self.page)
+
+    def to_dicts(self):
+        """The list of dicts `pdf_viewer` takes as annotations, same shape as GrobidProcessor.get_coordinates."""
+        from grobid.grobid_processor import get_color
+
+        # one color string per (type, parity) instead of one per box
+        colors = {}
+        annotations = []
+        for i in range(len(self.page)):
+            key = (self.type_code[i], self.block[i] % 2 == 0)
+            if key not in colors:
+                colors[key] = get_color(self.types[key[0]], key[1])
+            annotations.append({'page': self.page[i], 'x': self.x[i], 'y': self.y[i], 'width': self.width[i],
+                                'height': self.height[i], 'color': colors[key], 'type': self.types[key[0]]})
+        return annotations
+
+
+def _collect_boxes(elements):
+    """TeiBoxes from elements given in document order, as start events or a tree walk yield them."""
+    boxes = TeiBoxes()
+    type_codes = {}
+    block = 0
+    for elem in elements:
+        tag = elem.tag
+        if not isinstance(tag, str):
+            continue
+        name = tag[len(TEI_NS):] if tag.startswith(TEI_NS) else tag.rsplit('}', 1)[-1]
+        if name == 'surface':
+            boxes.page_sizes.append({'width': float(elem.get('lrx')) - float(elem.get('ulx')),
+                                     'height': float(elem.get('lry')) - float(elem.get('uly'))})
+        coords = elem.get('coords')
+        if coords is None:
+            continue
+        code = type_codes.get(name)
+        if code is None:
+            code = type_codes[name] = len(boxes.types)
+            boxes.types.append(name)
+        for box in coords.split(';'):
+            if not box:
+                continue
+            values = box.split(',')
+            boxes.page.append(int(float(values[0])))
+            boxes.x.append(float(values[1]))
+            boxes.y.append(float(values[2]))
+            boxes.width.append(float(values[3]))
+            boxes.height.append(float(values[4]))
+            boxes.type_code.append(code)
+            boxes.block.append(block)
+        block += 1
+    return boxes
+
+
+def _started(source):
+    for event, elem in etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+        if event == 'end':
+            # attributes were read on start, children are done: drop the subtree to keep memory flat
+            elem.clear(keep_tail=True)
+            continue
+        yield elem
+
+
+def parse_tei(source):
+    """Parse TEI from a string, bytes or path in a single streaming pass."""
+    if isinstance(source, str) and source.lstrip().startswith('<'):
+        source = source.encode('utf-8')
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return _collect_boxes(_started(source))
+
+
+def boxes_from_tree(root):
+    """TeiBoxes of an already parsed TEI tree, for callers that need more than the boxes from it."""
+    return _collect_boxes(root.iter())
@@ -0,0 +1,128 @@
+"""Offline Grobid pre-processing for the PDF corpus.
+
+Runs Grobid over every new or changed PDF in resources/pdf, writes the TEI XML next to the others in
+resources/xml and the precomputed annotation coordinates under resources/annotations, and adds the
+passages to the full-text index, so the apps never have to call Grobid while a user waits.
+
+    python ingest.py --workers 4
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from grobid_client.grobid_client import GrobidClient
+
+import database
+import search_index
+import util
+from grobid.grobid_processor import GrobidProcessor
+
+DB_PATH = database.DB_PATH
+PDF_DIR = 'resources/pdf'
+XML_DIR = 'resources/xml'
+
+
+def init_grobid(grobid_server='http://localhost:8070/'):
+    grobid_client = GrobidClient(
+        grobid_server=grobid_server,
+        batch_size=1000,
+        coordinates=["p", "s", "persName", "biblStruct", "figure", "formula", "head", "note", "title", "ref",
+                     "affiliation"],
+        sleep_time=5,
+        timeout=60,
+        check_server=True
+    )
+    return GrobidProcessor(grobid_client)
+
+
+def xml_path(filename, xml_dir=XML_DIR):
+    return os.path.join(xml_dir, f"{filename[:-4]}.grobid.tei.xml")
+
+
+class IngestStatus:
+    """Per-document progress in the `ingest` table, so an interrupted run resumes where it stopped."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def _connect(self):
+        return database.thread_connection(self.db_path)
+
+    def get(self, filename):
+        with self._connect() as conn:
+            return conn.execute('select hash, status from ingest where filename = ?', (filename,)).fetchone()
+
+    def set(self, filename, pdf_hash, status, pages=None, error=None):
+        with self._connect() as conn, database.write_transaction(conn):
+            conn.execute('insert or replace into ingest(filename, hash, status, pages, error, updated_at) '
+                         'values (?, ?, ?, ?, ?, ?)', (filename, pdf_hash, status, pages, error, time.time()))
+
+
+def pending_documents(status, pdf_dir=PDF_DIR, xml_dir=XML_DIR, force=False):
+    """Yield (filename, hash) for the PDFs that have no finished run for their current content."""
+    for filename in sorted(os.listdir(pdf_dir)):
+        if not filename.lower().endswith('.pdf'):
+            continue
+        pdf_hash = util.get_file_hash(os.path.join(pdf_dir, filename))
+        row = status.get(filename)
+        done = row is not None and row == (pdf_hash, 'done') and os.path.exists(xml_path(filename, xml_dir)) \
+            and os.path.exists(GrobidProcessor.annotations_path(pdf_hash))
+        if force or not done:
+            yield filename, pdf_hash
+
+
+def ingest_document(processor, status, filename, pdf_hash, pdf_dir=PDF_DIR, xml_dir=XML_DIR):
+    status.set(filename, pdf_hash, 'processing')
+    text = processor.process_tei(os.path.join(pdf_dir, filename))
+    if text is None:
+        status.set(filename, pdf_hash, 'failed', error='grobid returned an error status')
+        return False
+    target = xml_path(filename, xml_dir)
+    with open(target + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(target + '.tmp', target)
+    coordinates, pages = processor.parse_structure(text)
+    GrobidProcessor.write_annotations(pdf_hash, coordinates, pages)
+    search_index.index_document(filename, target, pdf_hash, status.db_path)
+    status.set(filename, pdf_hash, 'done', pages=pages)
+    return True
+
+
+def ingest(processor, workers=4, pdf_dir=PDF_DIR, xml_dir=XML_DIR, db_path=DB_PATH, force=False):
+    status = IngestStatus(db_path)
+    os.makedirs(xml_dir, exist_ok=True)
+    documents = list(pending_documents(status, pdf_dir, xml_dir, force))
+    logging.info(f"{len(documents)} documents to process with {workers} workers")
+    succeeded = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(ingest_document, processor, status, filename, pdf_hash, pdf_dir, xml_dir):
+                   (filename, pdf_hash) for filename, pdf_hash in documents}
+        for future in as_completed(futures):
+            filename, pdf_hash = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                logging.exception(f"failed to ingest {filename}")
+                status.set(filename, pdf_hash, 'failed', error=str(e))
+                ok = False
+            succeeded += ok
+            logging.info(f"{'done' if ok else 'failed'} {filename}")
+    return succeeded, len(documents) - succeeded
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Run Grobid over new or changed PDFs of the corpus.')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent Grobid requests')
+    parser.add_argument('--grobid-server', default='http://localhost:8070/')
+    parser.add_argument('--pdf-dir', default=PDF_DIR)
+    parser.add_argument('--xml-dir', default=XML_DIR)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--force', action='store_true', help='reprocess documents that are already done')
+    args = parser.parse_args()
+
+    succeeded, failed = ingest(init_grobid(args.grobid_server), args.workers, args.pdf_dir, args.xml_dir, args.db,
+                               args.force)
+    print(f"processed {succeeded} documents, {failed} failed")
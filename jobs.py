@@ -0,0 +1,452 @@
+"""Persistent queue for the slow work of the apps: summaries, labels, searches and Grobid runs.
+
+The apps submit a job and look at it again on later reruns instead of calling OpenAI or Grobid
+inside the script, so a rerun returns at once and the work is not thrown away when the user
+interacts midway. Jobs are rows of the `job` table keyed by what they compute, so two sessions
+asking the same question share one job and a finished job answers later requests until it is
+removed. Summaries and labels are streamed, the answer so far is kept in the job's `partial` column
+for the apps to show while it runs. Worker threads of the app process run the jobs, started with the
+queue; a process without UI can work the same queue:
+
+    python jobs.py --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import bootstrap
+import database
+import metrics
+import openai_service
+import section_routing
+import util
+from grobid.grobid_processor import GrobidProcessor
+
+DB_PATH = database.DB_PATH
+PDF_DIR = 'resources/pdf'
+XML_DIR = 'resources/xml'
+# worker threads started with the queue of an app process, 0 leaves the jobs to `python jobs.py`; this bounds the
+# concurrent OpenAI calls of the apps, whose request and token rates are limited by openai_client (OPENAI_RPM/TPM)
+WORKERS = int(os.getenv('JOB_WORKERS', 8))
+# idle workers look for jobs of other processes this often, jobs of their own process wake them at once
+POLL_SECONDS = 1.0
+# a running job whose lease was not renewed for this long is taken to belong to a stopped worker and run again;
+# the worker running it renews the lease every third of this
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+# finished jobs are removed after this long
+RETENTION_SECONDS = 7 * 24 * 3600
+# a streaming job writes the answer so far to its row at most this often
+PARTIAL_SECONDS = 0.5
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+PENDING = (QUEUED, RUNNING)
+# jobs nobody waits for, run when no job of a user is queued
+BACKGROUND = -1
+
+HANDLERS = {}
+# kinds whose handlers take a partial callback for the answer so far
+STREAMING = set()
+
+
+class Cancelled(Exception):
+    """Raised in a streaming handler whose job was cancelled, or claimed by another worker, while it ran."""
+
+
+class Job:
+    __slots__ = ('key', 'kind', 'status', 'result', 'error', 'partial')
+
+    def __init__(self, key, kind, status, result=None, error=None, partial=None):
+        self.key = key
+        self.kind = kind
+        self.status = status
+        self.result = result
+        self.error = error
+        self.partial = partial
+
+    @property
+    def pending(self):
+        return self.status in PENDING
+
+
+def _job(row):
+    key, kind, status, result, error, partial = row
+    return Job(key, kind, status, json.loads(result) if result is not None else None, error, partial)
+
+
+class JobQueue:
+    def __init__(self, db_path=DB_PATH, lease=LEASE_SECONDS):
+        self.db_path = db_path
+        self.lease = lease
+        self._wakeup = threading.Condition()
+
+    def _connect(self):
+        return database.thread_connection(self.db_path)
+
+    def submit(self, key, kind, payload, retry=False, priority=0):
+        """Queue a job unless one with this key exists and return it.
+
+        A cancelled job is queued again, a failed one only with retry, so a failing job is not resent
+        on every rerun of the page showing its error.
+        """
+        job = self.get(key)
+        if job is not None and (job.status != CANCELLED and not (retry and job.status == FAILED)):
+            metrics.cache_lookup('job', 'hit' if job.status == DONE else job.status)
+            if job.status == QUEUED and priority > BACKGROUND:
+                # a user now waits for a job that was queued in the background
+                with self._connect() as conn, database.write_transaction(conn):
+                    conn.execute('update job set priority = ? where key = ? and priority < ?',
+                                 (priority, key, priority))
+            return job
+        metrics.cache_lookup('job', 'miss')
+        with self._connect() as conn, database.write_transaction(conn):
+            conn.execute('insert into job(key, kind, payload, status, priority, created_at) values (?, ?, ?, ?, ?, ?) '
+                         'on conflict(key) do update set payload = excluded.payload, status = excluded.status, '
+                         'priority = excluded.priority, result = null, error = null, partial = null, attempts = 0, '
+                         'created_at = excluded.created_at, started_at = null, finished_at = null, run = null, renewed_at = null '
+                         'where job.status in (?, ?)',
+                         (key, kind, json.dumps(payload), QUEUED, priority, time.time(), FAILED, CANCELLED))
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(key)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('select key, kind, status, result, error, partial from job where key = ?',
+                               (key,)).fetchone()
+        return _job(row) if row is not None else None
+
+    def get_many(self, keys):
+        """{key: Job} of the keys that have a job."""
+        keys = list(keys)
+        jobs = {}
+        with self._connect() as conn:
+            # below the default limit of 999 parameters per statement
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = conn.execute(f'select key, kind, status, result, error, partial from job '
+                                    f'where key in ({", ".join("?" * len(part))})', part).fetchall()
+                jobs.update((row[0], _job(row)) for row in rows)
+        return jobs
+
+    def claim(self, kinds=None):
+        """Mark the oldest runnable job of the highest priority as running.
+
+        Returns (Job, payload, run), None when there is none. run identifies this claim of the job, the
+        writes of its worker only apply while the job is still running under it.
+        """
+        kinds = list(kinds or HANDLERS)
+        now = time.time()
+        query = (f'select key from job where kind in ({", ".join("?" * len(kinds))}) and attempts < ? and '
+                 f'(status = ? or (status = ? and renewed_at < ?)) order by priority desc, created_at limit 1')
+        params = [*kinds, MAX_ATTEMPTS, QUEUED, RUNNING, now - self.lease]
+        with self._connect() as conn:
+            # looked up before taking the write lock, so idle workers don't queue up on it
+            if conn.execute(query, params).fetchone() is None:
+                return None
+            with database.write_transaction(conn):
+                row = conn.execute(query, params).fetchone()
+                if row is None:
+                    return None
+                run = uuid.uuid4().hex
+                conn.execute('update job set status = ?, started_at = ?, renewed_at = ?, run = ?, '
+                             'attempts = attempts + 1 where key = ?', (RUNNING, now, now, run, row[0]))
+                key, kind, payload = conn.execute('select key, kind, payload from job where key = ?',
+                                                  (row[0],)).fetchone()
+        return Job(key, kind, RUNNING), json.loads(payload), run
+
+    def _finish(self, key, run, status, result=None, error=None):
+        with self._connect() as conn, database.write_transaction(conn):
+            updated = conn.execute('update job set status = ?, result = ?, error = ?, partial = null, finished_at = ? '
+                                   'where key = ? and run = ? and status = ?',
+                                   (status, json.dumps(result) if result is not None else None, error, time.time(),
+                                    key, run, RUNNING)).rowcount
+        if not updated:
+            logging.info(f"job {key} was cancelled or claimed again while it ran, its {status} result is dropped")
+
+    def renew(self, key, run):
+        """Extend the lease of a running job, False when it no longer runs under this claim."""
+        with self._connect() as conn, database.write_transaction(conn):
+            return conn.execute('update job set renewed_at = ? where key = ? and run = ? and status = ?',
+                                (time.time(), key, run, RUNNING)).rowcount > 0
+
+    def _keep_leased(self, key, run, done):
+        """Renew the lease of a running job until done is set, so a long job is not claimed a second time."""
+        while not done.wait(self.lease / 3):
+            try:
+                if not self.renew(key, run):
+                    return
+            except Exception:
+                logging.exception(f"renewing the lease of job {key} failed")
+
+    def set_partial(self, key, run, text):
+        """Store the answer so far of a running job, False when it no longer runs under this claim."""
+        with self._connect() as conn, database.write_transaction(conn):
+            return conn.execute('update job set partial = ?, renewed_at = ? where key = ? and run = ? and status = ?',
+                                (text, time.time(), key, run, RUNNING)).rowcount > 0
+
+    def _running(self, key, run):
+        with self._connect() as conn:
+            return conn.execute('select 1 from job where key = ? and run = ? and status = ?',
+                                (key, run, RUNNING)).fetchone() is not None
+
+    def _partial_writer(self, key, run):
+        """Callback for a streaming handler, writes the answer so far every PARTIAL_SECONDS.
+
+        Raises Cancelled once the job no longer runs under this claim, which stops the handler before it
+        caches its answer. Every delta is checked, including the last one.
+        """
+        written_at = 0.0
+
+        def write(text):
+            nonlocal written_at
+            if time.perf_counter() - written_at >= PARTIAL_SECONDS:
+                written_at = time.perf_counter()
+                running = self.set_partial(key, run, text)
+            else:
+                running = self._running(key, run)
+            if not running:
+                raise Cancelled(key)
+
+        return write
+
+    def finish(self, key, run, result):
+        self._finish(key, run, DONE, result=result)
+
+    def fail(self, key, run, error):
+        self._finish(key, run, FAILED, error=error)
+
+    def cancel(self, keys, running=False):
+        """Cancel the given jobs that have not started yet, with running also the ones that have.
+
+        A cancelled streaming job stops at its next delta, other handlers run to the end but their result
+        is dropped.
+        """
+        keys = list(keys)
+        statuses = PENDING if running else (QUEUED,)
+        with self._connect() as conn, database.write_transaction(conn):
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                conn.execute(f'update job set status = ?, partial = null, finished_at = ? '
+                             f'where status in ({", ".join("?" * len(statuses))}) '
+                             f'and key in ({", ".join("?" * len(part))})',
+                             [CANCELLED, time.time(), *statuses, *part])
+
+    def remove(self, key):
+        """Forget a job, the next submit with its key runs it again."""
+        with self._connect() as conn, database.write_transaction(conn):
+            conn.execute('delete from job where key = ? and status != ?', (key, RUNNING))
+
+    def prune(self, retention=RETENTION_SECONDS):
+        """Remove old finished jobs and fail the ones whose workers stopped too often."""
+        now = time.time()
+        with self._connect() as conn, database.write_transaction(conn):
+            conn.execute('delete from job where status in (?, ?, ?) and coalesce(finished_at, created_at) < ?',
+                         (DONE, FAILED, CANCELLED, now - retention))
+            conn.execute('update job set status = ?, error = ?, finished_at = ? '
+                         'where status = ? and attempts >= ? and renewed_at < ?',
+                         (FAILED, 'the worker stopped before finishing', now, RUNNING, MAX_ATTEMPTS, now - self.lease))
+
+    def wait(self, timeout):
+        """Sleep until a job is submitted in this process, or timeout."""
+        with self._wakeup:
+            self._wakeup.wait(timeout)
+
+    def run_next(self, kinds=None):
+        """Run one job, returns False when there was none."""
+        claimed = self.claim(kinds)
+        if claimed is None:
+            return False
+        job, payload, run = claimed
+        done = threading.Event()
+        threading.Thread(target=self._keep_leased, args=(job.key, run, done), name=f'job-lease-{run[:8]}',
+                         daemon=True).start()
+        try:
+            with metrics.timer('job', kind=job.kind):
+                if job.kind in STREAMING:
+                    payload['partial'] = self._partial_writer(job.key, run)
+                result = HANDLERS[job.kind](**payload)
+        except Cancelled:
+            logging.info(f"{job.kind} job {job.key} was cancelled while it ran")
+        except Exception as e:
+            logging.exception(f"{job.kind} job {job.key} failed")
+            self.fail(job.key, run, f'{type(e).__name__}: {e}')
+        else:
+            self.finish(job.key, run, result)
+        finally:
+            done.set()
+        return True
+
+    def work(self, kinds=None, stop_event=None):
+        """Worker loop: run jobs until stop_event is set, pruning now and then while idle."""
+        pruned_at = 0
+        while stop_event is None or not stop_event.is_set():
+            try:
+                if self.run_next(kinds):
+                    continue
+                if time.time() - pruned_at > 3600:
+                    self.prune()
+                    pruned_at = time.time()
+            except Exception:
+                logging.exception("job worker error")
+            self.wait(POLL_SECONDS)
+
+    def start_workers(self, workers=WORKERS, kinds=None):
+        for number in range(workers):
+            threading.Thread(target=self.work, args=(kinds,), name=f'job-worker-{number}', daemon=True).start()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """The queue of the app database, with WORKERS worker threads started on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                queue = JobQueue()
+                queue.start_workers()
+                _queue = queue
+    return _queue
+
+
+def handler(kind, streams=False):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        if streams:
+            STREAMING.add(kind)
+        return fn
+
+    return decorator
+
+
+@handler('answer', streams=True)
+def run_answer(pdf_path, query, partial=None):
+    return openai_service.chat_with_pdf(pdf_path, query, on_delta=partial)
+
+
+@handler('label', streams=True)
+def run_label(pdf_path, query, use_retrieval=False, sections=None, partial=None):
+    # retrieval answers come in one piece
+    if use_retrieval:
+        response, chunk_ids = openai_service.chat_with_pdf_retrieval(pdf_path, query)
+        return {'response': str(response), 'chunk_ids': chunk_ids}
+    if sections:
+        response, routed = openai_service.chat_with_pdf_sections(pdf_path, query, sections, on_delta=partial)
+        return {'response': response, 'chunk_ids': None, 'sections': sections if routed else None}
+    return {'response': openai_service.chat_with_pdf(pdf_path, query, on_delta=partial), 'chunk_ids': None}
+
+
+_grobid_processor = None
+
+
+@handler('extract')
+def run_extract(pdf_path):
+    """Page texts of a PDF into the page cache, the prompts of its labels and searches read them from there."""
+    text = openai_service.pdf_to_text(pdf_path)
+    if text is None:
+        raise RuntimeError('the PDF could not be read')
+    return {'characters': len(text)}
+
+
+@handler('grobid')
+def run_grobid(filename, pdf_dir=PDF_DIR, xml_dir=XML_DIR):
+    """TEI, annotation file and index entries of a PDF, like an ingest run for one document.
+
+    A TEI that was produced with coordinates before is used as it is, without sending the PDF again.
+    """
+    import ingest
+    import search_index
+
+    status = ingest.IngestStatus()
+    pdf_path = os.path.join(pdf_dir, filename)
+    pdf_hash = util.get_file_hash(pdf_path)
+    xml_path = ingest.xml_path(filename, xml_dir)
+    structure = GrobidProcessor(None).load_structure(pdf_path, xml_path, remote=False)
+    if structure is not None:
+        if os.path.exists(xml_path):
+            search_index.index_document(filename, xml_path, pdf_hash)
+        status.set(filename, pdf_hash, 'done', pages=structure[1])
+        return {'hash': pdf_hash}
+
+    global _grobid_processor
+    if _grobid_processor is None:
+        _grobid_processor = GrobidProcessor(bootstrap.LazyGrobidClient(
+            batch_size=1000,
+            coordinates=["p", "s", "persName", "biblStruct", "figure", "formula", "head", "note", "title", "ref",
+                         "affiliation"],
+            sleep_time=5,
+            timeout=60
+        ))
+    if not _grobid_processor.grobid_client.is_available():
+        raise RuntimeError(f"Grobid is not reachable at {bootstrap.GROBID_SERVER}")
+    try:
+        ok = ingest.ingest_document(_grobid_processor, status, filename, pdf_hash, pdf_dir, xml_dir)
+    except Exception as e:
+        status.set(filename, pdf_hash, 'failed', error=str(e))
+        raise
+    if not ok:
+        raise RuntimeError('Grobid returned an error status')
+    return {'hash': pdf_hash}
+
+
+def answer_key(pdf_path, query):
+    return f'answer:{openai_service.get_cache_key(pdf_path, query)}'
+
+
+def answer(pdf_path, query, queue=None, retry=False):
+    """Job answering query about the PDF; a cached answer comes back as a done job without queueing."""
+    key = openai_service.get_cache_key(pdf_path, query)
+    cached = openai_service.response_cache.get(key)
+    if cached is not None:
+        return Job(f'answer:{key}', 'answer', DONE, cached)
+    return (queue or get_job_queue()).submit(f'answer:{key}', 'answer', {'pdf_path': pdf_path, 'query': query},
+                                             retry=retry)
+
+
+def label(pdf_path, query, use_retrieval=False, variable=None, queue=None, retry=False):
+    """Job labeling the PDF; without retrieval the prompt of a routed variable gets only its sections."""
+    key = openai_service.get_cache_key(pdf_path, query)
+    sections = None if use_retrieval or variable is None else section_routing.sections_for(variable)
+    if sections:
+        return (queue or get_job_queue()).submit(f"label:sections={','.join(sorted(sections))}:{key}", 'label',
+                                                 {'pdf_path': pdf_path, 'query': query, 'sections': sections},
+                                                 retry=retry)
+    if not use_retrieval:
+        cached = openai_service.response_cache.get(key)
+        if cached is not None:
+            return Job(f'label:0:{key}', 'label', DONE, {'response': cached, 'chunk_ids': None})
+    return (queue or get_job_queue()).submit(f'label:{int(use_retrieval)}:{key}', 'label',
+                                             {'pdf_path': pdf_path, 'query': query, 'use_retrieval': use_retrieval},
+                                             retry=retry)
+
+
+def grobid(filename, queue=None, retry=False, priority=0, pdf_dir=PDF_DIR):
+    pdf_hash = util.get_file_hash(os.path.join(pdf_dir, filename))
+    return (queue or get_job_queue()).submit(f'grobid:{pdf_hash}', 'grobid', {'filename': filename, 'pdf_dir': pdf_dir},
+                                             retry=retry, priority=priority)
+
+
+def extract(pdf_path, queue=None, retry=False, priority=BACKGROUND):
+    pdf_hash = util.get_file_hash(pdf_path)
+    return (queue or get_job_queue()).submit(f'extract:{pdf_hash}', 'extract', {'pdf_path': pdf_path}, retry=retry,
+                                             priority=priority)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Run the queued jobs of the apps.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--kind', action='append', choices=sorted(HANDLERS), help='only jobs of this kind')
+    args = parser.parse_args()
+
+    queue = JobQueue()
+    queue.start_workers(args.workers - 1, args.kind)
+    logging.info(f"{args.workers} workers on {queue.db_path}")
+    queue.work(args.kind)
@@ -0,0 +1,134 @@
+"""Exports of the `label` table, streamed from SQLite to disk and reused until the table changes.
+
+Triggers from the database migrations bump a counter in `table_version` on every write to `label`,
+so checking whether a cached export is still current costs one single-row query. Rows go from the
+cursor to the file in batches and are never held as a whole frame.
+
+    python label_export.py --kind labels --format parquet
+"""
+import argparse
+import contextlib
+import csv
+import glob
+import os
+import threading
+
+import database
+import metrics
+
+DB_PATH = database.DB_PATH
+EXPORT_DIR = 'resources/exports'
+BATCH_ROWS = 5000
+# exports of older versions are deleted, but the one before the newest is kept: another session may
+# just have been handed its path and not opened it yet
+KEEP_VERSIONS = 2
+
+# the first one is the default, CSV as before the other formats were added
+FORMATS = {
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+KINDS = ('labels', 'log')
+LOG_COLUMNS = ['doc_id', 'variable', 'label', 'ai_label', 'manual_label', 'prompt_version']
+
+
+def label_matrix_query(conn):
+    """(header, sql, params) pivoting label to one row per document and one column per variable."""
+    variables = [v for v, in conn.execute('select distinct variable from label order by variable')]
+    columns = ', '.join(["coalesce(max(case when variable = ? then label end), '')"] * len(variables))
+    sql = f"select doc_id{', ' + columns if columns else ''} from label group by doc_id order by doc_id"
+    return ['DOC_ID'] + variables, sql, variables
+
+
+def log_query(conn):
+    return LOG_COLUMNS, f"select {', '.join(LOG_COLUMNS)} from label order by doc_id, variable", ()
+
+
+QUERIES = {'labels': label_matrix_query, 'log': log_query}
+
+
+def _batches(cursor):
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            return
+        yield rows
+
+
+def write_delimited(path, header, cursor, delimiter):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=delimiter, lineterminator='\n')
+        writer.writerow(header)
+        for rows in _batches(cursor):
+            writer.writerows(rows)
+
+
+def write_arrow(path, header, cursor, fmt):
+    import pyarrow as pa
+
+    schema = pa.schema([(name, pa.string()) for name in header])
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    try:
+        for rows in _batches(cursor):
+            columns = [[None if v is None else str(v) for v in column] for column in zip(*rows)]
+            writer.write_batch(pa.RecordBatch.from_arrays([pa.array(c, pa.string()) for c in columns],
+                                                          schema=schema))
+    finally:
+        writer.close()
+
+
+class LabelExporter:
+    def __init__(self, db_path=DB_PATH, export_dir=EXPORT_DIR):
+        self.db_path = db_path
+        self.export_dir = export_dir
+        # the file is migrated before the first export reads it
+        database.thread_connection(db_path)
+
+    def export(self, kind='labels', fmt='csv'):
+        """Path of the export for the current content of `label`, written only if it is not on disk yet."""
+        if kind not in QUERIES or fmt not in FORMATS:
+            raise ValueError(f"unknown export {kind} as {fmt}")
+        with metrics.timer('label_export', kind=kind, format=fmt):
+            return self._export(kind, fmt)
+
+    def _export(self, kind, fmt):
+        os.makedirs(self.export_dir, exist_ok=True)
+        with database.thread_connection(self.db_path) as conn:
+            # one read transaction, so the version in the name matches the rows that are written
+            conn.execute('begin')
+            version = conn.execute("select version from table_version where name = 'label'").fetchone()[0]
+            path = os.path.join(self.export_dir, f'{kind}-v{version}.{fmt}')
+            if os.path.exists(path):
+                metrics.cache_lookup('label_export', 'hit')
+                return path
+            metrics.cache_lookup('label_export', 'miss')
+            header, sql, params = QUERIES[kind](conn)
+            cursor = conn.execute(sql, params)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            if fmt in ('csv', 'tsv'):
+                write_delimited(tmp_path, header, cursor, ',' if fmt == 'csv' else '\t')
+            else:
+                write_arrow(tmp_path, header, cursor, fmt)
+        os.replace(tmp_path, path)
+        versions = sorted(glob.glob(os.path.join(self.export_dir, f'{kind}-v*.{fmt}')),
+                          key=lambda p: int(os.path.basename(p)[len(kind) + 2:-len(fmt) - 1]))
+        for old in versions[:-KEEP_VERSIONS]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(old)
+        return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the label table.')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--export-dir', default=EXPORT_DIR)
+    parser.add_argument('--kind', choices=KINDS, default='labels')
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    args = parser.parse_args()
+    print(LabelExporter(args.db, args.export_dir).export(args.kind, args.format))
@@ -0,0 +1,284 @@
+"""Process-wide stage timings, token usage and cache hit rates.
+
+Wrap a stage with `with metrics.timer('pdf_to_text'):` or `@metrics.timed('pdf_to_text')`. Durations
+go to fixed-bucket histograms, so recording one is a bisect and a few increments under a lock. The
+values are kept in memory and shown in the apps' sidebar. A process that calls metrics.start(), which
+the two apps do, also writes them out every METRICS_FLUSH_SECONDS and on exit:
+
+- as Prometheus text to METRICS_PROM_PATH, and served on http://localhost:METRICS_PORT/metrics
+  when that is set. Give each process its own path when running both apps.
+- to the `metrics` table, one row per process and series holding its totals since the process
+  started, updated on every flush. Rows not updated for METRICS_RETENTION_DAYS are deleted.
+
+CLIs, benchmarks and scripts only record in memory and never touch the database or the file.
+"""
+import atexit
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, the last bucket is everything above
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+PROM_PATH = os.getenv('METRICS_PROM_PATH', 'resources/metrics.prom')
+PORT = int(os.getenv('METRICS_PORT', 0))
+FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 60))
+# rows of the `metrics` table not updated for this long, stopped processes, are deleted when a process flushes
+RETENTION_DAYS = float(os.getenv('METRICS_RETENTION_DAYS', 7))
+# cache lookups with this result count against the hit rate, every other result is a hit
+MISS = 'miss'
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, capped by the largest value seen."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return 0.0
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class Metrics:
+    def __init__(self):
+        self.started_at = time.time()
+        # (name, ((label, value), ...)) -> Histogram or number
+        self.histograms = {}
+        self.counters = {}
+        self.changes = 0
+        self._flushed_changes = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+            self.changes += 1
+
+    def increment(self, name, amount=1, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self.changes += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def cache_lookup(self, cache, result):
+        """Count a lookup of a cache: 'hit', 'miss' or where it was found ('memory', 'disk', ...)."""
+        self.increment('cache_lookups_total', cache=cache, result=result)
+
+    def record_usage(self, model, usage):
+        """Token counts of the `usage` field of a completion."""
+        if usage is None:
+            return
+        self.increment('openai_tokens_total', usage.prompt_tokens, model=model, kind='prompt')
+        self.increment('openai_tokens_total', usage.completion_tokens, model=model, kind='completion')
+
+    def stage_rows(self):
+        """[{stage, labels, count, mean ms, p50 ms, p95 ms, max ms}] of the stage timers, slowest total first."""
+        with self._lock:
+            items = [(dict(labels), h.count, h.sum, h.quantile(.5), h.quantile(.95), h.max)
+                     for (name, labels), h in self.histograms.items() if name == 'stage_seconds']
+        rows = [{'stage': labels.pop('stage'), 'labels': _labels(sorted(labels.items())), 'count': count,
+                 'mean ms': round(total / count * 1000, 1), 'p50 ms': round(p50 * 1000, 1),
+                 'p95 ms': round(p95 * 1000, 1), 'max ms': round(longest * 1000, 1), '_total': total}
+                for labels, count, total, p50, p95, longest in items]
+        rows.sort(key=lambda row: -row.pop('_total'))
+        return rows
+
+    def cache_rows(self):
+        """[{cache, lookups, hit rate}]"""
+        lookups = {}
+        with self._lock:
+            for (name, labels), count in self.counters.items():
+                if name == 'cache_lookups_total':
+                    labels = dict(labels)
+                    total, misses = lookups.get(labels['cache'], (0, 0))
+                    lookups[labels['cache']] = total + count, misses + (count if labels['result'] == MISS else 0)
+        return [{'cache': cache, 'lookups': total, 'hit rate': round(1 - misses / total, 3)}
+                for cache, (total, misses) in sorted(lookups.items())]
+
+    def token_rows(self):
+        """[{model, kind, tokens}]"""
+        with self._lock:
+            return [{**dict(labels), 'tokens': count} for (name, labels), count in sorted(self.counters.items())
+                    if name == 'openai_tokens_total']
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for metric in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {metric} histogram')
+                for (name, labels), h in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), h.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+                    lines.append(f'{name}_sum{{{_labels(labels)}}} {h.sum}')
+                    lines.append(f'{name}_count{{{_labels(labels)}}} {h.count}')
+            for metric in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {metric} counter')
+                lines += [f'{name}{{{_labels(labels)}}} {count}'
+                          for (name, labels), count in sorted(self.counters.items()) if name == metric]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=PROM_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def write_table(self, db_path=None):
+        """Upsert this process's totals into the `metrics` table, one row per series, and drop the expired rows."""
+        import database
+
+        now, pid = time.time(), os.getpid()
+        with self._lock:
+            rows = [(pid, self.started_at, name, json.dumps(dict(labels)), now, h.count, h.sum, h.quantile(.5),
+                     h.quantile(.95), h.max) for (name, labels), h in self.histograms.items()]
+            rows += [(pid, self.started_at, name, json.dumps(dict(labels)), now, count, None, None, None, None)
+                     for (name, labels), count in self.counters.items()]
+        with database.thread_connection(db_path or database.DB_PATH) as conn, \
+                database.write_transaction(conn, observe=False):
+            conn.executemany('insert into metrics(pid, started_at, name, labels, recorded_at, count, sum, p50, p95, '
+                             'max) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                             'on conflict(pid, started_at, name, labels) do update set '
+                             'recorded_at = excluded.recorded_at, count = excluded.count, sum = excluded.sum, '
+                             'p50 = excluded.p50, p95 = excluded.p95, max = excluded.max', rows)
+            if RETENTION_DAYS:
+                conn.execute('delete from metrics where recorded_at < ?', (now - RETENTION_DAYS * 86400,))
+
+    def flush(self):
+        """Write the Prometheus file and the table rows, when anything was recorded since the last flush."""
+        changes = self.changes
+        if changes == self._flushed_changes:
+            return
+        try:
+            if PROM_PATH:
+                self.write_prometheus()
+            self.write_table()
+            self._flushed_changes = changes
+        except Exception as e:
+            logging.warning(f"could not write metrics: {e}")
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            self.flush()
+
+    def serve(self, port=PORT):
+        """Serve the Prometheus text on /metrics from a daemon thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        except OSError as e:
+            logging.warning(f"metrics endpoint not started on port {port}: {e}")
+            return
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info(f"metrics served on http://127.0.0.1:{port}/metrics")
+
+    def start(self):
+        """Flush periodically and on exit, and serve the endpoint; once per process, later calls do nothing."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if FLUSH_SECONDS:
+            threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+        if PORT:
+            self.serve()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
+
+
+def start():
+    """Write the metrics of this process out, see the module docstring; for the apps, on every rerun."""
+    get_metrics().start()
+
+
+def timer(stage, **labels):
+    return get_metrics().timer(stage, **labels)
+
+
+def timed(stage, **labels):
+    """Decorator timing every call of the function as the given stage."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_metrics().timer(stage, **labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def cache_lookup(cache, result):
+    get_metrics().cache_lookup(cache, result)
@@ -0,0 +1,127 @@
+"""One OpenAI client per process, with retries and request/token rate limits shared by every caller.
+
+The SDK client keeps its HTTP connection pool and TLS sessions alive between calls, so it is created
+once instead of per request. Retries are done here rather than by the SDK so they can honor the
+process-wide limits and Retry-After.
+"""
+import logging
+import os
+import threading
+import time
+
+import metrics
+import token_count
+from fanout import RateLimiter, call_with_retry
+
+REQUEST_TIMEOUT = float(os.getenv('OPENAI_REQUEST_TIMEOUT', 120))
+MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_RPM', 500))
+TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TPM', 300000))
+# completion tokens reserved per request before the real usage is known
+EXPECTED_COMPLETION_TOKENS = 1000
+
+
+def estimate_tokens(messages, model):
+    """Prompt tokens counted locally plus the expected completion, reserved before the request."""
+    prompt_tokens = token_count.count_message_tokens(messages, model)
+    logging.info(f"{model}: sending {prompt_tokens} prompt tokens")
+    return prompt_tokens + EXPECTED_COMPLETION_TOKENS
+
+
+class ClientManager:
+    def __init__(self, timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, backoff=1.0, base_url=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.base_url = base_url
+        self.request_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self.token_limiter = RateLimiter(tokens_per_minute, burst=tokens_per_minute) if tokens_per_minute else None
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # the SDK takes most of the app's import time, so it is loaded with the first request
+                    import openai
+                    self._client = openai.Client(timeout=self.timeout, max_retries=0,
+                                                 **({'base_url': self.base_url} if self.base_url else {}))
+        return self._client
+
+    def _acquire(self, estimated_tokens):
+        if self.request_limiter is not None:
+            self.request_limiter.acquire()
+        if self.token_limiter is not None:
+            self.token_limiter.acquire(estimated_tokens)
+
+    def create_chat_completion(self, messages, model, timeout=None, **kwargs):
+        """chat.completions.create through the shared client, rate limits and retry policy."""
+        estimated_tokens = estimate_tokens(messages, model)
+
+        def attempt():
+            self._acquire(estimated_tokens)
+            return self.client.chat.completions.create(model=model, messages=messages,
+                                                       timeout=timeout or self.timeout, **kwargs)
+
+        with metrics.timer('openai_completion', model=model):
+            completion = call_with_retry(attempt, self.max_retries, self.backoff)
+        usage = getattr(completion, 'usage', None)
+        metrics.get_metrics().record_usage(model, usage)
+        if self.token_limiter is not None and usage is not None:
+            self.token_limiter.adjust(usage.total_tokens - estimated_tokens)
+        return completion
+
+    def stream_chat_completion(self, messages, model, timeout=None, **kwargs):
+        """Yield the text deltas of a streamed completion.
+
+        Retries only cover opening the stream, a connection lost mid-answer raises to the caller.
+        """
+        estimated_tokens = estimate_tokens(messages, model)
+
+        def attempt():
+            self._acquire(estimated_tokens)
+            return self.client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                       stream_options={'include_usage': True},
+                                                       timeout=timeout or self.timeout, **kwargs)
+
+        start = time.perf_counter()
+        stream = call_with_retry(attempt, self.max_retries, self.backoff)
+        usage = first_token = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    metrics.get_metrics().observe('stage_seconds', first_token, stage='openai_first_token',
+                                                  model=model)
+                yield chunk.choices[0].delta.content
+        metrics.get_metrics().observe('stage_seconds', time.perf_counter() - start, stage='openai_stream',
+                                      model=model)
+        metrics.get_metrics().record_usage(model, usage)
+        if self.token_limiter is not None and usage is not None:
+            self.token_limiter.adjust(usage.total_tokens - estimated_tokens)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ClientManager()
+    return _manager
+
+
+def configure(**kwargs):
+    """Replace the process-wide manager, e.g. configure(requests_per_minute=60) from a batch job."""
+    global _manager
+    with _manager_lock:
+        _manager = ClientManager(**kwargs)
+    return _manager
@@ -1,10 +1,15 @@
 import dotenv
+import logging
 import os
-import PyPDF2
-import openai
-import fitz  # PyMuPDF
+import context_builder
+import metrics
+import openai_client
 import random
+import retrieval
+import section_routing
+import text_extraction
 import util
+from response_cache import ResponseCache
 
 dotenv.load_dotenv()
 openai_key = os.getenv('OPENAI_KEY')
@@ -14,51 +19,152 @@ fine_tuned_model = 'ft:gpt-3.5-turbo-1106:personal:label-datatype:9qirU0Ny'
 gpt4o_model = "gpt-4o"
 gpt4 = "gpt-4-turbo"
 
+system_prompt = 'you are a social scentist with a PhD in communication and media. You have read a paper as below:'
 
-def pdf_to_text(pdf_file_path, binsize=1, abstract=1, start_ratio=0.3, end_ratio=0.76):
+response_cache = ResponseCache()
+
+@metrics.timed('pdf_to_text')
+def pdf_to_text(pdf_file_path, binsize=1, abstract=1, start_ratio=0.3, end_ratio=0.76,
+                backend=text_extraction.DEFAULT_BACKEND):
     try:
-        with open(pdf_file_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ''
-            if binsize == 1:
-                start_num = 0
-                end_num = len(pdf_reader.pages)
-            else:
-                start_num = int(start_ratio * len(pdf_reader.pages))
-                end_num = int(end_ratio * len(pdf_reader.pages))
-            if abstract == 1:
-                # include the first two pages
-                text += pdf_reader.pages[0].extract_text() if pdf_reader.pages[0].extract_text() else ''
-                text += pdf_reader.pages[1].extract_text() if pdf_reader.pages[1].extract_text() else ''
-            for page_num in range(start_num, end_num):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() if page.extract_text() else ''
-
-            return text
-    except PyPDF2.errors.PdfReadError:
-        print(f"Error reading {pdf_file_path}: EOF marker not found")
-        # corrupted_pdf[label] = corrupted_pdf[label].append(pdf_file_path)
+        pages = text_extraction.get_pages(pdf_file_path, backend)
+    except text_extraction.PdfReadError as e:
+        logging.warning(f"Error reading {pdf_file_path}: {e}")
         return None
+    if binsize == 1:
+        start_num = 0
+        end_num = len(pages)
+    else:
+        start_num = int(start_ratio * len(pages))
+        end_num = int(end_ratio * len(pages))
+    selected = []
+    if abstract == 1:
+        # include the first two pages, unless the selected range already starts with them
+        selected += pages[:min(2, start_num)]
+    selected += pages[start_num:end_num]
+    return ''.join(selected)
+
+
+def build_messages(knowledge_base, query):
+    return [
+        {"role": "system",
+         "content": system_prompt + knowledge_base},
+        {"role": "user", "content": query}
+    ]
 
 
-def get_answer(knowledge_base, query, model):
-    client = openai.Client()
-    completion = client.chat.completions.create(
+@metrics.timed('get_answer')
+def get_answer(knowledge_base, query, model, timeout=None):
+    completion = openai_client.get_client_manager().create_chat_completion(
         model=model,
-        messages=[
-            {"role": "system",
-             "content": 'you are a social scentist with a PhD in communication and media. You have read a paper as below:' + knowledge_base},
-            {"role": "user", "content": query}
-        ])
+        timeout=timeout,
+        messages=build_messages(knowledge_base, query))
     return completion.choices[0].message.content
 
 
-def chat_with_pdf(pdf_file_path, query):
+def get_answer_stream(knowledge_base, query, model, timeout=None):
+    yield from openai_client.get_client_manager().stream_chat_completion(
+        model=model,
+        timeout=timeout,
+        messages=build_messages(knowledge_base, query))
+
+
+def get_cache_key(pdf_file_path, query, model=gpt4o_model):
+    return response_cache.make_key(util.get_file_hash(pdf_file_path), model, system_prompt, query,
+                                   'context', context_builder.CONTEXT_VERSION)
+
+
+def _answer_pdf(pdf_file_path, query, model, key=None, timeout=None, knowledge_base=None, on_delta=None):
+    if knowledge_base is None:
+        knowledge_base = context_builder.build_context(pdf_file_path, model)
+    elif callable(knowledge_base):
+        knowledge_base = knowledge_base()
+    if on_delta is None:
+        response = get_answer(knowledge_base, query, model=model, timeout=timeout)
+    else:
+        deltas = []
+        for delta in get_answer_stream(knowledge_base, query, model, timeout):
+            deltas.append(delta)
+            on_delta(''.join(deltas))
+        response = ''.join(deltas)
+    if key and response is not None:
+        response_cache.put(key, response, util.get_file_hash(pdf_file_path), model, query)
+    return response
+
+
+def chat_with_pdf(pdf_file_path, query, model=gpt4o_model, use_cache=True, timeout=None, knowledge_base=None,
+                  on_delta=None):
+    """Answer a query about a PDF, from the response cache when possible.
+
+    knowledge_base is the already extracted text of the PDF, or a callable returning it, for callers
+    that ask several questions about the same document; it is only used on a cache miss.
+    With on_delta the answer is streamed, on_delta is called with the text so far after every delta;
+    an answer that fails halfway is not cached.
+    """
     if pdf_file_path:
-        knowledge_base = pdf_to_text(pdf_file_path)
-        if query:
-            response = get_answer(knowledge_base, query, model=gpt4o_model)
-            return response
+        if not query:
+            return None
+        key = None
+        if use_cache:
+            key = get_cache_key(pdf_file_path, query, model)
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+        return _answer_pdf(pdf_file_path, query, model, key, timeout, knowledge_base, on_delta)
+
+
+def chat_with_pdf_retrieval(pdf_file_path, query, model=gpt4o_model, top_k=retrieval.DEFAULT_TOP_K,
+                            token_budget=retrieval.DEFAULT_TOKEN_BUDGET, use_cache=True, timeout=None):
+    """Answer from the passages of the paper that best match the query instead of the whole text.
+
+    Returns (response, chunk_ids), chunk_ids being the TEI passages that were sent. Papers without a
+    TEI file fall back to chat_with_pdf and return None as chunk_ids.
+    """
+    if not pdf_file_path or not query:
+        return None, None
+    xml_path = retrieval.xml_path_for(pdf_file_path)
+    if not os.path.exists(xml_path):
+        return chat_with_pdf(pdf_file_path, query, model=model, use_cache=use_cache, timeout=timeout), None
+    knowledge_base, chunk_ids = retrieval.build_context(xml_path, query, top_k, token_budget)
+    key = None
+    if use_cache:
+        key = response_cache.make_key(util.get_file_hash(pdf_file_path), model, system_prompt, query,
+                                      'retrieval', chunk_ids)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached, chunk_ids
+    response = get_answer(knowledge_base, query, model=model, timeout=timeout)
+    if key and response is not None:
+        response_cache.put(key, response, util.get_file_hash(pdf_file_path), model, query)
+    return response, chunk_ids
+
+
+def chat_with_pdf_sections(pdf_file_path, query, sections, model=gpt4o_model, use_cache=True, timeout=None,
+                           knowledge_base=None, on_delta=None):
+    """Answer a labeling prompt from the given section classes of the paper only.
+
+    Returns (response, routed). The whole paper is used instead, and routed is False, when there are
+    no sections, the paper has no TEI or too little text in them, or the answer from the sections
+    comes with low confidence. knowledge_base is passed on to chat_with_pdf for that fallback, on_delta
+    to both, so a streamed answer starts over when it falls back.
+    """
+    if not pdf_file_path or not query:
+        return None, False
+    if sections:
+        key, response = None, None
+        if use_cache:
+            key = response_cache.make_key(util.get_file_hash(pdf_file_path), model, system_prompt, query,
+                                          'sections', sorted(sections), context_builder.CONTEXT_VERSION)
+            response = response_cache.get(key)
+        if response is None:
+            section_text = context_builder.build_section_context(pdf_file_path, model, sections)
+            if section_text is not None:
+                response = _answer_pdf(pdf_file_path, query, model, key, timeout, section_text, on_delta)
+        if response is not None and not section_routing.low_confidence(response):
+            metrics.get_metrics().increment('section_routing_total', result='routed')
+            return response, True
+    metrics.get_metrics().increment('section_routing_total', result='whole paper')
+    return chat_with_pdf(pdf_file_path, query, model, use_cache, timeout, knowledge_base, on_delta), False
 
 
 if __name__ == "__main__":
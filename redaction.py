@@ -0,0 +1,63 @@
+"""Case-insensitive removal of many phrases (title, author names) from a text in a single pass.
+
+The phrases are merged into a prefix trie and compiled as one regex, so at each position of the
+text the engine follows a single branch per character instead of trying every phrase in turn; this
+keeps one pass cheaper than a scan per phrase even for hundreds of names. The longest phrase wins
+where several match, and whitespace inside a phrase matches any run of whitespace, so names broken
+over lines in the extracted text are found too.
+"""
+import re
+from functools import lru_cache
+
+_END = ''
+
+
+def _normalize(phrase):
+    return ' '.join(phrase.split()).lower()
+
+
+def _trie_pattern(node):
+    branches = [(r'\s+' if char == ' ' else re.escape(char)) + _trie_pattern(child)
+                for char, child in sorted(node.items()) if char != _END]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # greedy, so a longer phrase is preferred over one that ends here
+    return f'(?:{pattern})?' if _END in node else pattern
+
+
+class Redactor:
+    def __init__(self, replacements):
+        """replacements is an iterable of (phrase, replacement); empty and repeated phrases are ignored."""
+        self.replacements = {}
+        for phrase, replacement in replacements:
+            key = _normalize(phrase or '')
+            if key:
+                self.replacements.setdefault(key, replacement)
+        trie = {}
+        for key in self.replacements:
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[_END] = {}
+        self.pattern = re.compile(_trie_pattern(trie), re.IGNORECASE) if trie else None
+
+    def _replace(self, match):
+        # a phrase differing only in exotic case folding falls back to a space
+        return self.replacements.get(_normalize(match.group()), ' ')
+
+    def redact(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._replace, text)
+
+
+@lru_cache(maxsize=32)
+def get_redactor(replacements):
+    """Compiled Redactor for a tuple of (phrase, replacement), shared by repeated exports of a document."""
+    return Redactor(replacements)
+
+
+def redact_title_and_authors(text, title, person_names):
+    """The export redaction: the title is removed, each person name becomes a space."""
+    return get_redactor(((title, ''),) + tuple((name, ' ') for name in person_names)).redact(text)
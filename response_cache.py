@@ -0,0 +1,120 @@
+import hashlib
+import json
+import threading
+import time
+
+import database
+import metrics
+
+DB_PATH = database.DB_PATH
+
+# responses older than this are treated as missing and removed on the next eviction pass
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+# last_access is only moved forward once it is this old, eviction is least recently used to about an hour
+TOUCH_SECONDS = 3600
+
+
+class ResponseCache:
+    """LLM response cache stored in the `response_cache` table of the app database.
+
+    Entries are keyed by the content hash of the document, the model name, the system prompt
+    and the query, so renaming a file keeps its cached answers and editing a prompt does not
+    return stale ones.
+    """
+
+    def __init__(self, db_path=DB_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # key -> time of a hit whose last_access is not written yet
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return database.thread_connection(self.db_path)
+
+    @staticmethod
+    def make_key(doc_hash, model, system_prompt, query, *extra):
+        payload = json.dumps([doc_hash, model, system_prompt, query, *extra], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @metrics.timed('db', query='response_cache_get')
+    def get(self, key):
+        """The cached response or None; read only, the access time of a hit is written with the next put."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('select response, created_at, last_access from response_cache where key = ?',
+                               (key,)).fetchone()
+        if row is not None and self.ttl and row[1] < now - self.ttl:
+            # expired, removed by the next eviction
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if row[2] < now - TOUCH_SECONDS:
+                    self._touched[key] = now
+        metrics.cache_lookup('response', 'miss' if row is None else 'hit')
+        return row[0] if row is not None else None
+
+    def put(self, key, response, doc_hash, model, query):
+        self.put_many([(key, response, doc_hash, model, query)])
+
+    @metrics.timed('db', query='response_cache_put')
+    def put_many(self, entries, replace=True):
+        """Store (key, response, doc_hash, model, query) tuples; with replace=False existing keys are kept."""
+        now = time.time()
+        verb = 'insert or replace' if replace else 'insert or ignore'
+        with self._connect() as conn, database.write_transaction(conn):
+            conn.executemany(f'{verb} into response_cache(key, doc_hash, model, query, response, created_at, last_access) '
+                             'values (?, ?, ?, ?, ?, ?, ?)',
+                             [(key, doc_hash, model, query, response, now, now)
+                              for key, response, doc_hash, model, query in entries])
+            # in the same transaction, one write lock per put
+            self._evict(conn)
+
+    def invalidate(self, key=None, doc_hash=None, model=None):
+        """Remove the entries matching every given criterion and return how many were removed."""
+        clauses, params = [], []
+        for column, value in (('key', key), ('doc_hash', doc_hash), ('model', model)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if not clauses:
+            raise ValueError('invalidate needs a key, doc_hash or model, use clear() to drop everything')
+        with self._connect() as conn:
+            return conn.execute(f'delete from response_cache where {" and ".join(clauses)}', params).rowcount
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('delete from response_cache')
+
+    def evict(self):
+        """Write the pending access times, drop expired entries, then the least recently used ones above max_entries."""
+        with self._connect() as conn, database.write_transaction(conn):
+            self._evict(conn)
+
+    def _evict(self, conn):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            conn.executemany('update response_cache set last_access = max(last_access, ?) where key = ?',
+                             [(accessed_at, key) for key, accessed_at in touched.items()])
+        if self.ttl:
+            conn.execute('delete from response_cache where created_at < ?', (time.time() - self.ttl,))
+        if self.max_entries:
+            conn.execute('delete from response_cache where key in ('
+                         'select key from response_cache order by last_access desc limit -1 offset ?)',
+                         (self.max_entries,))
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute('select count(*) from response_cache').fetchone()[0]
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0, 'entries': entries}
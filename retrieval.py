@@ -0,0 +1,151 @@
+"""Local lexical retrieval over the TEI of a paper, used to send only the relevant passages to the LLM."""
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+from lxml import etree
+
+from token_count import count_tokens
+
+TEI = {'tei': 'http://www.tei-c.org/ns/1.0'}
+XML_DIR = 'resources/xml'
+
+DEFAULT_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 8))
+DEFAULT_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', 3000))
+# paragraphs longer than this are split into runs of sentences
+MAX_CHUNK_TOKENS = 250
+
+STOPWORDS = frozenset('a an and are as at be by for from has have in is it its of on or that the their this to was '
+                      'were which with what how do does did not we our they these those there been can also'.split())
+_word = re.compile(r'[a-z0-9]+')
+_sentence_end = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9(])')
+
+
+def tokenize(text):
+    return [w for w in _word.findall(text.lower()) if len(w) > 1 and w not in STOPWORDS]
+
+
+def xml_path_for(pdf_file_path, xml_dir=XML_DIR):
+    return os.path.join(xml_dir, f"{os.path.basename(pdf_file_path)[:-4]}.grobid.tei.xml")
+
+
+class Chunk:
+    __slots__ = ('id', 'section', 'text', 'position')
+
+    def __init__(self, id, section, text, position):
+        self.id = id
+        self.section = section
+        self.text = text
+        self.position = position
+
+
+def _text(element):
+    return ' '.join(''.join(element.itertext()).split())
+
+
+def _split_sentences(paragraph, text):
+    sentences = [_text(s) for s in paragraph.iterfind('tei:s', TEI)] or _sentence_end.split(text)
+    groups, current = [], []
+    for sentence in sentences:
+        if current and count_tokens(' '.join(current + [sentence])) > MAX_CHUNK_TOKENS:
+            groups.append(' '.join(current))
+            current = []
+        current.append(sentence)
+    if current:
+        groups.append(' '.join(current))
+    return groups
+
+
+def _section_head(element):
+    if next(element.iterancestors('{%s}abstract' % TEI['tei']), None) is not None:
+        return 'abstract'
+    div = next(element.iterancestors('{%s}div' % TEI['tei']), None)
+    if div is None:
+        return ''
+    head = div.find('tei:head', TEI)
+    return _text(head) if head is not None else ''
+
+
+def load_chunks(xml_path):
+    """Chunks of a TEI document in reading order: abstract and body paragraphs, then figure and table captions."""
+    root = etree.parse(xml_path).getroot()
+    chunks = []
+    paragraphs = root.findall('.//tei:profileDesc/tei:abstract//tei:p', TEI) + root.findall('.//tei:text//tei:p', TEI)
+    for n, paragraph in enumerate(paragraphs):
+        text = _text(paragraph)
+        if not text:
+            continue
+        section = _section_head(paragraph)
+        if count_tokens(text) <= MAX_CHUNK_TOKENS:
+            chunks.append(Chunk(f'p{n}', section, text, len(chunks)))
+        else:
+            for m, group in enumerate(_split_sentences(paragraph, text)):
+                chunks.append(Chunk(f'p{n}.s{m}', section, group, len(chunks)))
+    for n, figure in enumerate(root.iterfind('.//tei:text//tei:figure', TEI)):
+        text = ' '.join(_text(e) for e in figure if etree.QName(e).localname in ('head', 'label', 'figDesc'))
+        if text:
+            chunks.append(Chunk(f'fig{n}', 'figures and tables', text, len(chunks)))
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(f'{c.section} {c.text}')) for c in chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_freq = Counter(term for tf in self.term_freqs for term in tf)
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_freq.items()}
+
+    def search(self, query, k=None):
+        """[(score, chunk)] ordered by decreasing BM25 score, chunks without any query term are left out."""
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        scored = []
+        for tf, length, chunk in zip(self.term_freqs, self.lengths, self.chunks):
+            score = 0.0
+            for term in terms:
+                f = tf.get(term)
+                if f:
+                    score += self.idf[term] * f * (self.k1 + 1) / (
+                            f + self.k1 * (1 - self.b + self.b * length / self.avg_length))
+            if score > 0:
+                scored.append((score, chunk))
+        scored.sort(key=lambda sc: (-sc[0], sc[1].position))
+        return scored[:k] if k else scored
+
+
+@lru_cache(maxsize=64)
+def _index(xml_path, mtime_ns):
+    return BM25Index(load_chunks(xml_path))
+
+
+def get_index(xml_path):
+    return _index(xml_path, os.stat(xml_path).st_mtime_ns)
+
+
+def build_context(xml_path, query, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+    """The best matching chunks that fit in token_budget, in reading order, and their ids.
+
+    Each chunk is prefixed with its id and section so an answer can point back at what it used.
+    """
+    index = get_index(xml_path)
+    selected, used = [], 0
+    for _, chunk in index.search(query, top_k):
+        tokens = count_tokens(chunk.text)
+        if used + tokens > token_budget:
+            continue
+        selected.append(chunk)
+        used += tokens
+    selected.sort(key=lambda c: c.position)
+    context = '\n\n'.join(f'[{c.id}] ({c.section}) {c.text}' if c.section else f'[{c.id}] {c.text}' for c in selected)
+    return context, [c.id for c in selected]
+
+
+def get_chunks(xml_path, chunk_ids):
+    wanted = set(chunk_ids)
+    return [c for c in get_index(xml_path).chunks if c.id in wanted]
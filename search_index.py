@@ -0,0 +1,96 @@
+"""Corpus-wide full-text index over the TEI passages, stored as SQLite FTS5 in the app database.
+
+    python search_index.py            # index new or changed documents
+    python search_index.py "panel survey"
+"""
+import logging
+import os
+import sys
+
+import database
+import metrics
+import retrieval
+import util
+
+DB_PATH = database.DB_PATH
+PDF_DIR = 'resources/pdf'
+
+
+def to_match_query(query):
+    """Free text to an FTS5 expression: any of the query words, each quoted so punctuation can't break it."""
+    terms = dict.fromkeys(retrieval.tokenize(query))
+    return ' OR '.join(f'"{term}"' for term in terms)
+
+
+def index_document(filename, xml_path, pdf_hash, db_path=DB_PATH):
+    chunks = retrieval.load_chunks(xml_path)
+    with database.thread_connection(db_path) as conn, database.write_transaction(conn):
+        conn.execute('delete from tei_fts where filename = ?', (filename,))
+        conn.executemany('insert into tei_fts(filename, chunk_id, section, text) values (?, ?, ?, ?)',
+                         [(filename, c.id, c.section, c.text) for c in chunks])
+        conn.execute('insert or replace into tei_fts_source(filename, hash) values (?, ?)', (filename, pdf_hash))
+    return len(chunks)
+
+
+@metrics.timed('index_corpus')
+def index_corpus(pdf_dir=PDF_DIR, xml_dir=retrieval.XML_DIR, db_path=DB_PATH, force=False):
+    """Index every PDF that has a TEI file and whose content changed since it was last indexed."""
+    with database.thread_connection(db_path) as conn:
+        indexed = dict(conn.execute('select filename, hash from tei_fts_source'))
+    count = 0
+    for filename in sorted(os.listdir(pdf_dir)):
+        xml_path = retrieval.xml_path_for(filename, xml_dir)
+        if not filename.lower().endswith('.pdf') or not os.path.exists(xml_path):
+            continue
+        pdf_hash = util.get_file_hash(os.path.join(pdf_dir, filename))
+        if force or indexed.get(filename) != pdf_hash:
+            index_document(filename, xml_path, pdf_hash, db_path)
+            count += 1
+    return count
+
+
+@metrics.timed('db', query='indexed_filenames')
+def indexed_filenames(db_path=DB_PATH):
+    """Filenames of the PDFs in the index, the others can't be ranked."""
+    with database.thread_connection(db_path) as conn:
+        return {filename for filename, in conn.execute('select filename from tei_fts_source')}
+
+
+@metrics.timed('db', query='rank_documents')
+def rank_documents(query, limit=None, db_path=DB_PATH):
+    """[(filename, score, matching passages)] ordered by summed BM25 relevance, best first."""
+    match = to_match_query(query)
+    if not match:
+        return []
+    with database.thread_connection(db_path) as conn:
+        rows = conn.execute('select filename, bm25(tei_fts) from tei_fts where tei_fts match ?', (match,)).fetchall()
+    # bm25() cannot be used inside an aggregate, so the per-document sums are done here;
+    # it is lower for better matches, negated so the scores add up
+    totals = {}
+    for filename, score in rows:
+        total, hits = totals.get(filename, (0.0, 0))
+        totals[filename] = (total - score, hits + 1)
+    ranked = sorted(((f, total, hits) for f, (total, hits) in totals.items()), key=lambda r: -r[1])
+    return ranked[:limit] if limit else ranked
+
+@metrics.timed('db', query='keyword_hits')
+def keyword_hits(query, limit=200, db_path=DB_PATH, marks=('**', '**')):
+    """[(filename, chunk_id, section, snippet)] of the best matching passages across the corpus.
+
+    The matched words of a snippet are put between marks.
+    """
+    match = to_match_query(query)
+    if not match:
+        return []
+    with database.thread_connection(db_path) as conn:
+        return conn.execute("select filename, chunk_id, section, snippet(tei_fts, 3, ?, ?, '…', 24) "
+                            'from tei_fts where tei_fts match ? order by bm25(tei_fts) limit ?',
+                            (*marks, match, limit)).fetchall()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f"indexed {index_corpus()} documents")
+    if len(sys.argv) > 1:
+        for filename, score, hits in rank_documents(sys.argv[1], 10):
+            print(f"{score:8.2f} {hits:4d} {filename}")
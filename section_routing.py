@@ -0,0 +1,77 @@
+"""Which sections of a paper the prompt of a chain variable is sent with.
+
+The TEI section headings are sorted into a few classes (abstract, introduction, method, results,
+discussion, figures and tables, other). Headings that say nothing about their class, like the
+name of a measure under Method, belong to the class of the section before them, the untitled
+opening sections to the introduction. The classes each variable needs are rows of the
+`chain_section` table; variables without rows, papers without a TEI and answers given with low
+confidence fall back to the whole paper.
+"""
+import re
+
+import database
+import util
+
+ABSTRACT, INTRODUCTION, METHOD, RESULTS, DISCUSSION, FIGURES, OTHER = (
+    'abstract', 'introduction', 'method', 'results', 'discussion', 'figures', 'other')
+SECTION_CLASSES = (ABSTRACT, INTRODUCTION, METHOD, RESULTS, DISCUSSION, FIGURES, OTHER)
+
+# matched against the lower cased heading without spaces, first match wins
+_patterns = [
+    (OTHER, re.compile(r'acknowledg|funding|disclosure|^notes|appendix|contributor|supplementa|conflictofinterest')),
+    (RESULTS, re.compile(r'result|finding|hypothes[ie]stest|testsof|descriptive|correlation|^model[0-9ivx]*$|'
+                         r'pathmodel|mediationanalys|moderationanalys|regression')),
+    (DISCUSSION, re.compile(r'discussion|conclu|limitation|implication|future')),
+    (METHOD, re.compile(r'method|procedure|participant|sample|measure|design|datacollection|datasource|dataand|'
+                        r'instrument|stimul|manipulation|variable|analyticstrateg|analysisplan|analyticprocedure|'
+                        r'statisticalanalys|dataanalys|coding|operationali')),
+    (INTRODUCTION, re.compile(r'introduction|theor|background|literature|hypothes|researchquestion|overview|'
+                              r'previousresearch|framework|conceptual')),
+]
+# sections below this many characters are not worth a prompt of their own, the whole paper is sent
+MIN_ROUTED_CHARACTERS = 1500
+LOW_CONFIDENCE = ('low',)
+
+
+def classify_heading(heading):
+    """Class of a heading, None when the heading itself does not tell."""
+    if heading == 'abstract':
+        return ABSTRACT
+    if heading == 'figures and tables':
+        return FIGURES
+    # headings are often letter-spaced in the Grobid output, e.g. 'M E T H O D O L O G Y'
+    normalized = heading.replace(' ', '').lower()
+    for section_class, pattern in _patterns:
+        if pattern.search(normalized):
+            return section_class
+    return None
+
+
+def chunk_classes(chunks):
+    """Class of each chunk of a paper, chunks in reading order."""
+    classes, current, section, section_class = [], INTRODUCTION, None, None
+    for chunk in chunks:
+        if chunk.section != section:
+            section = chunk.section
+            section_class = classify_heading(section)
+            if section_class is None:
+                section_class = current
+            elif section_class not in (ABSTRACT, FIGURES):
+                current = section_class
+        classes.append(section_class)
+    return classes
+
+
+def sections_for(variable, db_path=database.DB_PATH):
+    """Section classes of a chain variable, None when it is sent the whole paper."""
+    with database.thread_connection(db_path) as conn:
+        return database.chain_sections(conn, variable) or None
+
+
+def low_confidence(response):
+    """True for an answer that should be asked again with the whole paper: low confidence or unparsable."""
+    try:
+        _, confidence_level, _ = util.parse_label_response(response or '')
+    except ValueError:
+        return True
+    return str(confidence_level).strip().lower() in LOW_CONFIDENCE
@@ -1,23 +1,29 @@
 import os
-from hashlib import blake2b
-from tempfile import NamedTemporaryFile
-import pandas as pd
 import dotenv
-from grobid_client.grobid_client import GrobidClient
 from streamlit_pdf_viewer import pdf_viewer
+from grobid.annotation_index import AnnotationIndex
 from grobid.grobid_processor import GrobidProcessor
+import bootstrap
+import content_export
+import database
+import jobs
+import label_export
+import metrics
 import openai_service
+import retrieval
 import json
 import streamlit as st
 import logging
 import util
-import sqlalchemy
-from bs4 import BeautifulSoup
 
 logging.basicConfig(level=logging.INFO)
+# the apps write their metrics to the `metrics` table and the Prometheus file, other processes keep them in memory
+metrics.start()
 dotenv.load_dotenv(override=True)
 
 variable_select_box_key = 'variable_select_box_key'
+# seconds between two looks at a running background job
+JOB_POLL_SECONDS = 1
 if 'doc_id' not in st.session_state:
     st.session_state['doc_id'] = None
 
@@ -39,6 +45,12 @@ if 'pages' not in st.session_state:
 if 'page_selection' not in st.session_state:
     st.session_state['page_selection'] = []
 
+if 'annotation_index' not in st.session_state:
+    st.session_state['annotation_index'] = AnnotationIndex([])
+
+if 'grobid_job' not in st.session_state:
+    st.session_state['grobid_job'] = None
+
 st.set_page_config(
     page_title="PDF Viewer and Summary",
     page_icon="",
@@ -74,6 +86,10 @@ with st.sidebar:
     width = st.slider(label="PDF width", min_value=100, max_value=2000, value=2000)
     height = st.slider(label="PDF height", min_value=100, max_value=1000, value=1000)
 
+    st.header("Export")
+    label_export_format = st.selectbox("Label export format", list(label_export.FORMATS), index=0,
+                                       help="Parquet and Arrow keep large label tables compact")
+
     st.header("Page Selection")
     placeholder = st.empty()
 
@@ -92,47 +108,40 @@ def new_file():
     st.session_state['doc_id'] = None
     st.session_state['uploaded'] = True
     st.session_state['annotations'] = []
+    st.session_state['annotation_index'] = AnnotationIndex([])
+    st.session_state['pages'] = None
     st.session_state['binary'] = None
     st.session_state[variable_select_box_key] = None
+    st.session_state['grobid_job'] = None
 
 @st.cache_resource
 def init_grobid():
-    grobid_client = GrobidClient(
-        grobid_server='http://localhost:8070/',
+    # the client is built on first use and the server pinged in the background, not on the first run
+    grobid_client = bootstrap.LazyGrobidClient(
+        grobid_server=bootstrap.GROBID_SERVER,
         batch_size=1000,
         coordinates=["p", "s", "persName", "biblStruct", "figure", "formula", "head", "note", "title", "ref",
                      "affiliation"],
         sleep_time=5,
-        timeout=60,
-        check_server=True
+        timeout=60
     )
     grobid_processor = GrobidProcessor(grobid_client)
 
     return grobid_processor
 
 
-init_grobid()
-
-def get_file_hash(fname):
-    hash_md5 = blake2b()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+if init_grobid().grobid_client.available is False:
+    st.sidebar.warning("Grobid is not reachable, highlights are shown for already processed PDFs only.")
 
 summary_prompt = "Please provide a summary of the research article focusing on the following aspects, using original phrases about time and unit of analysis from article if possible:\n- Research Method: Describe the overall research method employed in the study, also the data collection procedure and duration, time intervals\n- Time relevant details: state the data collection procedure and duration, time intervals of data collection between times. Usually research variables are collected each time.\n- Sampling Method and Entity Type: Explain the sampling method used and specify the type of entities (e.g., individuals, organizations) involved. Here, entity refers to an unit of analysis, or termed as analysis level, granuality or resolution. \n- Statistical Model: Outline the statistical model applied for analysis. DO NOT USE conceptual model name here.\n- Unit of Analysis: Identify the unit of analysis used in the statistical model.\n- Number of entities or Sample Size: the table and results parts ususally reveal the number of analysis unit.Analysis model details in figure and table are good references."
-conn = st.connection('sqlite.db', type='sql', url='sqlite:///resources/sqlite.db')
-chain = conn.query('select * from chain', ttl=0)
-chain_dict = dict(zip(chain['variable'], chain['prompt']))
-
-pdfs = conn.query('select * from pdf', ttl=0)
-pdf_dict = dict(zip(pdfs['doc_id'], pdfs['filename']))
+chain_dict, pdf_dict = bootstrap.get_reference_data()
 
 st.title("PDF Viewer and Summary")
-doc_id_selection = st.selectbox("Choose a PDF", pdf_dict.keys(), index=None, on_change=new_file(), key="doc_id_selection")
+doc_id_selection = st.selectbox("Choose a PDF", pdf_dict.keys(), index=None, on_change=new_file, key="doc_id_selection")
 col1, col2 = st.columns(2)
 
 @st.fragment
+@metrics.timed('export', format='xml')
 def export_pdf_body():
     filename = pdf_dict[st.session_state['doc_id_selection']]
     filename = filename[:-4]
@@ -150,43 +159,16 @@ def export_pdf_selected_content():
     # init_grobid().process_pdf_to_xml("resources/pdf", "resources/xml")
     filename = pdf_dict[st.session_state['doc_id_selection']]
     logging.info(f"export pdf select content {filename[:-4]}")
-    with open(f"resources/xml/{filename[:-4]}.grobid.tei.xml", "rb") as file:
-        soup = BeautifulSoup(file, features="xml")
-        title = soup.title.text
-        logging.info(title)
-        person_names = []
-        for persName in soup.find_all('persName'):
-            pn = ''
-            for name in persName.children:
-                # ignore role name
-                if str(name.text).find('Ph.D') >= 0:
-                    continue
-                pn = pn + name.text + " "
-            person_names.append(pn[:-1])
-        logging.info(person_names)
-        selected_content = {}
-        if highlight_title:
-            selected_content['title'] = title
-        if highlight_person_names:
-            selected_content['person_names'] = person_names
-        if highlight_figures:
-            selected_content['figures'] = []
-            for figure in soup.find_all('figure'):
-                if figure.head:
-                    selected_content['figures'].append(figure.head.text)
-        if highlight_sentences or highlight_paragraphs:
-            all_content = util.read_all_pdf_content(f"resources/pdf/{filename}")
-            all_content = all_content.replace('\n', ' ')
-            all_content = util.replace_ignore_case(all_content, title, '')
-            for pn in person_names:
-                all_content = util.replace_ignore_case(all_content, pn, ' ')
-            selected_content['paragraphs'] = all_content
-        st.download_button(
-            label="Download Selected Content as JSON",
-            data=json.dumps(selected_content),
-            file_name=f"{filename[:-4]}.json",
-            mime="application/json",
-        )
+    selected_content = content_export.selected_content(
+        f"resources/xml/{filename[:-4]}.grobid.tei.xml", f"resources/pdf/{filename}", title=highlight_title,
+        person_names=highlight_person_names, figures=highlight_figures,
+        paragraphs=highlight_sentences or highlight_paragraphs)
+    st.download_button(
+        label="Download Selected Content as JSON",
+        data=json.dumps(selected_content),
+        file_name=f"{filename[:-4]}.json",
+        mime="application/json",
+    )
 
 @st.fragment
 def export_pdf_selected_content_as_txt():
@@ -194,90 +176,57 @@ def export_pdf_selected_content_as_txt():
     filename = pdf_dict[st.session_state['doc_id_selection']]
     filename = filename[:-4]
     logging.info(f"export pdf select content {filename}")
-    with open(f"resources/xml/{filename}.grobid.tei.xml", "rb") as file:
-        soup = BeautifulSoup(file, features="xml")
-        selected_txt = soup.title.text + '\n\n'
-        if highlight_person_names:
-            for persName in soup.find_all('persName'):
-                pn = ''
-                for name in persName.children:
-                    pn = pn + name.text + " "
-                selected_txt = selected_txt + pn + '\n'
-            selected_txt = selected_txt + '\n'
-        if highlight_figures:
-            for figure in soup.find_all('figure'):
-                if figure.head:
-                    selected_txt = selected_txt + figure.head.text + '\n'
-            selected_txt = selected_txt + '\n'
-        if highlight_sentences or highlight_paragraphs:
-            for paragraph in soup.find_all('p'):
-                selected_txt = selected_txt + paragraph.text + '\n'
-        st.download_button(
-            label="Download Selected Content as TXT",
-            data=selected_txt,
-            file_name=f"{filename}.txt"
-        )
+    selected_txt = content_export.selected_text(
+        f"resources/xml/{filename}.grobid.tei.xml", person_names=highlight_person_names, figures=highlight_figures,
+        paragraphs=highlight_sentences or highlight_paragraphs)
+    st.download_button(
+        label="Download Selected Content as TXT",
+        data=selected_txt,
+        file_name=f"{filename}.txt"
+    )
+
+@st.cache_resource
+def init_label_exporter():
+    return label_export.LabelExporter()
+
+
+def download_label_export(label, kind, file_name):
+    path = init_label_exporter().export(kind, label_export_format)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        # pruned by another session's newer export in the meantime
+        f = open(init_label_exporter().export(kind, label_export_format), 'rb')
+    with f:
+        st.download_button(label, f, f"{file_name}.{label_export_format}", label_export.FORMATS[label_export_format])
+
 
 @st.fragment
 def export_label_csv():
-    label_df = conn.query(
-        f"select doc_id, variable, label from label order by doc_id, variable", ttl=0)
-    doc_ids = label_df['doc_id'].to_list()
-    variables = label_df['variable'].to_list()
-    labels = label_df['label'].to_list()
-    doc_id_single = sorted(list(set(doc_ids)))
-    variables_single = sorted(list(set(variables)))
-    result_dict = {}
-    result_dict['DOC_ID'] = doc_id_single
-    for variable in variables_single:
-        current_list = ['' for i in range(len(doc_id_single))]
-        result_dict[variable] = current_list
-    for i in range(len(doc_ids)):
-        d = doc_ids[i]
-        v = variables[i]
-        l = labels[i]
-        idx = doc_id_single.index(d)
-        result_dict[v][idx] = l
-    result_df = pd.DataFrame(result_dict)
-    st.download_button(
-        "Download Labels as CSV",
-        result_df.to_csv(index=False, sep='\t').encode('utf-8'),
-        "label.csv",
-        "text/csv"
-    )
+    download_label_export("Download Labels", 'labels', 'label')
+
 
 @st.fragment
 def export_log_csv():
-    label_df = conn.query(
-        f"select doc_id, variable, label, ai_label, manual_label, prompt_version from label order by doc_id, variable", ttl=0)
-    st.download_button(
-        "Download Logs as CSV",
-        label_df.to_csv(index=False, sep='\t').encode('utf-8'),
-        "log.csv",
-        "text/csv"
-    )
+    download_label_export("Download Logs", 'log', 'log')
+
+
+def save_label(label, ai_label, manual_label):
+    with database.thread_connection() as db:
+        variable = st.session_state['variable_selection']
+        database.upsert_label(db, st.session_state['doc_id_selection'], variable, label, ai_label, manual_label,
+                              util.prompt_version(chain_dict[variable]))
 
 
 @st.fragment
 def submit_label():
     variable_selection = st.session_state['variable_selection']
     variable_response = st.session_state['variable_response']
-    variable_response = variable_response[variable_response.find("{"): variable_response.rfind("}") + 1]
     result, confidence_level, evidence = None, None, None
     try:
-        variable_json = json.loads(variable_response)
-        if "result" in variable_json:
-            raw_result = str(variable_json["result"])
-            result = raw_result.replace("\t", "")
-        else:
-            result = 'failed to get result from openai'
-        if "confidence level" in variable_json:
-            confidence_level = variable_json["confidence level"]
-        if "confidence_level" in variable_json:
-            confidence_level = variable_json["confidence_level"]
-        if "evidence" in variable_json:
-            evidence = variable_json["evidence"]
+        result, confidence_level, evidence = util.parse_label_response(variable_response)
     except:
+        variable_response = variable_response[variable_response.find("{"): variable_response.rfind("}") + 1]
         st.write(f"Failed to parse json. Print raw json: \n{variable_response}")
     st.write(f"Result from AI: {result}")
     st.write(f"Evidence: {evidence}")
@@ -285,17 +234,7 @@ def submit_label():
     st.write(f"Page number from AI: not support yet")
     submit_ai = st.button("Apply AI variable", )
     if submit_ai:
-        with conn.session as s:
-            sql = sqlalchemy.sql.text(
-                'insert or replace into label(doc_id, variable, label, ai_label, manual_label, prompt_version) '
-                'values (:doc_id, :variable, :label, :ai_label, :manual_label, :prompt_version)')
-            s.execute(sql, params=dict(doc_id=st.session_state['doc_id_selection'],
-                                       variable=variable_selection,
-                                       label=result,
-                                       ai_label=result,
-                                       manual_label="",
-                                       prompt_version="prompt version"))
-            s.commit()
+        save_label(result, result, "")
 
     st.subheader("Manual labeling area")
     select_existed_label = 'select existed label'
@@ -303,50 +242,76 @@ def submit_label():
     use_existed_label = st.radio("Input label style", [input_label_manually, select_existed_label], index=0)
     if use_existed_label == select_existed_label:
         with st.form("select existed label"):
-            existed = conn.query(f"select label from label where variable = '{variable_selection}'", ttl=0)
-            existed_label_value = st.selectbox("Select label:", existed['label'].to_list(), index=None)
+            with database.thread_connection() as db:
+                existed = database.labels_of_variable(db, variable_selection)
+            existed_label_value = st.selectbox("Select label:", existed, index=None)
             submitted = st.form_submit_button("Apply manual variable")
             if submitted:
-                with conn.session as s:
-                    sql = sqlalchemy.sql.text(
-                        'insert or replace into label(doc_id, variable, label, ai_label, manual_label, prompt_version) '
-                        'values (:doc_id, :variable, :label, :ai_label, :manual_label, :prompt_version)')
-                    s.execute(sql, params=dict(doc_id=st.session_state['doc_id_selection'],
-                                               variable=variable_selection,
-                                               label=existed_label_value,
-                                               ai_label=result,
-                                               manual_label=existed_label_value,
-                                               prompt_version="prompt version"))
-                    s.commit()
+                save_label(existed_label_value, result, existed_label_value)
     else:
         with st.form("input form"):
             manual_variable_input = st.text_input("Input label:")
             submitted = st.form_submit_button("Apply input variable")
             if submitted:
-                with conn.session as s:
-                    sql = sqlalchemy.sql.text(
-                        'insert or replace into label(doc_id, variable, label, ai_label, manual_label, prompt_version) '
-                        'values (:doc_id, :variable, :label, :ai_label, :manual_label, :prompt_version)')
-                    s.execute(sql, params=dict(doc_id=st.session_state['doc_id_selection'],
-                                               variable=variable_selection,
-                                               label=manual_variable_input,
-                                               ai_label=result,
-                                               manual_label=manual_variable_input,
-                                               prompt_version="prompt version"))
-                    s.commit()
+                save_label(manual_variable_input, result, manual_variable_input)
     doc_id = st.session_state['doc_id_selection']
-    current_pdf_csv = conn.query(f"select doc_id, variable, label from label where doc_id = '{doc_id}'", ttl=0)
-    st.write(current_pdf_csv)
+    with database.thread_connection() as db:
+        st.dataframe(database.labels_of_document(db, doc_id))
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def wait_for_jobs(keys, text, language=None):
+    # polled while the jobs run, the whole page reruns when one of them is finished to show its result
+    waiting = [job for job in jobs.get_job_queue().get_many(keys).values() if job.pending]
+    if len(waiting) < len(keys):
+        st.rerun()
+    st.info(f"{text} ({waiting[0].status})..." if len(keys) == 1 else f"{text}: {len(waiting)} left...")
+    if len(keys) == 1 and waiting[0].partial:
+        # the answer so far of a streaming job
+        if language:
+            st.code(waiting[0].partial, language=language)
+        else:
+            st.markdown(waiting[0].partial)
+
+
+def job_done(job, text, retry, language=None):
+    """True when the job has its result, shows its progress, answer so far or error otherwise."""
+    if job.status == jobs.DONE:
+        return True
+    if job.pending:
+        wait_for_jobs([job.key], text, language)
+    else:
+        st.error(f"{text} failed: {job.error}")
+        if st.button("Retry", key=f'retry_{job.key}'):
+            retry()
+            st.rerun()
+    return False
 
 
 @st.fragment
 def labeling_area():
     st.subheader("AI labeling area")
     variable_selection = st.selectbox("Select a Variable:", chain_dict.keys(), index=None, key=variable_select_box_key)
+    use_retrieval = st.toggle("Send only the most relevant passages", value=False,
+                              help="Ranks the TEI paragraphs of the paper against the prompt and sends the best ones "
+                                   "instead of the whole paper")
     if variable_selection:
         query = chain_dict[variable_selection]
         query = util.query_add_md(query)
-        variable_response = str(openai_service.chat_with_pdf(pdf_path, query))
+        # answered by a background job, this rerun and the next ones only look at it
+        job = jobs.label(pdf_path, query, use_retrieval, variable_selection)
+        if not job_done(job, f"Labeling {variable_selection}",
+                        lambda: jobs.label(pdf_path, query, use_retrieval, variable_selection, retry=True),
+                        language='json'):
+            return
+        variable_response, chunk_ids = str(job.result['response']), job.result['chunk_ids']
+        if not use_retrieval:
+            sections = job.result.get('sections')
+            st.caption(f"Sent to AI: {', '.join(sections) if sections else 'whole paper'}")
+        if chunk_ids is not None:
+            with st.expander(f"Passages sent to AI ({len(chunk_ids)})"):
+                for chunk in retrieval.get_chunks(retrieval.xml_path_for(pdf_path), chunk_ids):
+                    st.markdown(f"**{chunk.id}** *{chunk.section}* {chunk.text}")
         logging.info(variable_response)
         st.session_state['variable_response'] = variable_response
         st.session_state['variable_selection'] = variable_selection
@@ -354,27 +319,50 @@ def labeling_area():
 
 
 @st.fragment
-def summary_area(summary, height):
-    st.text_area(f"Summary of {st.session_state['doc_id_selection']}: ", summary, int(height/2))
+def summary_area(pdf_path, height):
+    # generated by a background job, a cached summary is shown at once
+    job = jobs.answer(pdf_path, summary_prompt)
+    if job_done(job, "Summarizing", lambda: jobs.answer(pdf_path, summary_prompt, retry=True)):
+        st.text_area(f"Summary of {st.session_state['doc_id_selection']}: ", job.result or '', int(height/2))
 
 if doc_id_selection:
     filename = pdf_dict[st.session_state['doc_id_selection']]
     pdf_path = os.path.join('resources/pdf', filename)
-    summary = openai_service.chat_with_pdf(pdf_path, summary_prompt)
+    if st.button("Regenerate summary"):
+        # a summary still streaming is cancelled first, so it stops before caching the old answer again
+        summary_key = jobs.answer_key(pdf_path, summary_prompt)
+        jobs.get_job_queue().cancel([summary_key], running=True)
+        openai_service.response_cache.invalidate(key=openai_service.get_cache_key(pdf_path, summary_prompt))
+        jobs.get_job_queue().remove(summary_key)
     if not st.session_state['binary']:
-        with (st.spinner('Reading file, calling Grobid...')):
+        with (st.spinner('Reading file, loading annotations...')):
             with open(pdf_path, 'rb') as f:
                 binary = f.read()
-                tmp_file = NamedTemporaryFile(delete=False)
-                tmp_file.write(bytearray(binary))
-                tmp_file.close()
                 st.session_state['binary'] = binary
-                annotations, pages = init_grobid().process_structure(tmp_file.name)
+                xml_path = os.path.join('resources/xml', f'{filename[:-4]}.grobid.tei.xml')
+                annotations, pages = init_grobid().load_structure(pdf_path, xml_path, remote=False) or ([], None)
+                if not annotations:
+                    # not processed yet, Grobid runs as a background job and the highlights follow
+                    grobid_job = jobs.grobid(filename)
+                    if grobid_job.status != jobs.DONE:
+                        st.session_state['grobid_job'] = grobid_job.key
 
                 st.session_state['annotations'] = annotations if not st.session_state['annotations'] else \
                     st.session_state[
                         'annotations']
                 st.session_state['pages'] = pages if not st.session_state['pages'] else st.session_state['pages']
+            st.session_state['annotation_index'] = AnnotationIndex(st.session_state['annotations'])
+
+    grobid_job = st.session_state['grobid_job'] and jobs.get_job_queue().get(st.session_state['grobid_job'])
+    if grobid_job and grobid_job.status == jobs.DONE:
+        # processed, the annotations are read again on the next run
+        st.session_state['grobid_job'] = None
+        st.session_state['binary'] = None
+        st.session_state['annotations'] = []
+        st.session_state['pages'] = None
+        st.rerun()
+    elif grobid_job:
+        job_done(grobid_job, "Processing the PDF with Grobid", lambda: jobs.grobid(filename, retry=True))
 
     if st.session_state['pages']:
         st.session_state['page_selection'] = placeholder.multiselect(
@@ -387,40 +375,13 @@ if doc_id_selection:
         )
 
     with (st.spinner("Rendering PDF document")):
-        annotations = st.session_state['annotations']
-
-        if not highlight_sentences:
-            annotations = list(filter(lambda a: a['type'] != 's', annotations))
-
-        if not highlight_paragraphs:
-            annotations = list(filter(lambda a: a['type'] != 'p', annotations))
-
-        if not highlight_title:
-            annotations = list(filter(lambda a: a['type'] != 'title', annotations))
-
-        if not highlight_head:
-            annotations = list(filter(lambda a: a['type'] != 'head', annotations))
-
-        if not highlight_citations:
-            annotations = list(filter(lambda a: a['type'] != 'biblStruct', annotations))
-
-        if not highlight_notes:
-            annotations = list(filter(lambda a: a['type'] != 'note', annotations))
-
-        if not highlight_callout:
-            annotations = list(filter(lambda a: a['type'] != 'ref', annotations))
-
-        if not highlight_formulas:
-            annotations = list(filter(lambda a: a['type'] != 'formula', annotations))
-
-        if not highlight_person_names:
-            annotations = list(filter(lambda a: a['type'] != 'persName', annotations))
-
-        if not highlight_figures:
-            annotations = list(filter(lambda a: a['type'] != 'figure', annotations))
-
-        if not highlight_affiliations:
-            annotations = list(filter(lambda a: a['type'] != 'affiliation', annotations))
+        hidden_types = [annotation_type for annotation_type, highlighted in (
+            ('s', highlight_sentences), ('p', highlight_paragraphs), ('title', highlight_title),
+            ('head', highlight_head), ('biblStruct', highlight_citations), ('note', highlight_notes),
+            ('ref', highlight_callout), ('formula', highlight_formulas), ('persName', highlight_person_names),
+            ('figure', highlight_figures), ('affiliation', highlight_affiliations)) if not highlighted]
+        annotations = st.session_state['annotation_index'].select_excluding(hidden_types,
+                                                                           st.session_state['page_selection'])
         with col1:
             pdf_viewer(
                 input=st.session_state['binary'],
@@ -433,14 +394,27 @@ if doc_id_selection:
                 render_text=enable_text,
                 resolution_boost=resolution_boost
             )
-            summary_area(summary, height)
+            summary_area(pdf_path, height)
         with col2:
             xml_filename = f'{filename[:-4]}.grobid.tei.xml'
-            if not os.path.exists(os.path.join('resources/xml', xml_filename)):
-                init_grobid().process_pdf_to_xml("resources/pdf", "resources/xml")
-            export_pdf_body()
-            export_pdf_selected_content()
-            export_pdf_selected_content_as_txt()
+            if os.path.exists(os.path.join('resources/xml', xml_filename)):
+                export_pdf_body()
+                export_pdf_selected_content()
+                export_pdf_selected_content_as_txt()
+            else:
+                st.info(f"{xml_filename} has not been processed yet, run `python ingest.py` to enable the content exports.")
             export_label_csv()
             export_log_csv()
             labeling_area()
+
+def performance_panel():
+    collected = metrics.get_metrics()
+    with st.sidebar.expander("Performance"):
+        st.caption("Timings, cache hit rates and tokens of this server process since it started")
+        st.dataframe(collected.stage_rows(), hide_index=True)
+        st.dataframe(collected.cache_rows(), hide_index=True)
+        st.dataframe(collected.token_rows(), hide_index=True)
+
+
+performance_panel()
+bootstrap.warm_up()
@@ -1,23 +1,26 @@
 import os
-from hashlib import blake2b
-from tempfile import NamedTemporaryFile
 import pandas as pd
 import dotenv
-from exceptiongroup import catch
-from grobid_client.grobid_client import GrobidClient
 from streamlit_pdf_viewer import pdf_viewer
+from grobid.annotation_index import AnnotationIndex
 from grobid.grobid_processor import GrobidProcessor
-import openai_service
+import bootstrap
+import jobs
+import metrics
+import search_index
 import json
+import re
 import streamlit as st
 import logging
-import util
-import sqlalchemy
 
 logging.basicConfig(level=logging.INFO)
+# the apps write their metrics to the `metrics` table and the Prometheus file, other processes keep them in memory
+metrics.start()
 dotenv.load_dotenv(override=True)
 
 variable_select_box_key = 'variable_select_box_key'
+# seconds between two looks at running background jobs
+JOB_POLL_SECONDS = 1
 if 'doc_id' not in st.session_state:
     st.session_state['doc_id'] = None
 
@@ -39,6 +42,15 @@ if 'pages' not in st.session_state:
 if 'page_selection' not in st.session_state:
     st.session_state['page_selection'] = []
 
+if 'annotation_index' not in st.session_state:
+    st.session_state['annotation_index'] = AnnotationIndex([])
+
+if 'search' not in st.session_state:
+    st.session_state['search'] = None
+
+if 'grobid_job' not in st.session_state:
+    st.session_state['grobid_job'] = None
+
 st.set_page_config(
     page_title="PDF Semantic Search",
     page_icon="",
@@ -92,40 +104,32 @@ def new_file():
     st.session_state['doc_id'] = None
     st.session_state['uploaded'] = True
     st.session_state['annotations'] = []
+    st.session_state['annotation_index'] = AnnotationIndex([])
+    st.session_state['pages'] = None
     st.session_state['binary'] = None
     st.session_state[variable_select_box_key] = None
+    st.session_state['grobid_job'] = None
 
 @st.cache_resource
 def init_grobid():
-    grobid_client = GrobidClient(
-        grobid_server='http://localhost:8070/',
+    # the client is built on first use and the server pinged in the background, not on the first run
+    grobid_client = bootstrap.LazyGrobidClient(
+        grobid_server=bootstrap.GROBID_SERVER,
         batch_size=1000,
         coordinates=["p", "s", "persName", "biblStruct", "figure", "formula", "head", "note", "title", "ref",
                      "affiliation"],
         sleep_time=5,
-        timeout=60,
-        check_server=True
+        timeout=60
     )
     grobid_processor = GrobidProcessor(grobid_client)
 
     return grobid_processor
 
 
-init_grobid()
+if init_grobid().grobid_client.available is False:
+    st.sidebar.warning("Grobid is not reachable, highlights are shown for already processed PDFs only.")
 
-def get_file_hash(fname):
-    hash_md5 = blake2b()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-conn = st.connection('sqlite.db', type='sql', url='sqlite:///resources/sqlite.db')
-chain = conn.query('select * from chain', ttl=0)
-chain_dict = dict(zip(chain['variable'], chain['prompt']))
-
-pdfs = conn.query('select * from pdf', ttl=0)
-pdf_dict = dict(zip(pdfs['doc_id'], pdfs['filename']))
+chain_dict, pdf_dict = bootstrap.get_reference_data()
 
 st.title("PDF Semantic Search")
 
@@ -134,7 +138,7 @@ doc_id_df = []
 reference_df = []
 
 @st.fragment
-def show_phrase():
+def show_phrase(input_query):
     # st.download_button(
     #     "Download Phrases as CSV",
     #     pd.DataFrame({'DOC_ID': doc_id_df, 'reference': reference_df}, index=None).to_csv(index=False, sep='\t').encode('utf-8'),
@@ -147,10 +151,11 @@ def show_phrase():
     notes = st.text_area(f"Notes about {input_query}:", notes, height=500)
     st.download_button("Download Notes as TXT", notes)
 
-def get_cached_response(input_query, filename):
-    phrase = conn.query(f"select response from phrase where query = '{input_query}' and filename = '{filename}'", ttl=0)
-    if len(phrase) > 0:
-        return phrase['response'][0]
+def escape_markdown(text):
+    return re.sub(r'([\\`*_{}\[\]<>#|~$])', r'\\\1', text)
+
+
+def build_query(input_query):
     query = f"{input_query}. Give me original reference as well. Save the result in a json array, the json array contains json objects, the keys are result and reference."
     if input_query == 'time phrases':
         query = '''
@@ -165,62 +170,165 @@ After the extraction, summarize the authors' motivation in a few words. Return t
 }
 Do not add any additional commentary or text. Only return the output in the specified format.
     '''
-    response = openai_service.chat_with_pdf(os.path.join('resources/pdf', filename), query)
-    with conn.session as s:
-        sql = sqlalchemy.sql.text(
-            'insert or replace into phrase(query, filename, response) values (:query, :filename, :response)')
-        s.execute(sql, params=dict(query=input_query, filename=filename, response=response))
-        s.commit()
-    return response
+    return query
+
+
+def parse_references(response):
+    response = response[response.find("["): response.rfind("]") + 1]
+    references = []
+    try:
+        response_json = json.loads(response)
+        for j in response_json:
+            ref = j['result']
+            ref = str(ref).replace('\t', ' ')
+            references.append(ref)
+    except:
+        pass
+    return references
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def wait_for_jobs(keys, text):
+    # polled while the jobs run, the whole page reruns when one of them is finished to show its result
+    waiting = [job for job in jobs.get_job_queue().get_many(keys).values() if job.pending]
+    if len(waiting) < len(keys):
+        st.rerun()
+    st.info(f"{text} ({waiting[0].status})..." if len(keys) == 1 else f"{text}: {len(waiting)} left...")
+
+
+def submit_search(input_query, pdf_paths):
+    """One background job per document, cached answers are taken at once."""
+    # jobs of the previous query that have not started yet are dropped
+    if st.session_state['search']:
+        jobs.get_job_queue().cancel(st.session_state['search']['pending'])
+    query = build_query(input_query)
+    search = {'input_query': input_query, 'query': query, 'responses': {}, 'pending': {}}
+    for pdf_path, doc_id in pdf_paths.items():
+        job = jobs.answer(pdf_path, query)
+        if job.status == jobs.DONE:
+            search['responses'][doc_id] = job.result
+        else:
+            search['pending'][job.key] = (doc_id, pdf_path)
+    st.session_state['search'] = search
+
+
+def collect_search(search):
+    """Move the finished jobs of the search to its responses."""
+    found = jobs.get_job_queue().get_many(search['pending'])
+    for key, (doc_id, pdf_path) in list(search['pending'].items()):
+        job = found.get(key)
+        if job is None or job.status == jobs.CANCELLED:
+            # cancelled by another session that shared the job, or removed; submitted again, which may also
+            # find the answer in the response cache
+            job = jobs.answer(pdf_path, search['query'])
+        if not job.pending:
+            logging.info(job.result)
+            search['responses'][doc_id] = job.result
+            del search['pending'][key]
+        elif job.key != key:
+            del search['pending'][key]
+            search['pending'][job.key] = (doc_id, pdf_path)
+
+
+@st.cache_resource
+def init_search_index():
+    # documents ingested before the index existed, or added by hand, are indexed on first start
+    logging.info(f"indexed {search_index.index_corpus()} documents for full-text search")
+
+
+init_search_index()
 
 
 with col1:
     input_query = st.text_input("Please input your query (e.g. elaborate the within-subject experiment designs, find time-relevant phrases)", key = 'input_query')
+    prefilter = st.toggle("Prefilter documents with the full-text index", value=True,
+                          help="Only query the documents whose text matches the query words, best matches first")
+    max_documents = st.number_input("Maximum documents to query", min_value=1, max_value=max(len(pdf_dict), 1),
+                                    value=min(20, max(len(pdf_dict), 1)), disabled=not prefilter)
     keyword_button = st.button("OK")
+    hits_button = st.button("Keyword hits", help="Matching passages from the full-text index, without calling AI")
+    if hits_button and len(input_query) > 0:
+        doc_ids = {filename: doc_id for doc_id, filename in pdf_dict.items()}
+        # marked with control characters, so the passage text can be escaped before the matches are made bold
+        hits = search_index.keyword_hits(input_query, marks=('\x02', '\x03'))
+        with st.container(height=500):
+            for f, _, section, snippet in hits:
+                passage = escape_markdown(snippet).replace('\x02', '**').replace('\x03', '**')
+                st.markdown(f"**{escape_markdown(doc_ids.get(f, f))}** *{escape_markdown(section)}*: {passage}")
     if keyword_button and len(input_query) > 0:
-        for doc_id in pdf_dict.keys():
-            filename = pdf_dict[doc_id]
-            if not os.path.exists(os.path.join('resources/pdf', filename)):
-                continue
-            # What are the time phrases in the article?
-            response = get_cached_response(input_query, filename)
-            logging.info(response)
-            response = response[response.find("["): response.rfind("]") + 1]
-
-            try:
-                response_json = json.loads(response)
-                for j in response_json:
-                    ref = j['result']
-                    ref = str(ref).replace('\t', ' ')
-                    doc_id_df.append(doc_id)
-                    reference_df.append(ref)
-            except:
-                pass
-        show_phrase()
+        pdf_paths = {os.path.join('resources/pdf', filename): doc_id for doc_id, filename in pdf_dict.items()
+                     if os.path.exists(os.path.join('resources/pdf', filename))}
+        unindexed = []
+        if prefilter:
+            # best ranked documents first, those without a single matching passage are not sent at all;
+            # documents without a TEI in the index can't be ranked and are all sent after them
+            ranked = [os.path.join('resources/pdf', filename)
+                      for filename, _, _ in search_index.rank_documents(input_query, max_documents)]
+            indexed = search_index.indexed_filenames()
+            unindexed = [path for path in pdf_paths if os.path.basename(path) not in indexed]
+            pdf_paths = {path: pdf_paths[path] for path in ranked + unindexed if path in pdf_paths}
+        if not pdf_paths:
+            st.info("No document matches the query words.")
+        submit_search(input_query, pdf_paths)
+        st.session_state['search']['unindexed'] = len(unindexed)
+    search = st.session_state['search']
+    if search:
+        # answered by background jobs, every rerun shows the ones finished so far
+        collect_search(search)
+        for doc_id, response in search['responses'].items():
+            for ref in parse_references(response) if response is not None else []:
+                doc_id_df.append(doc_id)
+                reference_df.append(ref)
+        if search.get('unindexed'):
+            st.caption(f"{search['unindexed']} documents are not in the full-text index yet and were queried without "
+                       f"prefiltering")
+        if search['pending']:
+            done, total = len(search['responses']), len(search['responses']) + len(search['pending'])
+            st.progress(done / total, text=f"{done}/{total} documents answered")
+            wait_for_jobs(list(search['pending']), f"Querying {total} documents")
+        show_phrase(search['input_query'])
         # st.write(f"Notes about {inputs}:")
         # st.dataframe(pd.DataFrame({'DOC_ID':doc_id_df, 'reference':reference_df}, index=None), width=1000, height=1000)
 
 
 @st.fragment
 def select_doc():
-    doc_id_selection = st.selectbox("Choose a PDF", list(set(doc_id_df)), index=None, on_change=new_file(),
+    doc_id_selection = st.selectbox("Choose a PDF", list(set(doc_id_df)), index=None, on_change=new_file,
                                     key="doc_id_selection")
     if doc_id_selection:
         filename = pdf_dict[st.session_state['doc_id_selection']]
         pdf_path = os.path.join('resources/pdf', filename)
         if not st.session_state['binary']:
-            with (st.spinner('Reading file, calling Grobid...')):
+            with (st.spinner('Reading file, loading annotations...')):
                 with open(pdf_path, 'rb') as f:
                     binary = f.read()
-                    tmp_file = NamedTemporaryFile()
-                    tmp_file.write(bytearray(binary))
                     st.session_state['binary'] = binary
-                    annotations, pages = init_grobid().process_structure(tmp_file.name)
+                    xml_path = os.path.join('resources/xml', f'{filename[:-4]}.grobid.tei.xml')
+                    annotations, pages = init_grobid().load_structure(pdf_path, xml_path, remote=False) or ([], None)
+                    if not annotations:
+                        # not processed yet, Grobid runs as a background job and the highlights follow
+                        grobid_job = jobs.grobid(filename)
+                        if grobid_job.status != jobs.DONE:
+                            st.session_state['grobid_job'] = grobid_job.key
 
                     st.session_state['annotations'] = annotations if not st.session_state['annotations'] else \
                         st.session_state[
                             'annotations']
                     st.session_state['pages'] = pages if not st.session_state['pages'] else st.session_state['pages']
+                st.session_state['annotation_index'] = AnnotationIndex(st.session_state['annotations'])
+
+        grobid_job = st.session_state['grobid_job'] and jobs.get_job_queue().get(st.session_state['grobid_job'])
+        if grobid_job and grobid_job.status == jobs.DONE:
+            # processed, the annotations are read again on the next run
+            st.session_state['grobid_job'] = None
+            st.session_state['binary'] = None
+            st.session_state['annotations'] = []
+            st.session_state['pages'] = None
+            st.rerun()
+        elif grobid_job and grobid_job.pending:
+            wait_for_jobs([grobid_job.key], "Processing the PDF with Grobid")
+        elif grobid_job:
+            st.warning(f"Grobid could not process the PDF, it is shown without highlights: {grobid_job.error}")
 
         # if st.session_state['pages']:
         #     st.session_state['page_selection'] = placeholder.multiselect(
@@ -233,40 +341,13 @@ def select_doc():
         #     )
 
         with (st.spinner("Rendering PDF document")):
-            annotations = st.session_state['annotations']
-
-            if not highlight_sentences:
-                annotations = list(filter(lambda a: a['type'] != 's', annotations))
-
-            if not highlight_paragraphs:
-                annotations = list(filter(lambda a: a['type'] != 'p', annotations))
-
-            if not highlight_title:
-                annotations = list(filter(lambda a: a['type'] != 'title', annotations))
-
-            if not highlight_head:
-                annotations = list(filter(lambda a: a['type'] != 'head', annotations))
-
-            if not highlight_citations:
-                annotations = list(filter(lambda a: a['type'] != 'biblStruct', annotations))
-
-            if not highlight_notes:
-                annotations = list(filter(lambda a: a['type'] != 'note', annotations))
-
-            if not highlight_callout:
-                annotations = list(filter(lambda a: a['type'] != 'ref', annotations))
-
-            if not highlight_formulas:
-                annotations = list(filter(lambda a: a['type'] != 'formula', annotations))
-
-            if not highlight_person_names:
-                annotations = list(filter(lambda a: a['type'] != 'persName', annotations))
-
-            if not highlight_figures:
-                annotations = list(filter(lambda a: a['type'] != 'figure', annotations))
-
-            if not highlight_affiliations:
-                annotations = list(filter(lambda a: a['type'] != 'affiliation', annotations))
+            hidden_types = [annotation_type for annotation_type, highlighted in (
+                ('s', highlight_sentences), ('p', highlight_paragraphs), ('title', highlight_title),
+                ('head', highlight_head), ('biblStruct', highlight_citations), ('note', highlight_notes),
+                ('ref', highlight_callout), ('formula', highlight_formulas), ('persName', highlight_person_names),
+                ('figure', highlight_figures), ('affiliation', highlight_affiliations)) if not highlighted]
+            annotations = st.session_state['annotation_index'].select_excluding(hidden_types,
+                                                                               st.session_state['page_selection'])
             pdf_viewer(
                 input=st.session_state['binary'],
                 width=width,
@@ -281,3 +362,15 @@ def select_doc():
 
 with col2:
     select_doc()
+
+def performance_panel():
+    collected = metrics.get_metrics()
+    with st.sidebar.expander("Performance"):
+        st.caption("Timings, cache hit rates and tokens of this server process since it started")
+        st.dataframe(collected.stage_rows(), hide_index=True)
+        st.dataframe(collected.cache_rows(), hide_index=True)
+        st.dataframe(collected.token_rows(), hide_index=True)
+
+
+performance_panel()
+bootstrap.warm_up()
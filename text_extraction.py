@@ -0,0 +1,162 @@
+"""Per-page PDF text extraction with interchangeable backends and a content-addressed page cache.
+
+Every page is extracted at most once per (content hash, backend); callers slice the cached pages.
+The PDF libraries are imported by the backends on first use, they are not needed for cache hits.
+A PDF a backend cannot read raises PdfReadError, whichever library failed.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+import metrics
+import util
+
+DB_PATH = database.DB_PATH
+DEFAULT_BACKEND = os.getenv('PDF_TEXT_BACKEND', 'pypdf2')
+# documents with at least this many pages are split across worker processes
+PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 40))
+MAX_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', max(1, min(4, (os.cpu_count() or 1)))))
+
+
+class PdfReadError(Exception):
+    pass
+
+
+class PyPDF2Backend:
+    name = 'pypdf2'
+
+    @staticmethod
+    def read_errors():
+        import PyPDF2
+        return PyPDF2.errors.PdfReadError,
+
+    @staticmethod
+    def page_count(pdf_path):
+        import PyPDF2
+        return len(PyPDF2.PdfReader(pdf_path).pages)
+
+    @staticmethod
+    def extract_pages(pdf_path, start=0, end=None):
+        import PyPDF2
+        pages = PyPDF2.PdfReader(pdf_path).pages
+        return [pages[i].extract_text() or '' for i in range(start, len(pages) if end is None else end)]
+
+
+class PyMuPDFBackend:
+    name = 'pymupdf'
+
+    @staticmethod
+    def read_errors():
+        import pymupdf
+        return pymupdf.FileDataError,
+
+    @staticmethod
+    def page_count(pdf_path):
+        import pymupdf
+        with pymupdf.open(pdf_path) as document:
+            return document.page_count
+
+    @staticmethod
+    def extract_pages(pdf_path, start=0, end=None):
+        import pymupdf
+        with pymupdf.open(pdf_path) as document:
+            return [document[i].get_text() for i in range(start, document.page_count if end is None else end)]
+
+
+BACKENDS = {backend.name: backend for backend in (PyPDF2Backend, PyMuPDFBackend)}
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn rather than fork, the apps run extraction from threads of a multi-threaded server
+        _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _extract_range(backend_name, pdf_path, start, end):
+    return BACKENDS[backend_name].extract_pages(pdf_path, start, end)
+
+
+def extract_pages(pdf_path, backend=DEFAULT_BACKEND, parallel_min_pages=PARALLEL_MIN_PAGES):
+    """Text of every page, extracting large documents in page ranges on a process pool."""
+    extractor = BACKENDS[backend]
+    try:
+        return _extract_pages(extractor, pdf_path, parallel_min_pages)
+    except Exception as e:
+        # the library's exception types are only looked at once it has failed
+        if isinstance(e, extractor.read_errors()):
+            raise PdfReadError(f"{backend} cannot read {pdf_path}: {e}") from e
+        raise
+
+
+def _extract_pages(extractor, pdf_path, parallel_min_pages):
+    backend = extractor.name
+    with metrics.timer('pdf_extract', backend=backend):
+        count = extractor.page_count(pdf_path)
+        if MAX_WORKERS < 2 or count < parallel_min_pages:
+            return extractor.extract_pages(pdf_path)
+        step = -(-count // MAX_WORKERS)
+        ranges = [(start, min(start + step, count)) for start in range(0, count, step)]
+        pages = []
+        for part in _get_pool().map(_extract_range, *zip(*[(backend, pdf_path, s, e) for s, e in ranges])):
+            pages.extend(part)
+        return pages
+
+
+class PageCache:
+    """Extracted page text in the `page_text` table, keyed by PDF content hash and backend."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def _connect(self):
+        return database.thread_connection(self.db_path)
+
+    @metrics.timed('db', query='page_text_get')
+    def get(self, pdf_hash, backend):
+        with self._connect() as conn:
+            row = conn.execute('select pages from page_text_document where hash = ? and backend = ?',
+                               (pdf_hash, backend)).fetchone()
+            if row is None:
+                return None
+            texts = [text for text, in conn.execute('select text from page_text where hash = ? and backend = ? '
+                                                    'order by page', (pdf_hash, backend))]
+        return texts if len(texts) == row[0] else None
+
+    @metrics.timed('db', query='page_text_put')
+    def put(self, pdf_hash, backend, pages):
+        with self._connect() as conn, database.write_transaction(conn):
+            conn.execute('delete from page_text where hash = ? and backend = ?', (pdf_hash, backend))
+            conn.executemany('insert into page_text(hash, backend, page, text) values (?, ?, ?, ?)',
+                             [(pdf_hash, backend, n, text) for n, text in enumerate(pages)])
+            # written last, a document only counts as cached once all its pages are in
+            conn.execute('insert or replace into page_text_document(hash, backend, pages) values (?, ?, ?)',
+                         (pdf_hash, backend, len(pages)))
+
+
+_page_cache = None
+
+
+def get_page_cache():
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = PageCache()
+    return _page_cache
+
+
+def get_pages(pdf_path, backend=DEFAULT_BACKEND):
+    """Text of every page of the PDF, from the page cache when this content was extracted before."""
+    pdf_hash = util.get_file_hash(pdf_path)
+    cache = get_page_cache()
+    pages = cache.get(pdf_hash, backend)
+    metrics.cache_lookup('page_text', 'miss' if pages is None else 'hit')
+    if pages is None:
+        pages = extract_pages(pdf_path, backend)
+        cache.put(pdf_hash, backend, pages)
+        logging.info(f"extracted {len(pages)} pages of {pdf_path} with {backend}")
+    return pages
@@ -0,0 +1,62 @@
+"""Local token counts for the chat models, exact with tiktoken and estimated when it is unavailable."""
+import logging
+import os
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_MODEL = 'gpt-4o'
+DEFAULT_ENCODING = 'o200k_base'
+CONTEXT_WINDOWS = {'gpt-3.5-turbo-1106': 16385, 'gpt-4o': 128000, 'gpt-4-turbo': 128000}
+DEFAULT_CONTEXT_WINDOW = 16385
+# left free in the window for the query and the answer
+RESERVED_TOKENS = 5000
+# optional upper bound on the paper text sent per request, to cap the cost on long-context models; 0, the
+# default, sends as much as the model's window takes, so papers that fit are sent whole as they always were
+MAX_CONTEXT_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 0))
+# chat format overhead per message and per reply, as documented for the OpenAI chat models
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+def base_model(model):
+    """'ft:gpt-3.5-turbo-1106:org:name:id' -> 'gpt-3.5-turbo-1106', other names unchanged."""
+    return model.split(':')[1] if model.startswith('ft:') else model
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """The tiktoken encoding of the model, None when tiktoken or its encoding files are unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        name = tiktoken.encoding_name_for_model(base_model(model))
+    except KeyError:
+        name = DEFAULT_ENCODING
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        # the encoding files are downloaded on first use, offline machines fall back to the estimate
+        logging.warning(f"no tiktoken encoding {name} for {model}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    encoding = get_encoding(model)
+    if encoding is None:
+        # about four characters per token for English prose
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model=DEFAULT_MODEL):
+    return sum(TOKENS_PER_MESSAGE + count_tokens(m['content'], model) for m in messages) + TOKENS_PER_REPLY
+
+
+def context_budget(model):
+    """Tokens of paper text that can be sent to the model along with a query."""
+    budget = CONTEXT_WINDOWS.get(base_model(model), DEFAULT_CONTEXT_WINDOW) - RESERVED_TOKENS
+    return min(budget, MAX_CONTEXT_TOKENS) if MAX_CONTEXT_TOKENS else budget
@@ -1,20 +1,64 @@
+import json
+import os
 import re
-from PyPDF2 import PdfReader
+from hashlib import blake2b
+
+import metrics
+
+# (path, mtime, size) -> blake2b digest, so repeated lookups of an unchanged file skip the read
+_file_hashes = {}
 
 def query_add_md(q: str):
     if not q.endswith('.') or not q.endswith('?'):
         q = q + '.'
     return q + "save the result in a json format, the keys are result, your confidence level(high/middle/low), and evidence."
 
+def get_file_hash(fname):
+    stat = os.stat(fname)
+    memo_key = (os.path.abspath(fname), stat.st_mtime_ns, stat.st_size)
+    if memo_key in _file_hashes:
+        return _file_hashes[memo_key]
+    hash_md5 = blake2b()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_md5.update(chunk)
+    _file_hashes[memo_key] = hash_md5.hexdigest()
+    return _file_hashes[memo_key]
+
+def prompt_version(prompt):
+    """Short hash of a chain prompt, stored with each label so labels of an edited prompt can be told apart."""
+    return blake2b(prompt.encode('utf-8'), digest_size=6).hexdigest()
+
+@metrics.timed('read_all_pdf_content')
 def read_all_pdf_content(file_path):
-    reader = PdfReader(file_path)
+    # imported here, text_extraction itself depends on this module for the file hash
+    import text_extraction
+    pages = text_extraction.get_pages(file_path)
     first_page = 0
-    if reader.pages[0].extract_text().find('To cite this article') > 0:
+    if pages[0].find('To cite this article') > 0:
         first_page = 1
-    all_content = ''
-    for i in range(first_page, len(reader.pages)):
-        all_content += reader.pages[i].extract_text()
-    return all_content
+    return ''.join(pages[first_page:])
+
+def parse_label_response(variable_response):
+    """(result, confidence level, evidence) from the json answer to a labeling prompt.
+
+    Raises ValueError when the answer holds no parsable json object.
+    """
+    variable_response = variable_response[variable_response.find("{"): variable_response.rfind("}") + 1]
+    result, confidence_level, evidence = None, None, None
+    variable_json = json.loads(variable_response)
+    if "result" in variable_json:
+        raw_result = str(variable_json["result"])
+        result = raw_result.replace("\t", "")
+    else:
+        result = 'failed to get result from openai'
+    if "confidence level" in variable_json:
+        confidence_level = variable_json["confidence level"]
+    if "confidence_level" in variable_json:
+        confidence_level = variable_json["confidence_level"]
+    if "evidence" in variable_json:
+        evidence = variable_json["evidence"]
+    return result, confidence_level, evidence
 
 def replace_ignore_case(string, old, new):
     pattern = re.compile(re.escape(old), re.IGNORECASE)
@@ -0,0 +1,143 @@
+"""Registers the PDFs copied into resources/pdf and prepares them before anyone opens them.
+
+Every new or changed PDF is hashed, gets a row in the `pdf` table (the file name without .pdf as
+doc_id unless the file is registered already) and background jobs for its text extraction and its
+Grobid TEI, coordinates and index entries. The jobs are run by a bounded number of workers of this
+process, next to the ones of the apps, behind the jobs users wait for. A file with the content of
+a registered one is not registered again, a registered file that was renamed keeps its doc_id.
+On start the whole directory is compared with the table, so files copied while the watcher was
+not running are picked up too.
+
+    python watcher.py --workers 2 [--poll]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+import database
+import jobs
+import util
+
+DB_PATH = database.DB_PATH
+PDF_DIR = 'resources/pdf'
+# a file is read once it has not changed for this long, so a copy in progress is not hashed
+SETTLE_SECONDS = 2.0
+
+
+def is_pdf(path):
+    return path.lower().endswith('.pdf') and not os.path.basename(path).startswith('.')
+
+
+class PdfWatcher(FileSystemEventHandler):
+    def __init__(self, pdf_dir=PDF_DIR, db_path=DB_PATH, queue=None):
+        self.pdf_dir = pdf_dir
+        self.db_path = db_path
+        self.queue = queue or jobs.JobQueue(db_path)
+        # path -> (time of the last event, size then)
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path and is_pdf(path) and os.path.exists(path):
+                with self._lock:
+                    self._changed[path] = time.time(), None
+
+    def settled(self):
+        """Paths whose file has neither had an event nor changed size for SETTLE_SECONDS."""
+        now, ready = time.time(), []
+        with self._lock:
+            for path, (changed_at, size) in list(self._changed.items()):
+                try:
+                    current = os.path.getsize(path)
+                except OSError:
+                    del self._changed[path]
+                    continue
+                if current != size:
+                    self._changed[path] = now, current
+                elif now - changed_at >= SETTLE_SECONDS:
+                    del self._changed[path]
+                    ready.append(path)
+        return ready
+
+    def register(self, path, retry=False):
+        """Upsert the pdf row of a file and queue its preparation, returns its doc_id or None when skipped.
+
+        An unchanged file is only prepared again with retry, which also reruns its failed jobs.
+        """
+        filename = os.path.basename(path)
+        pdf_hash = util.get_file_hash(path)
+        with database.thread_connection(self.db_path) as conn:
+            rows = database.pdf_rows(conn)
+            doc_id, registered_hash = rows.get(filename, (None, None))
+            if doc_id is not None and registered_hash == pdf_hash:
+                if retry:
+                    self.prepare(path, retry)
+                return doc_id
+            same_content = [(other, other_doc_id) for other, (other_doc_id, other_hash) in rows.items()
+                            if other_hash == pdf_hash and other != filename]
+            if same_content and doc_id is None:
+                other, other_doc_id = same_content[0]
+                if os.path.exists(os.path.join(self.pdf_dir, other)):
+                    logging.info(f"{filename} has the content of {other} ({other_doc_id}), not registered")
+                    return None
+                # renamed, the row follows the file
+                doc_id = other_doc_id
+            database.upsert_pdf(conn, doc_id or filename[:-4], filename, pdf_hash)
+        doc_id = doc_id or filename[:-4]
+        self.prepare(path)
+        logging.info(f"registered {filename} as {doc_id}, {pdf_hash[:12]}")
+        return doc_id
+
+    def prepare(self, path, retry=False):
+        """Queue text extraction and Grobid, both keyed by the content hash, so each runs once per content."""
+        jobs.extract(path, self.queue, retry=retry)
+        jobs.grobid(os.path.basename(path), self.queue, retry=retry, priority=jobs.BACKGROUND, pdf_dir=self.pdf_dir)
+
+    def _register(self, path, retry=False):
+        try:
+            self.register(path, retry)
+        except Exception:
+            logging.exception(f"could not register {path}")
+
+    def scan(self):
+        """Register every PDF of the directory that is new or changed since the last run, retrying failed jobs."""
+        for filename in sorted(os.listdir(self.pdf_dir)):
+            if is_pdf(filename):
+                self._register(os.path.join(self.pdf_dir, filename), retry=True)
+
+    def run(self, poll=False, stop_event=None):
+        observer = (PollingObserver if poll else Observer)()
+        observer.schedule(self, self.pdf_dir, recursive=False)
+        observer.start()
+        self.scan()
+        logging.info(f"watching {self.pdf_dir}")
+        try:
+            while stop_event is None or not stop_event.is_set():
+                for path in self.settled():
+                    self._register(path)
+                time.sleep(SETTLE_SECONDS / 4)
+        finally:
+            observer.stop()
+            observer.join()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Register and prepare the PDFs copied into the PDF directory.')
+    parser.add_argument('--pdf-dir', default=PDF_DIR)
+    parser.add_argument('--workers', type=int, default=2, help='workers for the extraction and Grobid jobs')
+    parser.add_argument('--poll', action='store_true', help='poll the directory, for file systems without events')
+    args = parser.parse_args()
+
+    watcher = PdfWatcher(args.pdf_dir)
+    watcher.queue.start_workers(args.workers, kinds=['extract', 'grobid'])
+    watcher.run(args.poll)